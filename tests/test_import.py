@@ -0,0 +1,98 @@
+import io
+import json
+import os
+import tarfile
+
+import tripote_store
+from tripote_storage import StorageFull
+
+
+def title_for(rating):
+    return f"{rating} étoiles"
+
+
+def jsonl(*lines):
+    return io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+
+def line(**fields):
+    record = {'name': 'client', 'rating': 4, 'comment': 'avis', 'date': '01/07/2024 09:05'}
+    record.update(fields)
+    return json.dumps(record)
+
+
+def test_malformed_jsonl_lines_are_rejected_with_line_number(tmp_path):
+    path = str(tmp_path / 'reviews.json')
+    records = tripote_store.iter_jsonl(jsonl(line(), '{"name": "coupé', '', line(rating=9), line()))
+    stats = tripote_store.import_reviews(path, records, title_for)
+    assert (stats['imported'], stats['rejected'], stats['total']) == (2, 2, 2)
+    assert stats['errors'][0].startswith('enregistrement 2: ligne 2: JSON invalide')
+    assert 'entre 1 et 5' in stats['errors'][1]
+    assert len(list(tripote_store.iter_reviews_file(path))) == 2
+
+
+def test_imported_dates_are_normalised(tmp_path):
+    path = str(tmp_path / 'reviews.json')
+    tripote_store.import_reviews(path, tripote_store.iter_jsonl(jsonl(line(date='1/7/2024 9:05'))), title_for)
+    assert next(tripote_store.iter_reviews_file(path))['date'] == '01/07/2024 09:05'
+
+
+def tar_archive(reviews, images):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        members = [(tripote_store.TAR_REVIEWS_MEMBER, ''.join(review + '\n' for review in reviews).encode())]
+        members += [(f"images/{name}", data) for name, data in images.items()]
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+# Budget disque factice : retient les réservations et les fichiers ajoutés
+class RecordingStorage:
+    def __init__(self, free):
+        self.free = free
+        self.added_files = []
+
+    def reserve(self, size):
+        if size > self.free:
+            raise StorageFull("espace de stockage des photos plein")
+        self.free -= size
+
+    def added(self, path):
+        self.added_files.append(path)
+
+
+def test_tar_import_keeps_existing_photos(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = 'static/uploads'
+    os.makedirs(folder)
+    with open(os.path.join(folder, 'photo.jpg'), 'wb') as f:
+        f.write(b'ancienne')
+    storage = RecordingStorage(free=100)
+    archive = tar_archive([line(image='/static/uploads/photo.jpg'), line(image='/static/uploads/absente.jpg')],
+                          {'photo.jpg': b'nouvelle', 'orpheline.jpg': b'x'})
+    stats = tripote_store.import_tar('reviews.json', archive, title_for, folder, storage=storage)
+
+    assert (stats['imported'], stats['images']) == (2, 1)
+    with open(os.path.join(folder, 'photo.jpg'), 'rb') as f:
+        assert f.read() == b'ancienne'
+    image = next(tripote_store.iter_reviews_file('reviews.json'))['image'].lstrip('/')
+    assert image != os.path.join(folder, 'photo.jpg')
+    with open(image, 'rb') as f:
+        assert f.read() == b'nouvelle'
+    assert storage.added_files == [image]
+    # Ni fichier réservé pour l'image absente, ni image qu'aucun avis ne référence
+    assert sorted(os.listdir(folder)) == sorted(['photo.jpg', os.path.basename(image)])
+
+
+def test_tar_import_skips_photos_when_storage_is_full(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = 'static/uploads'
+    archive = tar_archive([line(image='/static/uploads/grande.jpg')], {'grande.jpg': b'x' * 50})
+    stats = tripote_store.import_tar('reviews.json', archive, title_for, folder, storage=RecordingStorage(free=10))
+    assert (stats['imported'], stats['images']) == (1, 0)
+    assert stats['errors'] == ['image grande.jpg: espace de stockage des photos plein']
+    assert os.listdir(folder) == []
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import tripote_jobs
+from tripote_jobs import JobQueue
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs'))
+    # Pas de threads : les tâches sont traitées à la main
+    queue._pid = os.getpid()
+    return queue
+
+
+def pending_job(jobs, job_id):
+    with open(jobs._path('pending', job_id)) as f:
+        return json.load(f)
+
+
+def make_due(jobs, job_id):
+    job = pending_job(jobs, job_id)
+    job['not_before'] = 0
+    jobs._write(jobs._path('pending', job_id), job)
+
+
+def test_retry_backoff_then_failed(jobs):
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        raise OSError("disque plein")
+
+    jobs.register('thumbnail', handler)
+    job_id = jobs.enqueue('thumbnail', {'image': 'a.jpg'})
+
+    jobs._process(job_id)
+    job = pending_job(jobs, job_id)
+    assert job['attempts'] == 1
+    assert job['not_before'] - time.time() == pytest.approx(tripote_jobs.RETRY_DELAY, abs=1)
+
+    # Pas encore l'heure du réessai : la tâche retourne en attente sans essai
+    jobs._process(job_id)
+    assert pending_job(jobs, job_id)['attempts'] == 1
+    assert len(calls) == 1
+
+    make_due(jobs, job_id)
+    jobs._process(job_id)
+    job = pending_job(jobs, job_id)
+    assert job['attempts'] == 2
+    assert job['not_before'] - time.time() == pytest.approx(tripote_jobs.RETRY_DELAY * 2, abs=1)
+
+    make_due(jobs, job_id)
+    jobs._process(job_id)
+    status = jobs.status(job_id)
+    assert status['state'] == 'failed'
+    assert status['error'] == 'OSError: disque plein'
+    assert os.listdir(os.path.join(jobs.directory, 'running')) == []
+
+
+def test_done_jobs_are_purged_after_ttl(jobs):
+    jobs.register('warm', lambda payload: None)
+    old_id, recent_id = jobs.enqueue_many([('warm', None), ('warm', None)])
+    jobs._process(old_id)
+    jobs._process(recent_id)
+    expired = time.time() - tripote_jobs.DONE_TTL - 1
+    os.utime(jobs._path('done', old_id), (expired, expired))
+    jobs._purge_done()
+    assert jobs.status(old_id) is None
+    assert jobs.status(recent_id)['state'] == 'done'
+
+
+def test_poisoned_job_files_are_moved_to_failed(jobs):
+    for job_id, content in (('sans-champs', {'id': 'sans-champs'}), ('liste', [])):
+        with open(jobs._path('pending', job_id), 'w') as f:
+            json.dump(content, f)
+    jobs._scan()
+    assert sorted(os.listdir(os.path.join(jobs.directory, 'failed'))) == ['liste.json', 'sans-champs.json']
+    assert os.listdir(os.path.join(jobs.directory, 'pending')) == []
+
+
+def test_scan_loop_survives_errors(jobs, monkeypatch):
+    class Stop(Exception):
+        pass
+
+    logged = []
+    jobs.log = logged.append
+    monkeypatch.setattr(jobs, '_scan', lambda: 1 / 0)
+
+    def sleep(seconds):
+        raise Stop
+
+    monkeypatch.setattr(tripote_jobs, 'time', SimpleNamespace(time=time.time, sleep=sleep))
+    with pytest.raises(Stop):
+        jobs._scan_loop()
+    assert 'ZeroDivisionError' in logged[0]
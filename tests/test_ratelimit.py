@@ -0,0 +1,81 @@
+import importlib
+import os
+
+import pytest
+
+import tripote_storage
+from tripote_ratelimit import SharedTokenBuckets
+
+
+def test_refund_gives_tokens_back(tmp_path):
+    buckets = SharedTokenBuckets(str(tmp_path / 'ratelimit.bin'), 2, 3600)
+    assert buckets.take('ip:1', now=0)[0]
+    assert buckets.take('ip:1', now=0)[0]
+    assert not buckets.take('ip:1', now=0)[0]
+    buckets.refund('ip:1', now=0)
+    assert buckets.take('ip:1', now=0)[0]
+    assert buckets.take('ip:2', now=0)[0]
+
+
+# Serveur importé dans un dossier temporaire (ses chemins sont relatifs), avec
+# 2 avis par heure et par client
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('serveur')
+    previous = os.getcwd()
+    saved = {name: os.environ.get(name) for name in ('TRIPOTE_SECRET_KEY', 'TRIPOTE_RATE_SUBMISSIONS')}
+    os.chdir(directory)
+    os.environ.pop('TRIPOTE_SECRET_KEY', None)
+    os.environ['TRIPOTE_RATE_SUBMISSIONS'] = '2/3600'
+    try:
+        yield importlib.import_module('tripote_visor_server')
+    finally:
+        os.chdir(previous)
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def test_secret_key_is_generated_per_install(server):
+    with open(server.SECRET_KEY_FILE) as f:
+        assert f.read().strip() == server.app.secret_key
+    assert server.app.secret_key not in server.PLACEHOLDER_SECRET_KEYS
+    assert os.stat(server.SECRET_KEY_FILE).st_mode & 0o077 == 0
+
+
+def test_placeholder_secret_key_is_refused(server, monkeypatch):
+    monkeypatch.setenv('TRIPOTE_SECRET_KEY', 'votre_cle_secrete_ici')
+    with pytest.raises(RuntimeError):
+        server.load_secret_key()
+
+
+def review(**fields):
+    return dict({'name': 'client', 'rating': '4', 'comment': 'très bien'}, **fields)
+
+
+def test_storage_full_does_not_consume_review_quota(server, monkeypatch):
+    def full(size):
+        raise tripote_storage.StorageFull("espace de stockage des photos plein")
+
+    monkeypatch.setattr(server.storage, 'reserve', full)
+    client = server.app.test_client()
+    headers = {'Accept': 'application/json'}
+    environ = {'REMOTE_ADDR': '10.0.0.1'}
+    photo = review(comment='x' * (server.TEXT_REVIEW_MAX_BYTES + 1))
+    for _ in range(3):
+        response = client.post('/add_review', data=photo, headers=headers, environ_base=environ)
+        assert response.status_code == 507
+    # Les refus faute de place sont rendus : le budget de 2 avis est intact
+    statuses = [client.post('/add_review', data=review(), headers=headers, environ_base=environ).status_code
+                for _ in range(3)]
+    assert statuses == [201, 201, 429]
+
+
+def test_upload_init_is_rate_limited(server):
+    client = server.app.test_client()
+    environ = {'REMOTE_ADDR': '10.0.0.2'}
+    statuses = [client.post('/uploads', json={'filename': 'photo.jpg', 'size': 10},
+                            environ_base=environ).status_code for _ in range(3)]
+    assert statuses == [201, 201, 429]
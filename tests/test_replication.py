@@ -0,0 +1,91 @@
+import io
+import urllib.error
+import urllib.parse
+from types import SimpleNamespace
+
+import pytest
+
+from tripote_replication import Follower, ResyncRequired, changes_payload
+from tripote_store import ReviewStore
+
+
+def review(n):
+    return {'name': f'client {n}', 'rating': 4, 'comment': f'avis {n}',
+            'date': '2024-07-01 09:05:00', 'title': 'Bien'}
+
+
+# Follower dont les requêtes HTTP sont servies directement par le stockage du writer
+class LocalFollower(Follower):
+    def __init__(self, writer, listing, before_fetch=None, batch=500):
+        super().__init__('http://writer', resolve=lambda slug: listing, batch=batch)
+        self.writer = writer
+        self.before_fetch = before_fetch or (lambda: None)
+        self.fetches = 0
+
+    def _get_json(self, url):
+        self.fetches += 1
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        since = int(query['since'][0])
+        try:
+            payload = changes_payload(self.writer, since, query.get('last', [None])[0], int(query['limit'][0]))
+        except ResyncRequired as e:
+            raise urllib.error.HTTPError(url, 409, str(e), {}, io.BytesIO(b'{}'))
+        self.before_fetch()
+        return payload
+
+
+@pytest.fixture
+def writer(tmp_path):
+    (tmp_path / 'writer').mkdir()
+    store = ReviewStore(str(tmp_path / 'writer' / 'reviews.json'))
+    store.save([review(n) for n in range(5)])
+    return store
+
+
+def local_listing(tmp_path):
+    (tmp_path / 'follower').mkdir(exist_ok=True)
+    return SimpleNamespace(store=ReviewStore(str(tmp_path / 'follower' / 'reviews.json')))
+
+
+def test_sync_applies_missing_reviews(tmp_path, writer):
+    listing = local_listing(tmp_path)
+    follower = LocalFollower(writer, listing, batch=2)
+    assert follower.sync() == 5
+    assert ReviewStore(listing.store.path).load() == writer.load()
+    assert follower.sync() == 0
+
+
+def test_batch_applied_by_another_worker_is_dropped(tmp_path, writer):
+    # Deux workers lisent le même lot ; le second l'applique pendant que le
+    # premier attend la réponse du writer
+    other = LocalFollower(writer, local_listing(tmp_path))
+    listing = local_listing(tmp_path)
+    ran = []
+
+    def other_worker_first():
+        if not ran:
+            ran.append(True)
+            other.sync()
+
+    follower = LocalFollower(writer, listing, before_fetch=other_worker_first)
+    assert follower.sync() == 0
+    assert len(ReviewStore(listing.store.path).load()) == 5
+    assert follower.fetches == 2
+
+
+def test_extend_expected_len_rejects_stale_batch(tmp_path):
+    store = ReviewStore(str(tmp_path / 'reviews.json'))
+    store.save([review(0)])
+    assert store.extend([review(1)], expected_len=1)
+    assert not store.extend([review(1)], expected_len=1)
+    assert len(ReviewStore(store.path).load()) == 2
+
+
+def test_resync_after_409(tmp_path, writer):
+    listing = local_listing(tmp_path)
+    listing.store.save([review(100), review(101)])
+    follower = LocalFollower(writer, listing)
+    assert follower.sync() == 5
+    assert ReviewStore(listing.store.path).load() == writer.load()
+    # 409, copie complète, puis plus rien à appliquer
+    assert follower.fetches == 3
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta, timezone
+
+from tripote_rollups import RatingRollups
+
+
+def review(date, rating=4):
+    return {'name': 'client', 'rating': rating, 'comment': 'avis', 'date': date, 'title': 'Bien'}
+
+
+def test_dates_are_parsed_and_unreadable_reviews_rejected(tmp_path):
+    rollups = RatingRollups(str(tmp_path / 'reviews.rollups.json'))
+    reviews = [
+        review('01/07/2024 09:05'),
+        review('1/7/2024 9:05'),
+        review('01/07/2024 09:40', rating=300),
+        review(None),
+        review('01/07/2024 10:15', rating=5),
+    ]
+    assert rollups.sync(reviews) == 5
+    assert rollups.counted() == 5
+    assert rollups.rejected() == 2
+    points = rollups.trend('hour', datetime(2024, 7, 1, 9), datetime(2024, 7, 1, 10))
+    # '1/7/2024 9:05' (import) tombe bien dans la tranche de 9 h
+    assert [point['count'] for point in points] == [2, 1]
+    assert points[1]['distribution'][5] == 1
+
+
+def test_trend_accepts_aware_datetimes(tmp_path):
+    rollups = RatingRollups(str(tmp_path / 'reviews.rollups.json'))
+    rollups.sync([review('01/07/2024 09:05')])
+    start = datetime(2024, 7, 1, 9, tzinfo=timezone(timedelta(hours=2))).astimezone()
+    points = rollups.trend('day', start, start + timedelta(hours=1))
+    assert sum(point['count'] for point in points) == 1
@@ -0,0 +1,59 @@
+import os
+import time
+
+import pytest
+
+from tripote_storage import StorageFull, StorageManager
+
+DAY = 24 * 3600
+
+
+def photo(path, size, served):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    # La date du dernier service est la date d'accès
+    os.utime(path, (served, served))
+    return path
+
+
+@pytest.fixture
+def photos(tmp_path):
+    now = time.time()
+    root = tmp_path / 'uploads'
+    return {
+        'old_thumb': photo(str(root / '.thumbs' / 'a.jpg'), 100, now - 2 * DAY),
+        'recent_thumb': photo(str(root / 'chalet' / '.thumbs' / 'b.jpg'), 100, now),
+        'cold': photo(str(root / 'vieille.jpg'), 1000, now - 90 * DAY),
+        'hot': photo(str(root / 'chalet' / 'recente.jpg'), 1000, now - DAY),
+    }
+
+
+def manager(tmp_path, **options):
+    return StorageManager(str(tmp_path / 'uploads'), min_free=0, cold_dir=str(tmp_path / 'froid'),
+                          cold_after=30 * DAY, **options)
+
+
+def test_derived_files_go_first_least_recently_served(tmp_path, photos):
+    result = manager(tmp_path).reclaim(100)
+    assert (result['evicted'], result['moved']) == (1, 0)
+    assert not os.path.exists(photos['old_thumb'])
+    assert all(os.path.exists(photos[name]) for name in ('recent_thumb', 'cold', 'hot'))
+
+
+def test_cold_originals_move_after_all_derived_files(tmp_path, photos):
+    storage = manager(tmp_path)
+    result = storage.reclaim(201)
+    assert (result['evicted'], result['moved'], result['freed']) == (2, 1, 1200)
+    assert not os.path.exists(photos['cold'])
+    assert storage.find_cold(photos['cold']) is not None
+    # Une photo servie récemment n'est jamais déplacée
+    assert os.path.exists(photos['hot'])
+
+
+def test_reserve_refuses_when_nothing_can_be_reclaimed(tmp_path, photos):
+    storage = manager(tmp_path, budget=2200)
+    storage.reserve(100)
+    with pytest.raises(StorageFull):
+        storage.reserve(2000)
+    assert os.path.exists(photos['hot'])
@@ -0,0 +1,64 @@
+import errno
+import os
+
+import pytest
+
+import tripote_uploads
+from tripote_uploads import ChunkedUploads, UploadError
+
+JPEG = b'\xff\xd8\xff' + b'photo'
+
+
+def finalized(uploads, owner, data):
+    upload_id = uploads.init('photo.jpg', len(data), owner, {'jpg'})['upload_id']
+    uploads.append(upload_id, owner, 0, data)
+    uploads.finalize(upload_id, owner)
+    return upload_id
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    os.makedirs(tmp_path / 'partial')
+    os.makedirs(tmp_path / 'photos')
+    return ChunkedUploads(str(tmp_path / 'partial'), max_size=1024)
+
+
+def test_same_name_in_the_same_second_is_not_overwritten(tmp_path, uploads):
+    first = finalized(uploads, 'invité-1', JPEG + b'1')
+    second = finalized(uploads, 'invité-2', JPEG + b'2')
+    folder = str(tmp_path / 'photos')
+    names = [uploads.claim(first, 'invité-1', folder), uploads.claim(second, 'invité-2', folder)]
+    assert names[0] != names[1]
+    assert all(name.endswith('_photo.jpg') for name in names)
+    contents = []
+    for name in names:
+        with open(os.path.join(folder, name), 'rb') as f:
+            contents.append(f.read())
+    assert contents == [JPEG + b'1', JPEG + b'2']
+    assert os.listdir(tmp_path / 'partial') == []
+
+
+def test_claim_twice_is_refused(tmp_path, uploads):
+    upload_id = finalized(uploads, 'invité', JPEG)
+    uploads.claim(upload_id, 'invité', str(tmp_path / 'photos'))
+    with pytest.raises(UploadError) as error:
+        uploads.claim(upload_id, 'invité', str(tmp_path / 'photos'))
+    assert error.value.status in (404, 409)
+
+
+def test_claim_across_filesystems_copies(tmp_path, uploads, monkeypatch):
+    upload_id = finalized(uploads, 'invité', JPEG)
+    link = os.link
+
+    # Premier lien refusé comme entre deux systèmes de fichiers
+    def cross_device_link(source, target):
+        if source.endswith('.claimed.part'):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        link(source, target)
+
+    monkeypatch.setattr(tripote_uploads.os, 'link', cross_device_link)
+    name = uploads.claim(upload_id, 'invité', str(tmp_path / 'photos'))
+    assert os.listdir(tmp_path / 'photos') == [name]
+    with open(tmp_path / 'photos' / name, 'rb') as f:
+        assert f.read() == JPEG
+    assert os.listdir(tmp_path / 'partial') == []
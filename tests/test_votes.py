@@ -0,0 +1,79 @@
+import sys
+import threading
+
+import pytest
+
+from tripote_votes import StoredVotes, VoteCounter
+
+
+def test_votes_survive_flush_and_keep_order(tmp_path):
+    path = str(tmp_path / 'reviews.votes')
+    counter = VoteCounter(path)
+    for guest in range(3):
+        assert counter.vote(2, f"invité-{guest}")
+    assert counter.vote(0, 'invité-0')
+    assert not counter.vote(2, 'invité-0')
+
+    assert counter.flush() == 2
+    assert (counter.count(0), counter.count(1), counter.count(2)) == (1, 0, 3)
+    assert list(counter.ordered(4)) == [2, 0, 1, 3]
+    assert StoredVotes(path).count(2) == 3
+
+
+def test_votes_of_other_workers_are_reindexed(tmp_path):
+    path = str(tmp_path / 'reviews.votes')
+    first, second = VoteCounter(path), VoteCounter(path)
+    first.vote(0, 'a')
+    first.flush()
+    for guest in 'abc':
+        second.vote(1, guest)
+    second.flush()
+    first.flush()
+    assert first.count(1) == 3
+    assert first.top() == [(1, 3), (0, 1)]
+
+
+# Changer de thread très souvent pour tomber au milieu d'une écriture
+@pytest.fixture
+def frequent_switches():
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(previous)
+
+
+def test_votes_during_flush_are_counted_once(tmp_path, frequent_switches):
+    counter = VoteCounter(str(tmp_path / 'reviews.votes'))
+    total = 3000
+    accepted = []
+    done = threading.Event()
+    errors = []
+
+    def vote():
+        for guest in range(total):
+            accepted.append(counter.vote(0, f"invité-{guest}"))
+        done.set()
+
+    def flush():
+        while not done.is_set():
+            counter.flush()
+
+    def read():
+        seen = 0
+        while not done.is_set():
+            count = counter.count(0)
+            # Un vote perdu ou compté deux fois ferait reculer ou bondir le compteur
+            if count < seen or count > total:
+                errors.append((seen, count))
+            seen = count
+
+    threads = [threading.Thread(target=target) for target in (vote, flush, read)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.flush()
+
+    assert errors == []
+    assert counter.count(0) == sum(accepted)
+    assert counter.top() == [(0, sum(accepted))]
@@ -0,0 +1,128 @@
+# tripote_analytics.py
+# Statistiques détaillées des notes : médiane, écart-type, percentiles, moyenne
+# bayésienne, intervalle de confiance et moyennes glissantes.
+#
+# Tout est calculé sur la colonne des notes (snapshot, colonnes compactes ou
+# liste d'avis), avec NumPy s'il est installé. Les notes allant de 1 à 5, la
+# médiane, l'écart-type et les percentiles se déduisent de l'histogramme (5
+# cases) : seuls le comptage et les moyennes glissantes parcourent les notes.
+import math
+from array import array
+from functools import lru_cache
+
+RATINGS = (1, 2, 3, 4, 5)
+PERCENTILES = (10, 25, 50, 75, 90)
+# Moyennes sur les N derniers avis
+WINDOWS = (10, 50, 100)
+# Moyenne bayésienne : note a priori et poids (en nombre d'avis fictifs)
+DEFAULT_PRIOR_MEAN = 3.5
+DEFAULT_PRIOR_WEIGHT = 10
+# Quantile de la loi normale pour un intervalle de confiance à 95 %
+Z_95 = 1.96
+
+
+# NumPy, importé au premier calcul (None s'il n'est pas installé)
+@lru_cache(maxsize=1)
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# Notes sous forme de tampon d'octets, sans reconstruire les avis si possible
+# (colonne du snapshot ou des colonnes compactes, lue sans copie)
+def rating_array(reviews):
+    ratings = getattr(reviews, 'ratings', None)
+    if callable(ratings):
+        return ratings()
+    return array('b', (review['rating'] for review in reviews))
+
+
+# Valeur d'indice `k` dans les notes triées, d'après les effectifs cumulés
+def _sorted_value(cumulative, k):
+    for rating, total in zip(RATINGS, cumulative):
+        if k < total:
+            return rating
+    return RATINGS[-1]
+
+
+# Percentile avec interpolation linéaire (même définition que numpy.percentile)
+def _percentile(cumulative, count, p):
+    position = p / 100 * (count - 1)
+    lower = math.floor(position)
+    low, high = _sorted_value(cumulative, lower), _sorted_value(cumulative, math.ceil(position))
+    return low + (high - low) * (position - lower)
+
+
+def _histogram(ratings):
+    np = _numpy()
+    if np is not None:
+        values = np.frombuffer(ratings, dtype=np.int8)
+        counts = np.bincount(values, minlength=6)[1:6]
+        # Les notes hors de 1..5 éventuelles ne sont pas comptées
+        return [int(count) for count in counts], values
+    data = bytes(ratings)
+    return [data.count(rating) for rating in RATINGS], None
+
+
+# Moyennes des N derniers avis (None si moins de N avis)
+def _windows(ratings, values, windows):
+    result = {}
+    for window in windows:
+        if len(ratings) < window:
+            result[window] = None
+        elif values is not None:
+            result[window] = round(float(values[-window:].mean()), 2)
+        else:
+            result[window] = round(sum(ratings[-window:]) / window, 2)
+    return result
+
+
+def rating_analytics(reviews, prior_mean=DEFAULT_PRIOR_MEAN, prior_weight=DEFAULT_PRIOR_WEIGHT,
+                     windows=WINDOWS):
+    ratings = rating_array(reviews)
+    counts, values = _histogram(ratings)
+    count = sum(counts)
+    total = sum(rating * c for rating, c in zip(RATINGS, counts))
+    bayesian = (prior_mean * prior_weight + total) / (prior_weight + count) if prior_weight + count else None
+    result = {
+        'count': count,
+        'counts': dict(zip(RATINGS, counts)),
+        'mean': None,
+        'median': None,
+        'std': None,
+        'percentiles': {p: None for p in PERCENTILES},
+        'bayesian_average': round(bayesian, 2) if bayesian is not None else None,
+        'confidence_interval': None,
+        'windows': _windows(ratings, values, windows),
+        'prior': {'mean': prior_mean, 'weight': prior_weight},
+    }
+    if not count:
+        return result
+
+    mean = total / count
+    # Écart-type de l'échantillon (n - 1), sur l'histogramme
+    variance = sum(c * (r - mean) ** 2 for r, c in zip(RATINGS, counts)) / (count - 1) if count > 1 else 0.0
+    std = math.sqrt(variance)
+    cumulative = []
+    running = 0
+    for c in counts:
+        running += c
+        cumulative.append(running)
+    margin = Z_95 * std / math.sqrt(count)
+
+    result.update({
+        'mean': round(mean, 2),
+        'median': _percentile(cumulative, count, 50),
+        'std': round(std, 3),
+        'percentiles': {p: round(_percentile(cumulative, count, p), 2) for p in PERCENTILES},
+        'confidence_interval': [round(max(mean - margin, 1.0), 2), round(min(mean + margin, 5.0), 2)],
+    })
+    return result
+
+
+# Même calcul pour plusieurs ensembles d'avis (ex: tous les lieux chargés)
+def batch_analytics(named_reviews, **options):
+    return {name: rating_analytics(reviews, **options) for name, reviews in named_reviews.items()}
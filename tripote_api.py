@@ -0,0 +1,90 @@
+# tripote_api.py
+# API JSON en lecture (avis paginés, statistiques). Les réponses sont
+# sérialisées une seule fois par version du stockage et gardées en cache.
+import hashlib
+import itertools
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+CACHE_ENTRIES = 512
+
+
+# Sérialiser en JSON (orjson s'il est installé, bien plus rapide)
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# Version du stockage, dérivée de la signature de son fichier
+def store_version(store):
+    signature = store.signature()
+    return hashlib.blake2b(repr((store.path, signature)).encode(), digest_size=8).hexdigest()
+
+
+# `votes` (tripote_votes.VoteCounter) : avis les plus utiles d'abord, avec leur nombre de votes
+def reviews_payload(store, page, per_page, votes=None):
+    reviews = store.load()
+    total = len(reviews)
+    start = (page - 1) * per_page
+    items = []
+    if votes is None:
+        for index, review in enumerate(reviews[start:start + per_page], start=start):
+            items.append(dict(review, id=index))
+    else:
+        for review_id in itertools.islice(votes.ordered(total), start, start + per_page):
+            items.append(dict(reviews[review_id], id=review_id, helpful=votes.count(review_id)))
+    return {
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': (total + per_page - 1) // per_page,
+        'reviews': items,
+    }
+
+
+def stats_payload(store):
+    return store.stats()
+
+
+# Cache LRU des réponses déjà sérialisées : (ETag, corps)
+class ResponseCache:
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Réponse pour `kind`/`params`, construite par `build()` si absente du cache
+    def get(self, store, kind, params, build):
+        version = store_version(store)
+        key = (store.path, kind, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1], entry[2]
+        body = dumps(build())
+        etag = f"{version}-{hashlib.blake2b(repr((kind, params)).encode(), digest_size=4).hexdigest()}"
+        with self._lock:
+            self._entries[key] = (version, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
+
+    # Nombre de réponses gardées et taille de leurs corps
+    def usage(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': sum(len(entry[2]) for entry in self._entries.values()),
+            }
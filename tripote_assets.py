@@ -0,0 +1,186 @@
+# tripote_assets.py
+# Copies locales de Font Awesome et des photos de la galerie, pour que la page
+# se charge sans accès à Internet. Les fichiers produits portent un hachage de
+# leur contenu dans leur nom et peuvent donc être mis en cache indéfiniment.
+import hashlib
+import json
+import os
+import re
+import shutil
+import urllib.request
+from io import BytesIO
+
+FONT_AWESOME_BASE = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0'
+FONT_AWESOME_CSS = f'{FONT_AWESOME_BASE}/css/all.min.css'
+# Police et graisse de chaque style utilisé par le template (fas / far)
+FONT_AWESOME_FONTS = {
+    'solid': ('webfonts/fa-solid-900.woff2', 900),
+    'regular': ('webfonts/fa-regular-400.woff2', 400),
+}
+
+UNSPLASH_QUERY = ('ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D'
+                  '&auto=format&fit=crop&q=80')
+# Photos de la galerie : identifiant Unsplash et largeurs produites
+GALLERY_IMAGES = {
+    'main-photo': ('photo-1522708323590-d24dbb6b0267', (800, 1200)),
+    'photo-2': ('photo-1584622650111-993a426fbf0a', (400, 600)),
+    'photo-3': ('photo-1560448204-e02f11c3d0e2', (400, 600)),
+    'photo-4': ('photo-1567767292278-a4f21aa2d36e', (400, 600)),
+    'photo-5': ('photo-1616594039964-ae902f0c1497', (400, 600)),
+}
+
+MANIFEST = 'manifest.json'
+
+# Classes qui ne sont pas des icônes
+NOT_ICONS = {'fa-solid', 'fa-regular', 'fa-brands'}
+
+ICON_RULE = re.compile(r'([^{}]+)\{content:"\\([0-9a-f]+)"\}')
+ICON_SELECTOR = re.compile(r'^\.(fa-[a-z0-9-]+):{1,2}before$')
+
+BASE_CSS = """\
+.fa,.fas,.far,.fa-solid,.fa-regular{-moz-osx-font-smoothing:grayscale;-webkit-font-smoothing:antialiased;\
+display:var(--fa-display,inline-block);font-style:normal;font-variant:normal;line-height:1;text-rendering:auto}
+.fa,.fas,.fa-solid{font-family:"Font Awesome 6 Free";font-weight:900}
+.far,.fa-regular{font-family:"Font Awesome 6 Free";font-weight:400}
+"""
+
+
+# URL Unsplash d'une photo de la galerie à une largeur donnée
+def unsplash_url(name, width):
+    photo_id, _ = GALLERY_IMAGES[name]
+    return f'https://images.unsplash.com/{photo_id}?{UNSPLASH_QUERY}&w={width}'
+
+
+# URL d'origine (CDN) d'une ressource, utilisée tant qu'elle n'est pas copiée
+def cdn_url(name, width=None):
+    if name == 'font-awesome.css':
+        return FONT_AWESOME_CSS
+    return unsplash_url(name, width)
+
+
+def manifest_key(name, width=None):
+    return f'{name}@{width}' if width else name
+
+
+def load_manifest(vendor_dir):
+    try:
+        with open(os.path.join(vendor_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def fetch(url):
+    request = urllib.request.Request(url, headers={'User-Agent': 'tripote-visor'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+# Icônes Font Awesome utilisées dans un texte (template, fiches des lieux)
+def used_icons(*texts):
+    icons = set()
+    for text in texts:
+        icons.update(re.findall(r'fa-[a-z0-9-]+', text))
+    return icons - NOT_ICONS
+
+
+# Point de code de chaque icône, lu dans la feuille de style Font Awesome
+def icon_codepoints(css):
+    codepoints = {}
+    for selectors, code in ICON_RULE.findall(css):
+        for selector in selectors.split(','):
+            match = ICON_SELECTOR.match(selector.strip())
+            if match:
+                codepoints[match.group(1)] = int(code, 16)
+    return codepoints
+
+
+# Écrire `data` sous un nom contenant son hachage ; renvoie le chemin relatif
+def write_hashed(vendor_dir, relative_path, data):
+    stem, extension = os.path.splitext(relative_path)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    hashed = f'{stem}-{digest}{extension}'
+    path = os.path.join(vendor_dir, hashed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return hashed.replace(os.sep, '/')
+
+
+# Garder seulement les glyphes utilisés (nécessite fontTools, sinon la police
+# complète est copiée)
+def subset_font(data, codepoints, log):
+    try:
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        log("fontTools absent : polices copiées sans sous-ensemble (pip install fonttools brotli)")
+        return data
+    font = TTFont(BytesIO(data))
+    options = subset.Options()
+    options.flavor = 'woff2'
+    options.layout_features = ['*']
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=sorted(codepoints))
+    subsetter.subset(font)
+    out = BytesIO()
+    font.save(out)
+    return out.getvalue()
+
+
+# Redimensionner une photo à une largeur donnée (JPEG progressif)
+def resize_image(data, width):
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert('RGB')
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+        out = BytesIO()
+        image.save(out, format='JPEG', quality=80, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+# Copier toutes les ressources externes dans `vendor_dir` et écrire le manifeste
+def vendor_assets(vendor_dir, icon_texts, fetch=fetch, log=print):
+    staging = vendor_dir + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    manifest = {}
+
+    css = fetch(FONT_AWESOME_CSS).decode('utf-8')
+    codepoints = icon_codepoints(css)
+    icons = used_icons(*icon_texts)
+    missing = sorted(icon for icon in icons if icon not in codepoints)
+    if missing:
+        log(f"icônes introuvables dans Font Awesome : {', '.join(missing)}")
+    icons = sorted(icon for icon in icons if icon in codepoints)
+    wanted = {codepoints[icon] for icon in icons}
+
+    rules = [BASE_CSS]
+    for style, (font_path, weight) in FONT_AWESOME_FONTS.items():
+        data = subset_font(fetch(f'{FONT_AWESOME_BASE}/{font_path}'), wanted, log)
+        font_file = write_hashed(staging, f'fonts/fa-{style}-{weight}.woff2', data)
+        rules.append('@font-face{font-family:"Font Awesome 6 Free";font-style:normal;'
+                     f'font-weight:{weight};font-display:block;src:url({font_file}) format("woff2")}}\n')
+        log(f"{font_file} : {len(data) // 1024} Ko")
+    for icon in icons:
+        rules.append(f'.{icon}:before{{content:"\\{codepoints[icon]:x}"}}\n')
+    manifest[manifest_key('font-awesome.css')] = write_hashed(staging, 'font-awesome.css',
+                                                              ''.join(rules).encode('utf-8'))
+    log(f"Font Awesome : {len(icons)} icônes")
+
+    for name, (_, widths) in GALLERY_IMAGES.items():
+        original = fetch(unsplash_url(name, max(widths)))
+        for width in widths:
+            data = resize_image(original, width)
+            manifest[manifest_key(name, width)] = write_hashed(staging, f'img/{name}-{width}.jpg', data)
+            log(f"{manifest[manifest_key(name, width)]} : {len(data) // 1024} Ko")
+
+    with open(os.path.join(staging, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=4)
+    # Remplacer l'ancienne copie d'un coup
+    shutil.rmtree(vendor_dir, ignore_errors=True)
+    os.replace(staging, vendor_dir)
+    return manifest
@@ -0,0 +1,197 @@
+# tripote_columns.py
+# Avis gardés en mémoire sous forme de colonnes de largeur fixe plutôt qu'en
+# dictionnaires : à grande échelle, le coût d'un dict et de ses chaînes par avis
+# domine la mémoire du worker.
+#
+#   ratings     array('b')   note de chaque avis
+#   minutes     array('i')   date, en minutes depuis le 01/01/1970
+#   offsets     array('Q')   début du nom et du commentaire dans `text`
+#   text        bytearray    noms et commentaires en UTF-8, bout à bout
+#   titles      array('i')   indice du titre dans la table des chaînes partagées
+#   images      array('i')   indice du chemin de la photo (-1 : pas de photo)
+#   nulls       array('B')   NULL_NAME / NULL_COMMENT : nom ou commentaire absent
+#                            (None, à ne pas confondre avec une chaîne vide)
+#
+# Les avis se lisent comme une liste (len, index, tranches, itération) et sont
+# rendus sous forme de dict à la demande : c'est une source directe pour les
+# statistiques, la pagination et le template.
+#
+# Les lectures se font sans verrou pendant qu'un avis est ajouté : `ratings`
+# donne la longueur et n'est allongée qu'en dernier, une fois toutes les
+# autres colonnes prêtes.
+import sys
+from array import array
+from datetime import date
+
+REVIEW_FIELDS = ('name', 'rating', 'comment', 'title', 'date', 'image')
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Date absente ou dans un autre format (gardée telle quelle à part)
+NO_DATE = -2 ** 31
+NO_STRING = -1
+NULL_NAME = 1
+NULL_COMMENT = 2
+
+
+# 'JJ/MM/AAAA HH:MM' -> minutes depuis 1970 (None si le format ne correspond pas)
+def date_to_minutes(value):
+    if not isinstance(value, str) or len(value) != 16 or value[2] != '/' or value[5] != '/' \
+            or value[10] != ' ' or value[13] != ':':
+        return None
+    try:
+        days = date(int(value[6:10]), int(value[3:5]), int(value[0:2])).toordinal() - EPOCH_ORDINAL
+        hours, minutes = int(value[11:13]), int(value[14:16])
+    except ValueError:
+        return None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        return None
+    return days * 1440 + hours * 60 + minutes
+
+
+def minutes_to_date(value):
+    day = date.fromordinal(EPOCH_ORDINAL + value // 1440)
+    return f"{day.day:02d}/{day.month:02d}/{day.year} {value % 1440 // 60:02d}:{value % 60:02d}"
+
+
+class ColumnarReviews:
+    def __init__(self):
+        self._ratings = array('b')
+        self._minutes = array('i')
+        self._offsets = array('Q', [0])
+        self._text = bytearray()
+        self._titles = array('i')
+        self._images = array('i')
+        self._nulls = array('B')
+        # Chaînes partagées (titres, chemins des photos) et leur indice
+        self._strings = []
+        self._string_ids = {}
+        self._strings_size = 0
+        # Valeurs qui ne tiennent pas dans les colonnes, par indice d'avis
+        self._extras = {}
+
+    @classmethod
+    def from_reviews(cls, reviews):
+        columns = cls()
+        for review in reviews:
+            columns.append(review)
+        return columns
+
+    def _intern(self, value):
+        if value is None:
+            return NO_STRING
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+            self._strings_size += sys.getsizeof(value)
+        return string_id
+
+    # Texte d'un nom ou d'un commentaire ; (texte, drapeau NULL_*) si absent
+    @staticmethod
+    def _text_value(key, value, null_flag, extras):
+        if isinstance(value, str):
+            return value.encode('utf-8'), 0
+        if value is None:
+            return b'', null_flag
+        extras[key] = value
+        return b'', 0
+
+    # Ajouter un avis (dict) à la fin des colonnes
+    def append(self, review):
+        index = len(self._ratings)
+        extras = {key: value for key, value in review.items() if key not in REVIEW_FIELDS}
+
+        rating = review.get('rating')
+        if not (isinstance(rating, int) and not isinstance(rating, bool) and -128 <= rating <= 127):
+            extras['rating'] = rating
+            rating = 0
+
+        minutes = date_to_minutes(review.get('date'))
+        if minutes is None:
+            minutes = NO_DATE
+            extras['date'] = review.get('date')
+
+        name, null_name = self._text_value('name', review.get('name'), NULL_NAME, extras)
+        comment, null_comment = self._text_value('comment', review.get('comment'), NULL_COMMENT, extras)
+
+        title, image = review.get('title'), review.get('image')
+        if title is not None and not isinstance(title, str):
+            extras['title'] = title
+        if image is not None and not isinstance(image, str):
+            extras['image'] = image
+
+        # Toutes les colonnes sauf `ratings`, puis `ratings`, qui rend l'avis visible
+        self._text += name
+        self._offsets.append(len(self._text))
+        self._text += comment
+        self._offsets.append(len(self._text))
+        self._minutes.append(minutes)
+        self._titles.append(self._intern(title if isinstance(title, str) else None))
+        self._images.append(self._intern(image if isinstance(image, str) else None))
+        self._nulls.append(null_name | null_comment)
+        if extras:
+            self._extras[index] = extras
+        self._ratings.append(rating)
+
+    def __len__(self):
+        return len(self._ratings)
+
+    def __bool__(self):
+        return len(self._ratings) > 0
+
+    def _review(self, index):
+        offsets = self._offsets
+        start, middle, end = offsets[2 * index], offsets[2 * index + 1], offsets[2 * index + 2]
+        minutes = self._minutes[index]
+        title, image, nulls = self._titles[index], self._images[index], self._nulls[index]
+        review = {
+            'name': None if nulls & NULL_NAME else self._text[start:middle].decode('utf-8'),
+            'rating': self._ratings[index],
+            'comment': None if nulls & NULL_COMMENT else self._text[middle:end].decode('utf-8'),
+            'title': self._strings[title] if title != NO_STRING else None,
+            'date': minutes_to_date(minutes) if minutes != NO_DATE else None,
+            'image': self._strings[image] if image != NO_STRING else None,
+        }
+        extras = self._extras.get(index)
+        if extras:
+            review.update(extras)
+        return review
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._review(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._review(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._review(index)
+
+    def __reversed__(self):
+        for index in range(len(self) - 1, -1, -1):
+            yield self._review(index)
+
+    # Colonne des notes, lue sans reconstruire les avis (à ne pas modifier :
+    # une memoryview empêcherait les ajouts suivants)
+    def ratings(self):
+        return self._ratings
+
+    # Mémoire occupée par les colonnes, les chaînes partagées et les valeurs à part
+    def memory_size(self):
+        size = sys.getsizeof(self)
+        for column in (self._ratings, self._minutes, self._offsets, self._text, self._titles, self._images,
+                       self._nulls):
+            size += sys.getsizeof(column)
+        size += sys.getsizeof(self._strings) + sys.getsizeof(self._string_ids)
+        size += self._strings_size
+        size += sys.getsizeof(self._extras)
+        for extras in self._extras.values():
+            size += sys.getsizeof(extras) + sum(sys.getsizeof(value) for value in extras.values())
+        return size
+
+    # Octets par avis (colonnes comprises)
+    def memory_per_review(self):
+        return self.memory_size() / len(self) if self else 0
@@ -0,0 +1,302 @@
+# tripote_jobs.py
+# File de tâches en arrière-plan : la soumission d'un avis n'écrit que l'avis
+# et confie le reste (agrégats, caches, miniatures) à un petit pool de threads.
+#
+# Les tâches sont persistées sur le disque pour survivre à un redémarrage :
+#   <directory>/pending/<id>.json          en attente (avec date de réessai)
+#   <directory>/running/<pid>.<id>.json    prise par un worker (renommage atomique,
+#                                          une seule copie du serveur la prend)
+#   <directory>/done/<id>.json             terminée (purgée après DONE_TTL)
+#   <directory>/failed/<id>.json           abandonnée après max_attempts essais
+#
+# Les tâches d'un même avis sont écrites ensemble, avec un seul fsync (celui du
+# dossier pending) : l'avis lui-même est l'écriture durable, ses tâches ne font
+# que recalculer ce qui en dérive. Un fichier de tâche tronqué par une coupure
+# de courant est classé en échec au lieu de bloquer la file, de même qu'un
+# fichier lisible mais sans les champs attendus.
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import traceback
+
+STATES = ('pending', 'running', 'done', 'failed')
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUE = 1000
+DEFAULT_MAX_ATTEMPTS = 3
+# Délai avant réessai : RETRY_DELAY * 2^(essai - 1)
+RETRY_DELAY = 2
+# Intervalle de relecture du dossier pending (tâches d'autres workers, réessais)
+SCAN_INTERVAL = 5
+DONE_TTL = 3600
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, directory, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, log=None):
+        self.directory = directory
+        self.workers = workers
+        self.handlers = {}
+        self.log = log or (lambda message: None)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._threads = []
+        for state in STATES:
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+    # Enregistrer la fonction qui traite les tâches `name` : handler(payload)
+    def register(self, name, handler):
+        self.handlers[name] = handler
+
+    def _path(self, state, job_id, pid=None):
+        filename = f"{pid}.{job_id}.json" if pid else f"{job_id}.json"
+        return os.path.join(self.directory, state, filename)
+
+    @staticmethod
+    def _write(path, job, sync=True):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _sync_dir(self, state):
+        fd = os.open(os.path.join(self.directory, state), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # Ajouter une tâche ; elle est écrite sur le disque avant d'être mise en file
+    def enqueue(self, name, payload=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        return self.enqueue_many([(name, payload)], max_attempts=max_attempts)[0]
+
+    # Ajouter plusieurs tâches [(nom, payload), ...] en une seule écriture durable
+    def enqueue_many(self, tasks, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        tasks = list(tasks)
+        for name, _ in tasks:
+            if name not in self.handlers:
+                raise KeyError(f"tâche inconnue: {name}")
+        self.start()
+        jobs = [{
+            'id': f"{int(time.time() * 1000):013d}-{secrets.token_hex(4)}",
+            'name': name,
+            'payload': payload or {},
+            'attempts': 0,
+            'max_attempts': max_attempts,
+            'not_before': 0,
+            'created': time.time(),
+            'error': None,
+        } for name, payload in tasks]
+        for job in jobs:
+            self._write(self._path('pending', job['id']), job, sync=False)
+        if jobs:
+            self._sync_dir('pending')
+        # Si la file est pleine, les tâches restent sur le disque et seront reprises au prochain scan
+        for job in jobs:
+            self._put(job['id'])
+        return [job['id'] for job in jobs]
+
+    # Mettre une tâche en file (une seule fois) ; False si la file est pleine
+    def _put(self, job_id):
+        with self._lock:
+            if job_id in self._queued:
+                return True
+            try:
+                self._queue.put_nowait(job_id)
+            except queue.Full:
+                return False
+            self._queued.add(job_id)
+            return True
+
+    # Démarrer les threads (à nouveau si le processus a été forké)
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queued.clear()
+            self._recover()
+            self._threads = [threading.Thread(target=self._run, name=f"tripote-job-{i}", daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            threading.Thread(target=self._scan_loop, name="tripote-job-scan", daemon=True).start()
+
+    # Remettre en attente les tâches prises par un processus qui n'existe plus.
+    # Au démarrage, aucune tâche n'a encore été prise par ce processus : celles
+    # qui portent son pid viennent d'un processus précédent qui avait le même.
+    def _recover(self):
+        running_dir = os.path.join(self.directory, 'running')
+        for filename in os.listdir(running_dir):
+            pid, _, rest = filename.partition('.')
+            if not rest.endswith('.json') or not pid.isdigit():
+                continue
+            if int(pid) != os.getpid() and _pid_alive(int(pid)):
+                continue
+            try:
+                os.rename(os.path.join(running_dir, filename), self._path('pending', rest[:-len('.json')]))
+            except FileNotFoundError:
+                pass
+
+    # Relire régulièrement le dossier pending
+    # Une erreur imprévue (disque, fichier étrange) est journalisée sans
+    # arrêter la relecture des tâches
+    def _scan_loop(self):
+        while True:
+            try:
+                self._scan()
+                self._purge_done()
+            except Exception:
+                self.log(traceback.format_exc())
+            time.sleep(SCAN_INTERVAL)
+
+    def _scan(self):
+        now = time.time()
+        pending_dir = os.path.join(self.directory, 'pending')
+        for filename in sorted(os.listdir(pending_dir)):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(pending_dir, filename)
+            try:
+                with open(path, 'r') as f:
+                    job = json.load(f)
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                self._discard_unreadable(path, filename, now)
+                continue
+            try:
+                due = job['not_before'] <= now
+                job_id = job['id']
+            except (KeyError, TypeError) as e:
+                self._discard_poisoned(path, filename, e)
+                continue
+            if not due:
+                continue
+            if not self._put(job_id):
+                return
+
+    # Fichier de tâche illisible (écriture interrompue) : classé en échec une
+    # fois qu'il ne peut plus s'agir d'une écriture en cours
+    def _discard_unreadable(self, path, filename, now):
+        try:
+            if now - os.path.getmtime(path) < SCAN_INTERVAL:
+                return
+            os.rename(path, os.path.join(self.directory, 'failed', filename))
+        except FileNotFoundError:
+            return
+        self.log(f"tâche {filename} illisible, classée en échec")
+
+    # Fichier de tâche complet mais sans les champs attendus : classé en échec
+    def _discard_poisoned(self, path, filename, error):
+        try:
+            os.rename(path, os.path.join(self.directory, 'failed', filename))
+        except FileNotFoundError:
+            return
+        self.log(f"tâche {filename} invalide ({type(error).__name__}: {error}), classée en échec")
+
+    def _purge_done(self):
+        done_dir = os.path.join(self.directory, 'done')
+        limit = time.time() - DONE_TTL
+        for filename in os.listdir(done_dir):
+            path = os.path.join(done_dir, filename)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                self._queued.discard(job_id)
+            try:
+                self._process(job_id)
+            except Exception:
+                self.log(traceback.format_exc())
+
+    def _process(self, job_id):
+        running_path = self._path('running', job_id, pid=os.getpid())
+        try:
+            # Le renommage est atomique : un seul worker obtient la tâche
+            os.rename(self._path('pending', job_id), running_path)
+        except FileNotFoundError:
+            return
+        try:
+            with open(running_path, 'r') as f:
+                job = json.load(f)
+            due = job['not_before'] <= time.time()
+            last_attempt = job['attempts'] + 1 >= job['max_attempts']
+        except (ValueError, KeyError, TypeError) as e:
+            self._discard_poisoned(running_path, f"{job_id}.json", e)
+            return
+        if not due:
+            os.rename(running_path, self._path('pending', job_id))
+            return
+
+        job['attempts'] += 1
+        job['started'] = time.time()
+        try:
+            self.handlers[job['name']](job['payload'])
+        except Exception as e:
+            job['error'] = f"{type(e).__name__}: {e}"
+            if last_attempt:
+                self.log(f"tâche {job['name']} {job_id} abandonnée : {job['error']}")
+                self._write(self._path('failed', job_id), job)
+            else:
+                job['not_before'] = time.time() + RETRY_DELAY * 2 ** (job['attempts'] - 1)
+                self._write(self._path('pending', job_id), job)
+        else:
+            job['error'] = None
+            job['finished'] = time.time()
+            self._write(self._path('done', job_id), job)
+        os.unlink(running_path)
+
+    # État d'une tâche (None si inconnue ou purgée)
+    def status(self, job_id):
+        running_dir = os.path.join(self.directory, 'running')
+        paths = [('pending', self._path('pending', job_id))]
+        paths += [('running', os.path.join(running_dir, filename)) for filename in os.listdir(running_dir)
+                  if filename.endswith(f".{job_id}.json")]
+        paths += [('done', self._path('done', job_id)), ('failed', self._path('failed', job_id))]
+        for state, path in paths:
+            try:
+                with open(path, 'r') as f:
+                    return dict(json.load(f), state=state)
+            except (FileNotFoundError, ValueError):
+                continue
+        return None
+
+    # Nombre de tâches par état et dernières erreurs
+    def summary(self, failed_limit=20):
+        counts = {}
+        for state in STATES:
+            counts[state] = sum(1 for f in os.listdir(os.path.join(self.directory, state))
+                                if f.endswith('.json'))
+        failed_dir = os.path.join(self.directory, 'failed')
+        failed = []
+        for filename in sorted(os.listdir(failed_dir), reverse=True)[:failed_limit]:
+            try:
+                with open(os.path.join(failed_dir, filename), 'r') as f:
+                    job = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            failed.append({key: job[key] for key in ('id', 'name', 'attempts', 'error')})
+        return {'counts': counts, 'queued': self._queue.qsize(), 'workers': self.workers, 'failed': failed}
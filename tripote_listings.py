@@ -0,0 +1,156 @@
+# tripote_listings.py
+# Hébergement de plusieurs lieux par serveur, chacun avec ses avis, ses photos
+# et sa fiche. Les lieux sont chargés au premier accès et gardés dans un LRU
+# borné en mémoire.
+#
+# Disposition sur le disque :
+#   <listings_dir>/<slug>/listing.json   fiche du lieu (titre, description...)
+#   <listings_dir>/<slug>/reviews.json   avis (ou reviews.snap, snapshot binaire)
+#   <upload_root>/<slug>/                photos envoyées par les invités
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from tripote_store import ReviewStore
+
+SLUG_PATTERN = re.compile(r'^[a-z0-9][a-z0-9-]{0,63}$')
+
+# Plafond par défaut de la mémoire occupée par les avis chargés
+DEFAULT_MEMORY_CAP = 256 * 1024 * 1024
+DEFAULT_MAX_LISTINGS = 1024
+
+
+# Un lieu : sa fiche, son stockage d'avis et son dossier de photos
+class Listing:
+    def __init__(self, slug, meta, store, upload_folder):
+        self.slug = slug
+        self.meta = meta
+        self.store = store
+        self.upload_folder = upload_folder
+        os.makedirs(upload_folder, exist_ok=True)
+
+    # Permet d'écrire listing.title dans le template
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['meta'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class ListingRegistry:
+    # `on_evict(listing)` est appelé (hors verrou) pour chaque lieu retiré du LRU
+    def __init__(self, listings_dir, upload_root, defaults, memory_cap=DEFAULT_MEMORY_CAP,
+                 max_listings=DEFAULT_MAX_LISTINGS, columnar=False, on_evict=None):
+        self.listings_dir = listings_dir
+        self.upload_root = upload_root
+        self.defaults = defaults
+        self.memory_cap = memory_cap
+        self.max_listings = max_listings
+        self.columnar = columnar
+        self.on_evict = on_evict or (lambda listing: None)
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Lieu correspondant au slug, chargé au premier accès (None s'il n'existe pas)
+    def get(self, slug):
+        if not SLUG_PATTERN.match(slug):
+            return None
+        with self._lock:
+            listing = self._listings.get(slug)
+            if listing is not None:
+                self._listings.move_to_end(slug)
+                evicted = self._evict(keep=slug)
+        if listing is not None:
+            self._evicted(evicted)
+            return listing
+
+        listing = self._open(slug)
+        if listing is None:
+            return None
+        with self._lock:
+            listing = self._listings.setdefault(slug, listing)
+            self._listings.move_to_end(slug)
+            evicted = self._evict(keep=slug)
+        self._evicted(evicted)
+        return listing
+
+    def _open(self, slug):
+        directory = os.path.join(self.listings_dir, slug)
+        meta_path = os.path.join(directory, 'listing.json')
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta = dict(self.defaults, **json.load(f))
+        snapshot_file = os.path.join(directory, 'reviews.snap')
+        store = ReviewStore(os.path.join(directory, 'reviews.json'),
+                            snapshot_file if os.path.exists(snapshot_file) else None,
+                            columnar=self.columnar)
+        store.on_write = self._rebalance
+        return Listing(slug, meta, store, os.path.join(self.upload_root, slug))
+
+    # Un lieu chargé a grandi (avis ajoutés, réplication) : revérifier les plafonds
+    def _rebalance(self):
+        with self._lock:
+            evicted = self._evict(keep=None)
+        self._evicted(evicted)
+
+    # Retirer les lieux les moins récemment utilisés au-delà des plafonds ;
+    # renvoie les lieux retirés
+    def _evict(self, keep):
+        evicted = []
+        total = sum(listing.store.memory_size() for listing in self._listings.values())
+        while len(self._listings) > 1 and (total > self.memory_cap or len(self._listings) > self.max_listings):
+            slug, listing = next(iter(self._listings.items()))
+            if slug == keep:
+                break
+            del self._listings[slug]
+            total -= listing.store.memory_size()
+            listing.store.unload()
+            evicted.append(listing)
+        return evicted
+
+    def _evicted(self, evicted):
+        for listing in evicted:
+            self.on_evict(listing)
+
+    # Lieu chargé, ou ouvert sans entrer dans le LRU (lecture ponctuelle, comme
+    # l'en-tête lu par la réplication)
+    def peek(self, slug):
+        if not SLUG_PATTERN.match(slug):
+            return None
+        with self._lock:
+            listing = self._listings.get(slug)
+        return listing if listing is not None else self._open(slug)
+
+    # Créer un nouveau lieu sur le disque
+    def create(self, slug, meta):
+        if not SLUG_PATTERN.match(slug):
+            raise ValueError(f"slug invalide: {slug!r}")
+        directory = os.path.join(self.listings_dir, slug)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'listing.json'), 'w') as f:
+            json.dump(meta, f, indent=4, ensure_ascii=False)
+        return self.get(slug)
+
+    def slugs(self):
+        if not os.path.isdir(self.listings_dir):
+            return []
+        return sorted(name for name in os.listdir(self.listings_dir)
+                      if SLUG_PATTERN.match(name)
+                      and os.path.isfile(os.path.join(self.listings_dir, name, 'listing.json')))
+
+    # Lieux actuellement chargés, du moins au plus récemment utilisé
+    def loaded(self):
+        with self._lock:
+            return list(self._listings.values())
+
+    # État du LRU (nombre de lieux chargés et mémoire occupée)
+    def usage(self):
+        with self._lock:
+            return {
+                'loaded': len(self._listings),
+                'memory': sum(listing.store.memory_size() for listing in self._listings.values()),
+                'memory_cap': self.memory_cap,
+            }
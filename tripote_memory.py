@@ -0,0 +1,171 @@
+# tripote_memory.py
+# Diagnostic de la mémoire d'un serveur qui tourne longtemps : tracemalloc est
+# démarré et arrêté à la demande (il ralentit les allocations), des instantanés
+# nommés sont gardés pour être comparés, et les principaux sites d'allocation
+# sont rendus sous forme de listes JSON.
+#
+# Chaque worker a sa propre mémoire : l'état et les instantanés sont ceux du
+# processus qui répond (son pid figure dans chaque réponse).
+import gc
+import linecache
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+DEFAULT_FRAMES = 1
+MAX_FRAMES = 50
+DEFAULT_LIMIT = 20
+MAX_SNAPSHOTS = 8
+KEY_TYPES = ('lineno', 'filename', 'traceback')
+
+# Allocations de tracemalloc lui-même (et de linecache, qui lit les lignes
+# affichées) et des imports, sans intérêt ici
+IGNORED_TRACES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+class DiagnosticsError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Mémoire résidente du processus en octets (None hors Linux)
+def rss():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _frame(frame):
+    return {
+        'file': frame.filename,
+        'line': frame.lineno,
+        'code': linecache.getline(frame.filename, frame.lineno).strip(),
+    }
+
+
+def _site(traceback, key_type):
+    if key_type == 'filename':
+        return {'file': traceback[0].filename}
+    if key_type == 'traceback':
+        return dict(_frame(traceback[-1]), traceback=[_frame(frame) for frame in traceback])
+    return _frame(traceback[0])
+
+
+class MemoryDiagnostics:
+    def __init__(self, max_snapshots=MAX_SNAPSHOTS):
+        self.max_snapshots = max_snapshots
+        # Nom -> (date, instantané), du plus ancien au plus récent
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Démarrer tracemalloc en gardant `frames` appels par allocation
+    def start(self, frames=DEFAULT_FRAMES):
+        if not 1 <= frames <= MAX_FRAMES:
+            raise DiagnosticsError(f"frames doit être entre 1 et {MAX_FRAMES}")
+        if tracemalloc.is_tracing():
+            if tracemalloc.get_traceback_limit() == frames:
+                return self.status()
+            tracemalloc.stop()
+        tracemalloc.start(frames)
+        return self.status()
+
+    # Arrêter tracemalloc (les instantanés déjà pris restent consultables)
+    def stop(self):
+        tracemalloc.stop()
+        return self.status()
+
+    def status(self):
+        tracing = tracemalloc.is_tracing()
+        traced, peak = tracemalloc.get_traced_memory() if tracing else (None, None)
+        with self._lock:
+            snapshots = [{'name': name, 'taken_at': taken_at, 'traces': len(snapshot.traces)}
+                         for name, (taken_at, snapshot) in self._snapshots.items()]
+        return {
+            'pid': os.getpid(),
+            'tracing': tracing,
+            'frames': tracemalloc.get_traceback_limit() if tracing else None,
+            'traced': traced,
+            'peak': peak,
+            'overhead': tracemalloc.get_tracemalloc_memory() if tracing else None,
+            'rss': rss(),
+            'gc': {'objects': len(gc.get_objects()), 'counts': gc.get_count()},
+            'snapshots': snapshots,
+        }
+
+    def _take(self):
+        if not tracemalloc.is_tracing():
+            raise DiagnosticsError("tracemalloc n'est pas démarré", 409)
+        return tracemalloc.take_snapshot().filter_traces(IGNORED_TRACES)
+
+    # Prendre un instantané nommé (le plus ancien est oublié au-delà de max_snapshots)
+    def snapshot(self, name):
+        snapshot = self._take()
+        with self._lock:
+            self._snapshots.pop(name, None)
+            self._snapshots[name] = (time.time(), snapshot)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return {'pid': os.getpid(), 'name': name, 'traces': len(snapshot.traces),
+                'size': sum(stat.size for stat in snapshot.statistics('filename'))}
+
+    def drop(self, name):
+        with self._lock:
+            if self._snapshots.pop(name, None) is None:
+                raise DiagnosticsError(f"instantané inconnu : {name}", 404)
+
+    # Instantané nommé, ou pris à l'instant si `name` est None
+    def _get(self, name):
+        if name is None:
+            return self._take()
+        with self._lock:
+            entry = self._snapshots.get(name)
+        if entry is None:
+            raise DiagnosticsError(f"instantané inconnu : {name}", 404)
+        return entry[1]
+
+    @staticmethod
+    def _check(key_type, limit):
+        if key_type not in KEY_TYPES:
+            raise DiagnosticsError(f"regroupement inconnu : {key_type} ({', '.join(KEY_TYPES)})")
+        if limit < 1:
+            raise DiagnosticsError("limit doit être positif")
+
+    # Principaux sites d'allocation d'un instantané
+    def top(self, name=None, limit=DEFAULT_LIMIT, key_type='lineno'):
+        self._check(key_type, limit)
+        stats = self._get(name).statistics(key_type)
+        return {
+            'pid': os.getpid(),
+            'snapshot': name,
+            'total': sum(stat.size for stat in stats),
+            'sites': [dict(_site(stat.traceback, key_type), size=stat.size, count=stat.count)
+                      for stat in stats[:limit]],
+        }
+
+    # Sites dont la mémoire a le plus changé entre deux instantanés
+    # (`new` à None : comparaison avec l'état actuel)
+    def diff(self, old, new=None, limit=DEFAULT_LIMIT, key_type='lineno'):
+        self._check(key_type, limit)
+        before, after = self._get(old), self._get(new)
+        stats = after.compare_to(before, key_type)
+        return {
+            'pid': os.getpid(),
+            'from': old,
+            'to': new,
+            'size_diff': sum(stat.size_diff for stat in stats),
+            'sites': [dict(_site(stat.traceback, key_type), size=stat.size, size_diff=stat.size_diff,
+                           count=stat.count, count_diff=stat.count_diff)
+                      for stat in stats[:limit]],
+        }
+
@@ -0,0 +1,143 @@
+# tripote_publish.py
+# Mode publication : les pages d'un lieu sont générées en fichiers statiques à
+# chaque modification de ses avis, pour être servies par n'importe quel serveur
+# de fichiers (ou par Flask avec sendfile) sans rendu à chaque visite.
+#
+# Disposition d'un lieu dans le dossier de sortie :
+#   index.html                  fiche, statistiques et derniers avis
+#   avis/page-<n>.html          tous les avis, par pages, du plus ancien au plus récent
+#   json/reviews-<n>.json       mêmes pages en JSON
+#   json/stats.json             statistiques (et stats-extended.json, etc.)
+#   .publish.json               état de la dernière publication
+#
+# Les avis n'étant qu'ajoutés, seules la dernière page déjà publiée et les
+# nouvelles pages changent ; l'index et les statistiques sont toujours refaits.
+import json
+import os
+import tempfile
+import threading
+
+from tripote_replication import review_hash
+import tripote_api
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_PER_PAGE = 50
+STATE_FILE = '.publish.json'
+LOCK_FILE = '.publish.lock'
+
+
+# Écrire un fichier de façon atomique (le serveur de fichiers ne voit jamais une page à moitié écrite)
+def write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.publish-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class Publisher:
+    # `render(listing, reviews, page, pages)` renvoie le HTML d'une page (page=None : index)
+    # `documents(listing)` renvoie les JSON refaits à chaque publication {nom: objet}
+    # `version(listing)` change quand le gabarit ou la fiche change (tout est alors refait)
+    def __init__(self, output_dir, render, documents=None, version=None, per_page=DEFAULT_PER_PAGE):
+        self.output_dir = output_dir
+        self.render = render
+        self.documents = documents or (lambda listing: {})
+        self.version = version or (lambda listing: '')
+        self.per_page = per_page
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    # Dossier de sortie d'un lieu (racine pour le lieu principal)
+    def listing_dir(self, listing):
+        if listing.slug:
+            return os.path.join(self.output_dir, 'l', listing.slug)
+        return self.output_dir
+
+    def _read_state(self, directory):
+        try:
+            with open(os.path.join(directory, STATE_FILE), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    # Première page à refaire, d'après l'état de la publication précédente
+    def _first_changed_page(self, state, reviews, version):
+        if state is None or state.get('version') != version or state.get('per_page') != self.per_page:
+            # Première publication, ou gabarit / taille de page changés
+            return 1
+        count = state['count']
+        if count > len(reviews) or (count and review_hash(reviews[count - 1]) != state['last_hash']):
+            # Fichier d'avis remplacé : tout refaire
+            return 1
+        if count == len(reviews):
+            return None
+        # La dernière page publiée gagne des avis (ou un lien vers la suivante)
+        return max((count - 1) // self.per_page + 1, 1)
+
+    # Publier un lieu ; renvoie les fichiers écrits
+    def publish(self, listing, force=False):
+        directory = self.listing_dir(listing)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            lock = self._locks.setdefault(directory, threading.Lock())
+        with lock, open(os.path.join(directory, LOCK_FILE), 'a') as lock_file:
+            if fcntl:
+                # Plusieurs workers peuvent publier le même lieu
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            return self._publish(listing, directory, force)
+
+    def _publish(self, listing, directory, force):
+        reviews = listing.store.load()
+        version = self.version(listing)
+        previous = self._read_state(directory)
+        first = self._first_changed_page(None if force else previous, reviews, version)
+        if first is None:
+            return []
+
+        total = len(reviews)
+        pages = max((total + self.per_page - 1) // self.per_page, 1)
+        written = []
+
+        def write(relative_path, data):
+            write_atomic(os.path.join(directory, relative_path), data)
+            written.append(relative_path)
+
+        for page in range(first, pages + 1):
+            start = (page - 1) * self.per_page
+            page_reviews = reviews[start:start + self.per_page]
+            write(f'avis/page-{page}.html', self.render(listing, page_reviews, page, pages).encode('utf-8'))
+            write(f'json/reviews-{page}.json', tripote_api.dumps(
+                tripote_api.reviews_payload(listing.store, page, self.per_page)))
+        # Pages devenues inutiles (fichier d'avis raccourci)
+        for stale in range(pages + 1, (previous or {}).get('pages', 0) + 1):
+            for relative_path in (f'avis/page-{stale}.html', f'json/reviews-{stale}.json'):
+                try:
+                    os.unlink(os.path.join(directory, relative_path))
+                except FileNotFoundError:
+                    pass
+
+        for name, document in self.documents(listing).items():
+            write(f'json/{name}.json', tripote_api.dumps(document))
+        latest = reviews[max(total - self.per_page, 0):total]
+        write('index.html', self.render(listing, latest, None, pages).encode('utf-8'))
+
+        state = {
+            'version': version,
+            'per_page': self.per_page,
+            'count': total,
+            'pages': pages,
+            'last_hash': review_hash(reviews[total - 1]) if total else None,
+        }
+        write_atomic(os.path.join(directory, STATE_FILE), json.dumps(state).encode('utf-8'))
+        return written
@@ -0,0 +1,112 @@
+# tripote_ratelimit.py
+# Limitation de débit par seau à jetons, partagée entre les processus workers.
+#
+# Les seaux vivent dans un petit fichier projeté en mémoire (mmap) : chaque
+# case contient le hachage de la clé, le nombre de jetons restants et la date
+# de dernière mise à jour. Les accès sont sérialisés par un verrou fcntl sur
+# le fichier (et un verrou de thread dans le processus).
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows : la limite reste propre à chaque processus
+    fcntl = None
+
+SLOT = struct.Struct('<Qdd')
+DEFAULT_SLOTS = 4096
+MAX_PROBES = 8
+
+
+# Lire une règle "quantité/secondes", par exemple "5/60" pour 5 avis par minute
+def parse_rate(value):
+    amount, _, period = value.partition('/')
+    return float(amount), float(period or 1)
+
+
+class SharedTokenBuckets:
+    def __init__(self, path, capacity, period, slots=DEFAULT_SLOTS):
+        self.capacity = float(capacity)
+        self.refill_per_second = self.capacity / float(period)
+        self.slots = slots
+        size = SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            self._locked(lambda: os.ftruncate(self._fd, size))
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def _locked(self, func):
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            return func()
+        finally:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key):
+        # 0 marque une case libre
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    # Trouver la case de la clé (ou la plus ancienne des cases sondées)
+    def _find(self, key_hash):
+        start = key_hash % self.slots
+        oldest = None
+        for probe in range(MAX_PROBES):
+            index = (start + probe) % self.slots
+            stored, tokens, updated = SLOT.unpack_from(self._map, index * SLOT.size)
+            if stored == key_hash:
+                return index, tokens, updated
+            if stored == 0:
+                return index, None, None
+            if oldest is None or updated < oldest[1]:
+                oldest = (index, updated)
+        return oldest[0], None, None
+
+    # Consommer `amount` jetons ; renvoie (autorisé, secondes avant de réessayer)
+    def take(self, key, amount=1, now=None):
+        now = time.time() if now is None else now
+        key_hash = self._hash(key)
+
+        def update():
+            index, tokens, updated = self._find(key_hash)
+            if tokens is None:
+                tokens, updated = self.capacity, now
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_per_second)
+            if amount > self.capacity:
+                # Demande plus grande que le seau entier : jamais satisfaisable
+                SLOT.pack_into(self._map, index * SLOT.size, key_hash, tokens, now)
+                return False, None
+            if tokens >= amount:
+                SLOT.pack_into(self._map, index * SLOT.size, key_hash, tokens - amount, now)
+                return True, 0
+            SLOT.pack_into(self._map, index * SLOT.size, key_hash, tokens, now)
+            return False, (amount - tokens) / self.refill_per_second
+
+        with self._lock:
+            return self._locked(update)
+
+    # Rendre des jetons pris pour une requête finalement refusée par une autre limite
+    def refund(self, key, amount=1, now=None):
+        now = time.time() if now is None else now
+        key_hash = self._hash(key)
+
+        def update():
+            index, tokens, updated = self._find(key_hash)
+            if tokens is None:
+                return
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_per_second + amount)
+            SLOT.pack_into(self._map, index * SLOT.size, key_hash, tokens, now)
+
+        with self._lock:
+            self._locked(update)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
@@ -0,0 +1,267 @@
+# tripote_replication.py
+# Réplication entre plusieurs serveurs Tripote Visor servant les mêmes lieux.
+#
+# Un seul serveur écrit (le « writer ») ; les autres (« followers ») lisent son
+# journal de modifications par HTTP et l'appliquent à leur propre reviews.json.
+# Les avis n'étant qu'ajoutés, le numéro de séquence d'un avis est sa position
+# dans le fichier : un follower demande les avis à partir du nombre qu'il a
+# déjà, ce qui rend la reprise après un redémarrage incrémentale.
+#
+#   GET /replication/heads
+#       -> {"listings": {"": {"seq": total, "last": <empreinte>}, "<slug>": {...}, ...}}
+#   GET <lieu>/replication/changes?since=N&last=<empreinte>&limit=500
+#       -> {"seq": total, "changes": [{"seq": N + 1, "review": {...}}, ...]}
+#
+# Les en-têtes (nombre d'avis et empreinte du dernier, tenus à jour à chaque
+# écriture sans charger les avis) permettent au follower de ne relire que les
+# lieux qui ont changé. `last` est l'empreinte du N-ième avis du follower : si
+# le writer a un autre avis à cette position (fichier remplacé, import...), il
+# répond 409 et le follower recopie tout le lieu.
+#
+# Un avis transmis par un follower reçoit une réponse JSON : 201 s'il est
+# enregistré, sinon un code d'erreur et {"error": "..."}.
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DEFAULT_INTERVAL = 2
+DEFAULT_BATCH = 500
+MAX_BATCH = 5000
+TIMEOUT = 10
+TOKEN_HEADER = 'X-Replication-Token'
+
+
+class ResyncRequired(Exception):
+    pass
+
+
+# Empreinte d'un avis, identique sur tous les serveurs
+def review_hash(review):
+    data = json.dumps(review, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+# Journal de modifications d'un stockage à partir de `since` (côté writer)
+def changes_payload(store, since, last_hash=None, limit=DEFAULT_BATCH):
+    reviews = store.load()
+    total = len(reviews)
+    if since > total:
+        raise ResyncRequired(f"le follower a {since} avis, le writer {total}")
+    if since and last_hash and review_hash(reviews[since - 1]) != last_hash:
+        raise ResyncRequired(f"l'avis {since} diffère du writer")
+    end = min(since + limit, total)
+    return {
+        'seq': total,
+        'changes': [{'seq': seq, 'review': review}
+                    for seq, review in enumerate(reviews[since:end], start=since + 1)],
+    }
+
+
+# Corps multipart/form-data pour transmettre un avis (et sa photo) au writer
+def encode_multipart(fields, files=()):
+    boundary = secrets.token_hex(16)
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode('utf-8'))
+        parts.append(str(value).encode('utf-8') + b'\r\n')
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode('utf-8'))
+        parts.append(data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+# Ne pas suivre la redirection renvoyée par le writer après un avis
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Follower:
+    # `resolve(slug)` renvoie le lieu local, `head(slug)` son en-tête sans
+    # charger les avis (None si le lieu n'existe pas ici), `on_applied(listing,
+    # reviews)` est appelé après chaque lot appliqué
+    def __init__(self, writer_url, token=None, interval=DEFAULT_INTERVAL, batch=DEFAULT_BATCH,
+                 resolve=None, head=None, on_applied=None, log=None):
+        self.writer_url = writer_url.rstrip('/')
+        self.token = token
+        self.interval = interval
+        self.batch = batch
+        self.resolve = resolve
+        self.head = head or (lambda slug: None)
+        self.on_applied = on_applied or (lambda listing, reviews: None)
+        self.log = log or (lambda message: None)
+        self._state = {}
+        self._lock = threading.Lock()
+        self._listing_locks = {}
+        self._wake = threading.Event()
+        self._pid = None
+
+    def _headers(self):
+        return {TOKEN_HEADER: self.token} if self.token else {}
+
+    def url(self, slug, path):
+        prefix = f"/l/{slug}" if slug else ''
+        return f"{self.writer_url}{prefix}{path}"
+
+    def _get_json(self, url):
+        request = urllib.request.Request(url, headers=self._headers())
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            return json.load(response)
+
+    def _listing_lock(self, slug):
+        with self._lock:
+            return self._listing_locks.setdefault(slug, threading.Lock())
+
+    # Appliquer les avis manquants d'un lieu ; renvoie le nombre d'avis ajoutés
+    def sync(self, slug=None):
+        listing = self.resolve(slug)
+        if listing is None:
+            return 0
+        applied = 0
+        with self._listing_lock(slug):
+            try:
+                while True:
+                    reviews = listing.store.load()
+                    since = len(reviews)
+                    query = {'since': since, 'limit': self.batch}
+                    if since:
+                        query['last'] = review_hash(reviews[since - 1])
+                    try:
+                        payload = self._get_json(self.url(slug, '/replication/changes?')
+                                                 + urllib.parse.urlencode(query))
+                    except urllib.error.HTTPError as e:
+                        if e.code != 409:
+                            raise
+                        applied += self._resync(listing, slug)
+                        continue
+                    new_reviews = [change['review'] for change in payload['changes']]
+                    # Un autre worker a déjà appliqué ce lot : repartir de son état
+                    if not listing.store.extend(new_reviews, expected_len=since):
+                        continue
+                    applied += len(new_reviews)
+                    if new_reviews:
+                        self.on_applied(listing, new_reviews)
+                    self._record(slug, since + len(new_reviews), payload['seq'], None)
+                    if since + len(new_reviews) >= payload['seq'] or not new_reviews:
+                        return applied
+            except (OSError, ValueError, KeyError) as e:
+                self._record(slug, None, None, f"{type(e).__name__}: {e}")
+                raise
+
+    # Recopier tous les avis d'un lieu (le fichier du writer a été remplacé)
+    def _resync(self, listing, slug):
+        self.log(f"réplication : copie complète du lieu {slug or '(principal)'}")
+        reviews = []
+        while True:
+            payload = self._get_json(self.url(slug, '/replication/changes?')
+                                     + urllib.parse.urlencode({'since': len(reviews), 'limit': self.batch}))
+            reviews.extend(change['review'] for change in payload['changes'])
+            if len(reviews) >= payload['seq'] or not payload['changes']:
+                break
+        listing.store.save(reviews)
+        self.on_applied(listing, reviews)
+        self._record(slug, len(reviews), payload['seq'], None)
+        return len(reviews)
+
+    def _record(self, slug, local_seq, writer_seq, error):
+        with self._lock:
+            state = self._state.setdefault(slug, {'local_seq': 0, 'writer_seq': None, 'last_sync': None,
+                                                  'error': None})
+            if error is None:
+                state.update(local_seq=local_seq, writer_seq=writer_seq, last_sync=time.time(), error=None)
+            else:
+                state['error'] = error
+
+    # Synchroniser les lieux dont l'en-tête diffère de celui du writer ;
+    # renvoie le nombre d'avis ajoutés
+    def poll(self):
+        heads = self._get_json(f"{self.writer_url}/replication/heads")['listings']
+        applied = 0
+        for key, writer_head in heads.items():
+            slug = key or None
+            local_head = self.head(slug)
+            if local_head is None:
+                continue
+            if local_head == writer_head:
+                self._record(slug, local_head['seq'], writer_head['seq'], None)
+                continue
+            try:
+                applied += self.sync(slug)
+            except Exception as e:
+                self.log(f"réplication du lieu {slug or '(principal)'} : {e}")
+        return applied
+
+    # Retard de chaque lieu : avis manquants et temps depuis la dernière synchronisation
+    def status(self):
+        now = time.time()
+        with self._lock:
+            listings = {}
+            for slug, state in self._state.items():
+                writer_seq = state['writer_seq']
+                listings[slug or ''] = dict(
+                    state,
+                    lag=None if writer_seq is None else max(writer_seq - state['local_seq'], 0),
+                    seconds_since_sync=None if state['last_sync'] is None else round(now - state['last_sync'], 1),
+                )
+        return {'role': 'follower', 'writer': self.writer_url, 'listings': listings}
+
+    # Transmettre un avis au writer ; renvoie (code HTTP, message d'erreur du
+    # writer ou None). Seul 201 signifie que l'avis est enregistré.
+    def forward(self, slug, fields, files=(), client_ip=None):
+        body, content_type = encode_multipart(fields, files)
+        headers = dict(self._headers(), **{'Content-Type': content_type, 'Accept': 'application/json'})
+        if client_ip:
+            headers['X-Forwarded-For'] = client_ip
+        request = urllib.request.Request(self.url(slug, '/add_review'), data=body, headers=headers, method='POST')
+        opener = urllib.request.build_opener(_NoRedirect)
+        try:
+            with opener.open(request, timeout=TIMEOUT) as response:
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            # Erreurs, et redirection d'un writer qui n'a pas répondu en JSON
+            try:
+                error = json.load(e).get('error')
+            except (ValueError, AttributeError):
+                error = None
+            return e.code, error
+
+    # Télécharger un fichier du writer (photo d'un avis répliqué)
+    def download(self, path, target):
+        request = urllib.request.Request(self.writer_url + path, headers=self._headers())
+        tmp_path = f"{target}.tmp"
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response, open(tmp_path, 'wb') as f:
+            while True:
+                block = response.read(64 * 1024)
+                if not block:
+                    break
+                f.write(block)
+        os.replace(tmp_path, target)
+
+    # Demander une synchronisation immédiate
+    def wake(self):
+        self._wake.set()
+
+    # Démarrer la boucle de synchronisation (à nouveau si le processus a été forké)
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="tripote-replication", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self.log(f"réplication : en-têtes du writer illisibles : {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,157 @@
+# tripote_rollups.py
+# Agrégats horaires et journaliers des notes (nombre, somme, répartition par
+# étoiles), mis à jour à chaque avis et enregistrés à côté du fichier d'avis.
+# Une requête de tendance parcourt les tranches demandées, jamais les avis.
+#
+# Les avis n'étant qu'ajoutés, les agrégats retiennent combien d'avis ils ont
+# déjà comptés (`count`) et n'intègrent ensuite que les suivants. Un avis
+# dont la date ou la note est illisible (import) est compté dans `rejected`
+# sans entrer dans les tranches.
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+# Format des dates des avis (tripote_store.DATE_FORMAT)
+DATE_FORMAT = '%d/%m/%Y %H:%M'
+
+# Format de clé et pas de chaque granularité
+BUCKETS = {
+    'hour': ('%Y-%m-%dT%H:00', timedelta(hours=1)),
+    'day': ('%Y-%m-%d', timedelta(days=1)),
+}
+
+# Nombre maximal de tranches renvoyées par une requête
+MAX_BUCKETS = 5000
+
+
+# Heure locale sans fuseau, comme les dates des avis (`from=...+02:00`)
+def local_time(moment):
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone().replace(tzinfo=None)
+
+
+# Début de la tranche contenant `moment`
+def bucket_start(bucket, moment):
+    if bucket == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class RatingRollups:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+        self._file_signature = None
+
+    def _empty(self):
+        return {'count': 0, 'rejected': 0, 'hour': {}, 'day': {}}
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    # Relire le fichier s'il a été réécrit par un autre worker
+    def _load(self):
+        file_signature = self._file_stat()
+        if self._data is not None and file_signature == self._file_signature:
+            return self._data
+        if file_signature is None:
+            self._data = self._empty()
+        else:
+            with open(self.path, 'r') as f:
+                self._data = json.load(f)
+        self._file_signature = file_signature
+        return self._data
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.rollups-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._data, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._file_signature = self._file_stat()
+
+    # Compter un avis dans ses tranches ; False si sa date ou sa note est illisible
+    @staticmethod
+    def _add(data, review):
+        rating = review.get('rating')
+        if type(rating) is not int or not 1 <= rating <= 5:
+            return False
+        try:
+            moment = datetime.strptime(review.get('date'), DATE_FORMAT)
+        except (TypeError, ValueError):
+            return False
+        for bucket, (key_format, _) in BUCKETS.items():
+            # [nombre, somme, 1 étoile, ..., 5 étoiles]
+            counters = data[bucket].setdefault(moment.strftime(key_format), [0, 0, 0, 0, 0, 0, 0])
+            counters[0] += 1
+            counters[1] += rating
+            counters[1 + rating] += 1
+        return True
+
+    # Intégrer les avis ajoutés depuis la dernière mise à jour ; `reviews` est la
+    # liste complète (ou le snapshot), seuls les avis au-delà de `count` sont lus
+    def sync(self, reviews):
+        with self._lock:
+            data = self._load()
+            total = len(reviews)
+            if total == data.get('count'):
+                return 0
+            if total < data.get('count', 0) or 'count' not in data:
+                # Le fichier d'avis a été remplacé : tout recalculer
+                data = self._data = self._empty()
+            start = data['count']
+            for review in reviews[start:total]:
+                if not self._add(data, review):
+                    data['rejected'] = data.get('rejected', 0) + 1
+            data['count'] = total
+            self._save()
+            return total - start
+
+    # Nombre d'avis déjà comptés (None si les agrégats n'ont jamais été calculés)
+    def counted(self):
+        with self._lock:
+            if self._file_stat() is None:
+                return None
+            return self._load().get('count', 0)
+
+    # Nombre d'avis comptés mais écartés des tranches (date ou note illisible)
+    def rejected(self):
+        with self._lock:
+            if self._file_stat() is None:
+                return 0
+            return self._load().get('rejected', 0)
+
+    # Série de tranches entre `start` et `end` (inclus), une entrée par tranche
+    def trend(self, bucket, start, end):
+        key_format, step = BUCKETS[bucket]
+        start, end = local_time(start), local_time(end)
+        moment = bucket_start(bucket, start)
+        if (end - moment) // step + 1 > MAX_BUCKETS:
+            raise ValueError(f"plus de {MAX_BUCKETS} tranches demandées")
+        with self._lock:
+            series = self._load()[bucket]
+        points = []
+        while moment <= end:
+            key = moment.strftime(key_format)
+            count, total, *stars = series.get(key, (0, 0, 0, 0, 0, 0, 0))
+            points.append({
+                'start': key,
+                'count': count,
+                'sum': total,
+                'average': round(total / count, 2) if count else None,
+                'distribution': {star: stars[star - 1] for star in range(1, 6)},
+            })
+            moment += step
+        return points
@@ -0,0 +1,194 @@
+# tripote_snapshot.py
+# Format binaire compact des avis, ouvert en mmap pour un démarrage rapide.
+#
+# Disposition du fichier (entiers little-endian) :
+#   en-tête   : magic (8 octets), version, nombre d'avis, position de la table
+#               des offsets, position de la table des notes
+#   avis      : pour chaque avis, longueur (u32) puis JSON compact en UTF-8
+#   offsets   : un u64 par avis, position de son préfixe de longueur
+#   notes     : un octet par avis (note de 1 à 5), pour les stats sans décodage
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+
+MAGIC = b'TVSNAP\x00\x01'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')
+LENGTH = struct.Struct('<I')
+
+# Nombre d'avis par page pour la lecture paresseuse
+PAGE_SIZE = 50
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+# Écrire un snapshot à partir d'un itérable d'avis, de façon atomique
+def write_snapshot(path, reviews):
+    return _write(path, (_encode(review) for review in reviews))
+
+
+# Ajouter des avis à un snapshot existant (les anciens sont recopiés sans décodage)
+def append_snapshot(path, reviews):
+    new_records = [_encode(review) for review in reviews]
+    if not os.path.exists(path):
+        return _write(path, iter(new_records))
+    with ReviewSnapshot(path) as snapshot:
+        return _write(path, _chain(snapshot.iter_raw(), new_records))
+
+
+def _chain(raw_records, new_records):
+    yield from raw_records
+    yield from new_records
+
+
+def _encode(review):
+    return (json.dumps(review, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+            review['rating'])
+
+
+def _write(path, records):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', suffix='.tmp', dir=directory)
+    offsets = array('Q')
+    ratings = bytearray()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+            position = HEADER.size
+            for data, rating in records:
+                offsets.append(position)
+                ratings.append(rating)
+                f.write(LENGTH.pack(len(data)))
+                f.write(data)
+                position += LENGTH.size + len(data)
+            offsets_pos = position
+            f.write(offsets.tobytes())
+            ratings_pos = offsets_pos + len(offsets) * offsets.itemsize
+            f.write(ratings)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, len(offsets), offsets_pos, ratings_pos))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(offsets)
+
+
+# Lecture d'un snapshot : rien n'est décodé avant d'être demandé
+class ReviewSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise SnapshotError(f"{path}: snapshot trop court")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, offsets_pos, ratings_pos = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise SnapshotError(f"{path}: format de snapshot inconnu")
+        if ratings_pos + count > size:
+            self._map.close()
+            raise SnapshotError(f"{path}: snapshot tronqué")
+        self._count = count
+        self._view = memoryview(self._map)
+        self._offsets = self._view[offsets_pos:ratings_pos].cast('Q')
+        self._ratings = self._view[ratings_pos:ratings_pos + count]
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def raw(self, index):
+        offset = self._offsets[index]
+        (length,) = LENGTH.unpack_from(self._map, offset)
+        start = offset + LENGTH.size
+        return self._map[start:start + length]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return json.loads(self.raw(index))
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield json.loads(self.raw(index))
+
+    # Avis bruts (JSON encodé, note) pour recopier un snapshot sans décoder
+    def iter_raw(self):
+        for index in range(self._count):
+            yield self.raw(index), self._ratings[index]
+
+    # Une page d'avis, décodée seulement à la demande
+    def page(self, number, size=PAGE_SIZE):
+        start = number * size
+        return self[start:start + size]
+
+    # Notes de tous les avis, sans décoder le JSON
+    def ratings(self):
+        return self._ratings
+
+    def close(self):
+        self._offsets.release()
+        self._ratings.release()
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Parcourir un snapshot avis par avis (même signature que tripote_store.iter_reviews_file)
+def iter_snapshot_file(path):
+    if not os.path.exists(path):
+        return
+    with ReviewSnapshot(path) as snapshot:
+        yield from snapshot
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+# Snapshot ouvert gardé en cache tant que le fichier n'a pas été remplacé
+def open_snapshot(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        snapshot = ReviewSnapshot(path)
+        # L'ancien mmap reste valide pour les requêtes en cours, le GC le libérera
+        _cache[path] = (key, snapshot)
+        return snapshot
+
+
+# Snapshots ouverts et taille des fichiers projetés en mémoire (mmap : pages
+# partagées avec le cache du système, pas le tas de Python)
+def cache_usage():
+    with _cache_lock:
+        return {
+            'open': len(_cache),
+            'mapped_bytes': sum(key[2] for key, _ in _cache.values()),
+        }
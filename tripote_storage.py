@@ -0,0 +1,309 @@
+# tripote_storage.py
+# Budget disque des photos : le dossier des photos ne grandit plus sans limite
+# sur la petite carte SD du serveur.
+#
+# La place se libère dans cet ordre :
+#   1. variantes dérivées (miniatures), les moins récemment servies d'abord :
+#      elles sont refaites ou remplacées par l'original au besoin ;
+#   2. originaux non servis depuis `cold_after` secondes : réduits à
+#      `recompress_size` pixels de côté (si `recompress_quality` est défini),
+#      puis déplacés vers `cold_dir` (un disque USB par exemple), d'où ils
+#      restent servis.
+# Quand il n'y a toujours pas la place, l'envoi est refusé (StorageFull).
+#
+# Les variantes sont rangées dans un dossier `.thumbs` à côté des originaux :
+# un slug de lieu ne peut pas commencer par un point, si bien qu'aucun dossier
+# de photos d'un lieu ne peut être pris pour un dossier de variantes.
+#
+# La date du dernier service est gardée dans la date d'accès (atime) de chaque
+# fichier, mise à jour au plus une fois par TOUCH_INTERVAL : elle est partagée
+# entre workers et survit aux redémarrages sans fichier d'index.
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DERIVED_FOLDERS = ('.thumbs',)
+DEFAULT_MIN_FREE = 50 * 1024 * 1024
+DEFAULT_COLD_AFTER = 30 * 24 * 3600
+DEFAULT_RECOMPRESS_SIZE = 1600
+# Le nettoyage en arrière-plan redescend à cette fraction du budget
+LOW_WATERMARK = 0.9
+SCAN_INTERVAL = 60
+TOUCH_INTERVAL = 3600
+LOCK_FILE = '.storage.lock'
+
+
+class StorageFull(Exception):
+    pass
+
+
+class _File:
+    __slots__ = ('path', 'size', 'served', 'derived')
+
+    def __init__(self, path, size, served, derived):
+        self.path = path
+        self.size = size
+        self.served = served
+        self.derived = derived
+
+
+class StorageManager:
+    # `budget` en octets (0 : pas de budget, seul `min_free` est respecté) ;
+    # `extra_dirs` sont comptés dans le budget sans jamais être nettoyés
+    # (envois par morceaux en cours)
+    def __init__(self, root, budget=0, min_free=DEFAULT_MIN_FREE, cold_dir=None, cold_after=DEFAULT_COLD_AFTER,
+                 recompress_quality=None, recompress_size=DEFAULT_RECOMPRESS_SIZE, extra_dirs=(), log=None):
+        self.root = root
+        self.budget = budget
+        self.min_free = min_free
+        self.cold_dir = cold_dir
+        self.cold_after = cold_after
+        self.recompress_quality = recompress_quality
+        self.recompress_size = recompress_size
+        self.extra_dirs = extra_dirs
+        self.log = log or (lambda message: None)
+        self._lock = threading.Lock()
+        self._reclaim_lock = threading.Lock()
+        self._files = {}
+        self._extra = 0
+        self._scanned_at = 0
+        # Originaux déjà assez petits pour être réduits
+        self._small = set()
+        self.last_reclaim = None
+        os.makedirs(root, exist_ok=True)
+
+    # Variante : fichier directement dans le dossier de variantes d'un dossier de photos
+    @staticmethod
+    def _is_derived(path):
+        return os.path.basename(os.path.dirname(path)) in DERIVED_FOLDERS
+
+    @staticmethod
+    def _walk(directory):
+        for folder, subfolders, filenames in os.walk(directory):
+            subfolders[:] = [name for name in subfolders
+                             if not name.startswith('.') or name in DERIVED_FOLDERS]
+            for filename in filenames:
+                if filename.startswith('.') or filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(folder, filename)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+    # Relire les tailles et dates de service (au plus toutes les SCAN_INTERVAL secondes)
+    def scan(self, force=False):
+        now = time.time()
+        with self._lock:
+            if not force and now - self._scanned_at < SCAN_INTERVAL:
+                return
+        files = {path: _File(path, st.st_size, st.st_atime, self._is_derived(path))
+                 for path, st in self._walk(self.root)}
+        extra = sum(st.st_size for directory in self.extra_dirs if os.path.isdir(directory)
+                    for _, st in self._walk(directory))
+        with self._lock:
+            self._files = files
+            self._extra = extra
+            self._scanned_at = now
+
+    def used(self):
+        self.scan()
+        with self._lock:
+            return sum(f.size for f in self._files.values()) + self._extra
+
+    def _disk_free(self):
+        return shutil.disk_usage(self.root).free
+
+    # Octets manquants pour écrire `size` octets de plus (0 : la place est là)
+    def shortfall(self, size=0):
+        missing = max(self.min_free + size - self._disk_free(), 0)
+        if self.budget:
+            missing = max(missing, self.used() + size - self.budget)
+        return missing
+
+    # Vérifier qu'un fichier de `size` octets peut être écrit, en libérant de
+    # la place si besoin ; StorageFull sinon
+    def reserve(self, size):
+        missing = self.shortfall(size)
+        if not missing:
+            return
+        self.reclaim(missing)
+        self.scan(force=True)
+        if self.shortfall(size):
+            raise StorageFull("espace de stockage des photos plein")
+
+    # Fichier ajouté au dossier (photo, miniature, copie répliquée)
+    def added(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._files[path] = _File(path, st.st_size, time.time(), self._is_derived(path))
+
+    # Fichier servi : sa date d'accès marque son dernier usage
+    def touch(self, path):
+        try:
+            st = os.stat(path)
+            now = time.time()
+            if now - st.st_atime < TOUCH_INTERVAL:
+                return
+            os.utime(path, (now, st.st_mtime))
+        except OSError:
+            return
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None:
+                entry.served = now
+
+    # Le nettoyage en arrière-plan a-t-il du travail ?
+    def needs_reclaim(self):
+        if self.budget and self.used() > self.budget * LOW_WATERMARK:
+            return True
+        return self._disk_free() < self.min_free
+
+    # Libérer `target` octets (par défaut : redescendre sous LOW_WATERMARK du budget)
+    def reclaim(self, target=None):
+        with self._reclaim_lock, open(os.path.join(self.root, LOCK_FILE), 'a') as lock_file:
+            if fcntl:
+                # Un seul worker fait le ménage à la fois
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            self.scan(force=True)
+            if target is None:
+                target = max(self.shortfall(),
+                             self.used() - int(self.budget * LOW_WATERMARK) if self.budget else 0)
+            result = {'target': target, 'freed': 0, 'evicted': 0, 'recompressed': 0, 'moved': 0}
+            if target > 0:
+                self._reclaim(target, result)
+            result['at'] = time.time()
+            self.last_reclaim = result
+            if result['freed']:
+                self.log(f"stockage : {result['freed'] // 1024} Ko libérés ({result['evicted']} variante(s) "
+                         f"supprimée(s), {result['recompressed']} réduite(s), {result['moved']} déplacée(s))")
+            return result
+
+    def _reclaim(self, target, result):
+        with self._lock:
+            files = sorted(self._files.values(), key=lambda f: f.served)
+
+        def done():
+            return result['freed'] >= target
+
+        for entry in files:
+            if done():
+                return
+            if entry.derived:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+                self._forget(entry)
+                result['freed'] += entry.size
+                result['evicted'] += 1
+
+        cutoff = time.time() - self.cold_after
+        cold = [entry for entry in files if not entry.derived and entry.served < cutoff]
+        if self.recompress_quality:
+            for entry in cold:
+                if done():
+                    return
+                saved = self._recompress(entry)
+                if saved:
+                    result['freed'] += saved
+                    result['recompressed'] += 1
+        if self.cold_dir:
+            for entry in cold:
+                if done():
+                    return
+                if self._move_cold(entry):
+                    result['freed'] += entry.size
+                    result['moved'] += 1
+
+    def _forget(self, entry):
+        with self._lock:
+            self._files.pop(entry.path, None)
+
+    # Réduire un original (sa date d'accès est conservée) ; renvoie les octets gagnés
+    def _recompress(self, entry):
+        if entry.path in self._small:
+            return 0
+        from PIL import Image
+
+        tmp_path = f"{entry.path}.tmp"
+        try:
+            with Image.open(entry.path) as image:
+                image_format = image.format
+                if max(image.size) <= self.recompress_size or image_format not in ('JPEG', 'PNG'):
+                    self._small.add(entry.path)
+                    return 0
+                image.thumbnail((self.recompress_size, self.recompress_size))
+                options = {'quality': self.recompress_quality} if image_format == 'JPEG' else {'optimize': True}
+                image.save(tmp_path, format=image_format, **options)
+            size = os.path.getsize(tmp_path)
+            if size >= entry.size:
+                os.unlink(tmp_path)
+                self._small.add(entry.path)
+                return 0
+            st = os.stat(entry.path)
+            os.replace(tmp_path, entry.path)
+            os.utime(entry.path, (st.st_atime, st.st_mtime))
+        except OSError as e:
+            self.log(f"stockage : réduction de {entry.path} impossible : {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return 0
+        self._small.add(entry.path)
+        saved = entry.size - size
+        entry.size = size
+        return saved
+
+    # Chemin d'un fichier du dossier dans le stockage froid
+    def cold_path(self, path):
+        return os.path.join(self.cold_dir, os.path.relpath(path, self.root))
+
+    def _move_cold(self, entry):
+        target = self.cold_path(entry.path)
+        tmp_path = f"{target}.tmp"
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Copie puis suppression : le stockage froid est souvent sur un autre disque
+            shutil.copy2(entry.path, tmp_path)
+            os.replace(tmp_path, target)
+            os.unlink(entry.path)
+        except OSError as e:
+            self.log(f"stockage : déplacement de {entry.path} impossible : {e}")
+            return False
+        self._forget(entry)
+        return True
+
+    # Copie froide d'un fichier absent du dossier (None s'il n'y en a pas)
+    def find_cold(self, path):
+        if not self.cold_dir:
+            return None
+        cold_path = self.cold_path(path)
+        return cold_path if os.path.isfile(cold_path) else None
+
+    def status(self):
+        self.scan()
+        with self._lock:
+            files = list(self._files.values())
+            extra = self._extra
+        derived = [f for f in files if f.derived]
+        used = sum(f.size for f in files) + extra
+        return {
+            'used': used,
+            'budget': self.budget or None,
+            'disk_free': self._disk_free(),
+            'min_free': self.min_free,
+            'originals': {'files': len(files) - len(derived), 'bytes': used - extra - sum(f.size for f in derived)},
+            'derived': {'files': len(derived), 'bytes': sum(f.size for f in derived)},
+            'in_progress': extra,
+            'cold_dir': self.cold_dir,
+            'last_reclaim': self.last_reclaim,
+        }
@@ -0,0 +1,715 @@
+# tripote_store.py
+# Lecture / écriture en flux du fichier d'avis, import et export en masse.
+import csv
+import io
+import itertools
+import json
+import os
+import secrets
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl
+except ImportError:  # Windows : le verrou reste propre à chaque processus
+    fcntl = None
+
+import tripote_snapshot
+import tripote_tracing
+from tripote_storage import StorageFull
+from tripote_replication import review_hash
+from tripote_columns import ColumnarReviews
+from tripote_rollups import RatingRollups
+
+DATE_FORMAT = '%d/%m/%Y %H:%M'
+REVIEW_FIELDS = ('name', 'rating', 'comment', 'title', 'date', 'image')
+
+# Taille des blocs lus sur le disque et taille des lots écrits
+READ_CHUNK_SIZE = 64 * 1024
+WRITE_BATCH_SIZE = 1000
+
+# Nom du membre contenant les avis dans une archive tar d'export
+TAR_REVIEWS_MEMBER = 'reviews.jsonl'
+
+
+# Parcourir les avis d'un fichier JSON (tableau) sans le charger en entier
+def iter_reviews_file(path, chunk_size=READ_CHUNK_SIZE):
+    if not os.path.exists(path):
+        return
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            # Sauter les blancs et les séparateurs entre deux éléments
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if not started and pos < len(buffer):
+                if buffer[pos] != '[':
+                    raise ValueError(f"{path}: un tableau JSON est attendu")
+                started = True
+                pos += 1
+                continue
+            if started and pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos >= len(buffer):
+                    raise ValueError
+                record, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # Élément incomplet : lire la suite du fichier
+                if eof:
+                    if buffer[pos:].strip():
+                        raise ValueError(f"{path}: fichier d'avis tronqué")
+                    return
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            pos = end
+            yield record
+
+
+# Écrire des avis dans un fichier JSON de façon atomique, par lots
+def write_reviews_file(path, reviews, batch_size=WRITE_BATCH_SIZE):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.reviews-', suffix='.tmp', dir=directory)
+    count = 0
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write('[')
+            batch = []
+            for review in reviews:
+                prefix = '\n' if count == 0 else ',\n'
+                batch.append(prefix + json.dumps(review, ensure_ascii=False))
+                count += 1
+                if len(batch) >= batch_size:
+                    f.write(''.join(batch))
+                    batch = []
+            f.write(''.join(batch))
+            f.write('\n]\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return count
+
+
+# Verrou d'écriture d'un fichier d'avis, partagé entre threads (verrou de
+# thread) et entre workers (flock sur un fichier <avis>.lock à côté)
+class WriteLock:
+    def __init__(self, path):
+        self.lock_file = f"{path}.lock"
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        self._fd = fd
+        return self
+
+    def __exit__(self, *exc_info):
+        # Fermer le fichier libère le flock
+        fd, self._fd = self._fd, None
+        os.close(fd)
+        self._lock.release()
+
+
+# Verrous d'écriture par fichier d'avis : un ReviewStore rouvert après une
+# éviction du cache des lieux reprend le verrou de l'ancien
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+
+def write_lock(path):
+    path = os.path.abspath(path)
+    with _write_locks_lock:
+        lock = _write_locks.get(path)
+        if lock is None:
+            lock = _write_locks[path] = WriteLock(path)
+        return lock
+
+
+# Calculer les statistiques des avis
+def calculate_stats(reviews):
+    if not reviews:
+        return {
+            'average': 0,
+            'count': 0,
+            'distribution': {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
+        }
+
+    distribution = {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
+    if isinstance(reviews, (tripote_snapshot.ReviewSnapshot, ColumnarReviews)):
+        # Les notes sont stockées à part (snapshot, colonnes) : pas de décodage des avis
+        ratings = bytes(reviews.ratings())
+        for key in distribution:
+            distribution[key] = ratings.count(key)
+    else:
+        for review in reviews:
+            distribution[review['rating']] += 1
+
+    total = sum(key * count for key, count in distribution.items())
+    average = total / len(reviews)
+
+    # Convertir en pourcentages
+    for key in distribution:
+        distribution[key] = (distribution[key] / len(reviews)) * 100
+
+    return {
+        'average': round(average, 1),
+        'count': len(reviews),
+        'distribution': distribution
+    }
+
+
+# Taille mémoire approximative d'une liste d'avis (les clés sont partagées)
+def reviews_memory_size(reviews):
+    if isinstance(reviews, ColumnarReviews):
+        return reviews.memory_size()
+    size = sys.getsizeof(reviews)
+    for review in reviews:
+        size += sys.getsizeof(review)
+        for value in review.values():
+            size += sys.getsizeof(value)
+    return size
+
+
+# Stockage des avis d'un lieu : reviews.json, ou snapshot binaire si `snapshot_file` est défini.
+# Les avis sont gardés en mémoire tant que le fichier n'a pas été réécrit (par ce
+# processus ou par un autre worker) ; avec `columnar`, ils le sont en colonnes
+# compactes (tripote_columns) plutôt qu'en liste de dict.
+class ReviewStore:
+    def __init__(self, reviews_file, snapshot_file=None, columnar=False):
+        self.reviews_file = reviews_file
+        self.snapshot_file = snapshot_file
+        self.columnar = columnar
+        self._lock = threading.Lock()
+        self._write_lock = write_lock(self.path)
+        self._reviews = None
+        self._stats = None
+        self._memory_size = 0
+        # Agrégats horaires/journaliers des notes, à côté du fichier d'avis
+        self.rollups = RatingRollups(os.path.splitext(self.path)[0] + '.rollups.json')
+        # Nombre d'avis et empreinte du dernier, pour la réplication
+        self.head_file = os.path.splitext(self.path)[0] + '.head.json'
+        # Appelé après chaque écriture, hors verrou (le LRU des lieux revérifie
+        # son plafond de mémoire quand un lieu chargé grandit)
+        self.on_write = lambda: None
+
+    @property
+    def path(self):
+        return self.snapshot_file or self.reviews_file
+
+    # Signature du fichier d'avis, qui change à chaque écriture
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    # Charger les avis (depuis le cache si le fichier n'a pas changé)
+    def load(self):
+        signature = self.signature()
+        with self._lock:
+            if self._reviews and self._reviews[0] == signature:
+                return self._reviews[1]
+        with tripote_tracing.span('store.load', path=self.path):
+            return self._load(signature)
+
+    def _load(self, signature):
+        if self.snapshot_file:
+            # Le snapshot est ouvert en mmap, les avis ne sont décodés qu'à la lecture
+            reviews = tripote_snapshot.open_snapshot(self.snapshot_file) or []
+            memory_size = sys.getsizeof(reviews)
+        elif self.columnar:
+            # Lecture en flux : la liste de dict n'est jamais construite
+            reviews = ColumnarReviews.from_reviews(iter_reviews_file(self.reviews_file))
+            memory_size = reviews.memory_size()
+        elif signature is not None:
+            with open(self.reviews_file, 'r') as f:
+                reviews = json.load(f)
+            memory_size = reviews_memory_size(reviews)
+        else:
+            reviews = []
+            memory_size = 0
+        with self._lock:
+            self._reviews = (signature, reviews)
+            self._memory_size = memory_size
+        return reviews
+
+    # Sauvegarder tous les avis
+    def save(self, reviews):
+        with self._write_lock:
+            self._save(reviews)
+        self.on_write()
+
+    def _save(self, reviews):
+        if self.snapshot_file:
+            tripote_snapshot.write_snapshot(self.snapshot_file, reviews)
+        else:
+            write_reviews_file(self.reviews_file, reviews)
+        self._write_head(reviews)
+
+    # Ajouter un avis
+    def append(self, review):
+        self.extend([review])
+
+    # Ajouter plusieurs avis en une seule écriture (réplication, lots).
+    # Avec `expected_len`, le lot n'est ajouté que si le lieu compte encore ce
+    # nombre d'avis sous le verrou d'écriture (un autre worker a pu appliquer le
+    # même lot entre-temps) ; renvoie False si le lot a été écarté
+    def extend(self, new_reviews, expected_len=None):
+        new_reviews = list(new_reviews)
+        if not new_reviews:
+            return True
+        if not self._extend(new_reviews, expected_len):
+            return False
+        self.on_write()
+        return True
+
+    def _extend(self, new_reviews, expected_len):
+        with self._write_lock, tripote_tracing.span('store.write', path=self.path, count=len(new_reviews)):
+            if expected_len is not None and len(self.load()) != expected_len:
+                return False
+            if self.snapshot_file:
+                tripote_snapshot.append_snapshot(self.snapshot_file, new_reviews)
+                self._write_head(self.load())
+            elif self.columnar:
+                self._extend_columnar(new_reviews)
+            else:
+                reviews = list(self.load())
+                reviews.extend(new_reviews)
+                self._save(reviews)
+                with self._lock:
+                    self._reviews = (self.signature(), reviews)
+                    self._memory_size += reviews_memory_size(new_reviews)
+        return True
+
+    def _extend_columnar(self, new_reviews):
+        reviews = self.load()
+        write_reviews_file(self.reviews_file, itertools.chain(reviews, new_reviews))
+        # Les colonnes ne font que grandir : les avis sont ajoutés sur place
+        with self._lock:
+            for review in new_reviews:
+                reviews.append(review)
+            self._reviews = (self.signature(), reviews)
+            self._memory_size = reviews.memory_size()
+        self._write_head(reviews)
+
+    # Enregistrer l'en-tête (nombre d'avis, empreinte du dernier) du fichier
+    # qui vient d'être écrit ; il n'est valable que pour cette version du fichier
+    def _write_head(self, reviews, signature=None):
+        head = {
+            'seq': len(reviews),
+            'last': review_hash(reviews[-1]) if reviews else None,
+            'signature': signature or self.signature(),
+        }
+        directory = os.path.dirname(os.path.abspath(self.head_file))
+        fd, tmp_path = tempfile.mkstemp(prefix='.head-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(head, f)
+            os.replace(tmp_path, self.head_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return head
+
+    # Nombre d'avis et empreinte du dernier {'seq': n, 'last': ...}, lus dans
+    # l'en-tête sans charger les avis (rechargés seulement si le fichier a été
+    # réécrit sans mise à jour de l'en-tête : import, copie à la main...)
+    def head(self):
+        signature = self.signature()
+        if signature is None:
+            return {'seq': 0, 'last': None}
+        try:
+            with open(self.head_file, 'r') as f:
+                head = json.load(f)
+            if head.get('signature') == list(signature):
+                return {'seq': head['seq'], 'last': head['last']}
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        with self._write_lock:
+            reviews = self.load()
+            with self._lock:
+                signature = self._reviews[0]
+            head = self._write_head(reviews, signature)
+        return {'seq': head['seq'], 'last': head['last']}
+
+    # Statistiques, recalculées seulement quand le fichier change
+    def stats(self):
+        signature = self.signature()
+        with self._lock:
+            if self._stats and self._stats[0] == signature:
+                return self._stats[1]
+        reviews = self.load()
+        with tripote_tracing.span('store.stats', count=len(reviews)):
+            stats = calculate_stats(reviews)
+        with self._lock:
+            self._stats = (signature, stats)
+        return stats
+
+    # Mettre à jour les agrégats de notes avec les avis ajoutés depuis la dernière fois
+    def sync_rollups(self):
+        return self.rollups.sync(self.load())
+
+    # Tendance des notes par tranche ('hour' ou 'day') entre deux dates, d'après
+    # les agrégats tels qu'ils sont (mis à jour par la tâche 'rollups')
+    def trend(self, bucket, start, end):
+        return self.rollups.trend(bucket, start, end)
+
+    # Fichier et fonctions de lecture/écriture en flux (import/export)
+    def io(self):
+        if self.snapshot_file:
+            return self.snapshot_file, tripote_snapshot.iter_snapshot_file, tripote_snapshot.write_snapshot
+        return self.reviews_file, iter_reviews_file, write_reviews_file
+
+    # Réécrire le fichier d'avis avec `rewrite(path, reader, writer)` (import en
+    # masse) sous le verrou d'écriture : un avis ajouté pendant ce temps n'est pas perdu
+    def rewrite(self, rewrite):
+        path, reader, writer = self.io()
+        with self._write_lock, tripote_tracing.span('store.write', path=path):
+            result = rewrite(path, reader, writer)
+            self.unload()
+        self.on_write()
+        return result
+
+    # Mémoire occupée par les avis chargés
+    def memory_size(self):
+        return self._memory_size if self._reviews else 0
+
+    # Avis gardés en mémoire et leur forme (sans charger le fichier)
+    def usage(self):
+        with self._lock:
+            reviews = self._reviews[1] if self._reviews else None
+            memory_size = self._memory_size if reviews is not None else 0
+        if reviews is None:
+            kind = None
+        elif self.snapshot_file:
+            kind = 'snapshot'
+        else:
+            kind = 'columns' if isinstance(reviews, ColumnarReviews) else 'dicts'
+        return {
+            'path': self.path,
+            'kind': kind,
+            'reviews': len(reviews) if reviews is not None else 0,
+            'memory': memory_size,
+        }
+
+    # Libérer les avis gardés en mémoire
+    def unload(self):
+        with self._lock:
+            self._reviews = None
+            self._stats = None
+            self._memory_size = 0
+
+
+# Le chemin d'image ("/static/uploads/x.jpg") désigne-t-il un fichier directement
+# dans `folder` (ni ailleurs sur le disque, ni dans un sous-dossier) ?
+def image_in_folder(image, folder):
+    local_path = os.path.normpath(image.lstrip('/'))
+    return os.path.dirname(local_path) == os.path.normpath(folder)
+
+
+# Enregistrement illisible dans un fichier importé (ligne JSON invalide),
+# rejeté à la validation comme un avis incomplet
+class RejectedRecord:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+# Vérifier et normaliser un avis importé (`upload_folder` : dossier où doivent se trouver les images)
+def validate_review(record, title_for, upload_folder=None):
+    if isinstance(record, RejectedRecord):
+        raise ValueError(record.reason)
+    if not isinstance(record, dict):
+        raise ValueError("l'avis doit être un objet")
+    name = record.get('name')
+    comment = record.get('comment')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("nom manquant")
+    if not isinstance(comment, str) or not comment.strip():
+        raise ValueError("commentaire manquant")
+    try:
+        rating = int(record.get('rating'))
+    except (TypeError, ValueError):
+        raise ValueError("note invalide")
+    if not 1 <= rating <= 5:
+        raise ValueError("la note doit être comprise entre 1 et 5")
+
+    date = record.get('date') or datetime.now().strftime(DATE_FORMAT)
+    try:
+        # '1/7/2024 9:05' est accepté et réécrit '01/07/2024 09:05'
+        date = datetime.strptime(date, DATE_FORMAT).strftime(DATE_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError(f"date invalide: {date!r}")
+
+    image = record.get('image') or None
+    if image is not None and not isinstance(image, str):
+        raise ValueError("chemin d'image invalide")
+    if image is not None and upload_folder is not None and not image_in_folder(image, upload_folder):
+        raise ValueError(f"image hors du dossier des photos: {image!r}")
+
+    return {
+        'name': name,
+        'rating': rating,
+        'comment': comment,
+        'title': record.get('title') or title_for(rating),
+        'date': date,
+        'image': image
+    }
+
+
+# Découper un flux binaire en lignes, par blocs (plus rapide que readline sur un flux brut)
+def iter_lines(stream, chunk_size=READ_CHUNK_SIZE):
+    pending = b''
+    while True:
+        block = stream.read(chunk_size)
+        if not block:
+            break
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+# Lire des avis au format JSON Lines depuis un flux binaire ; une ligne
+# illisible donne un RejectedRecord (avec son numéro) au lieu d'arrêter l'import
+def iter_jsonl(stream):
+    for number, line in enumerate(iter_lines(stream), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield RejectedRecord(f"ligne {number}: JSON invalide ({e})")
+
+
+# Lire des avis au format CSV depuis un flux texte
+def iter_csv(stream):
+    for row in csv.DictReader(stream):
+        yield row
+
+
+# Ouvrir un flux binaire en texte UTF-8 (pour le corps d'une requête par exemple)
+def text_stream(binary_stream):
+    return io.TextIOWrapper(binary_stream, encoding='utf-8', newline='')
+
+
+# Importer des avis en les ajoutant à la suite du fichier existant. Les images
+# doivent être dans `upload_folder` ; avec `image_folder` (archive tar), elles
+# y sont rattachées d'après leur nom de fichier, renommé par `image_name`.
+def import_reviews(path, records, title_for, image_folder=None, reader=iter_reviews_file,
+                   writer=write_reviews_file, upload_folder=None, image_name=None):
+    stats = {'imported': 0, 'rejected': 0, 'errors': []}
+
+    def validated():
+        for index, record in enumerate(records, start=1):
+            try:
+                review = validate_review(record, title_for, None if image_folder else upload_folder)
+            except ValueError as e:
+                stats['rejected'] += 1
+                if len(stats['errors']) < 20:
+                    stats['errors'].append(f"enregistrement {index}: {e}")
+                continue
+            if image_folder and review['image']:
+                # Rattacher l'image au dossier d'upload de cette instance
+                filename = secure_filename(os.path.basename(review['image']))
+                if filename and image_name:
+                    filename = image_name(filename)
+                review['image'] = f"/{image_folder}/{filename}" if filename else None
+            stats['imported'] += 1
+            yield review
+
+    def merged():
+        yield from reader(path)
+        yield from validated()
+
+    stats['total'] = writer(path, merged())
+    return stats
+
+
+# Exporter les avis en JSON Lines, ligne par ligne
+def export_jsonl(path, reader=iter_reviews_file):
+    for review in reader(path):
+        yield json.dumps(review, ensure_ascii=False) + '\n'
+
+
+# Exporter les avis en CSV, par lots de lignes
+def export_csv(path, batch_size=WRITE_BATCH_SIZE, reader=iter_reviews_file):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=REVIEW_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for index, review in enumerate(reader(path), start=1):
+        writer.writerow(review)
+        if index % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Fichier minimal qui renvoie les blocs écrits par tarfile au lieu de les garder
+class _ChunkSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return b''.join(chunks)
+
+
+# Exporter les avis et les images référencées dans une archive tar en flux
+# (seules les images du dossier `upload_folder` sont jointes)
+def export_tar(path, upload_folder, root='.', reader=iter_reviews_file):
+    import tarfile
+
+    sink = _ChunkSink()
+    archive = tarfile.open(fileobj=sink, mode='w|')
+
+    # Les avis passent par un fichier temporaire (déversé sur disque au-delà de 8 Mo)
+    images = []
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+        for review in reader(path):
+            spool.write((json.dumps(review, ensure_ascii=False) + '\n').encode('utf-8'))
+            if review.get('image'):
+                images.append(review['image'])
+        info = tarfile.TarInfo(TAR_REVIEWS_MEMBER)
+        info.size = spool.tell()
+        info.mtime = int(datetime.now().timestamp())
+        spool.seek(0)
+        archive.addfile(info, spool)
+    yield sink.drain()
+
+    seen = set()
+    for image in images:
+        if not image_in_folder(image, upload_folder):
+            continue
+        filepath = os.path.join(root, image.lstrip('/'))
+        name = os.path.basename(filepath)
+        if name in seen or not os.path.isfile(filepath):
+            continue
+        seen.add(name)
+        archive.add(filepath, arcname=f"images/{name}", recursive=False)
+        yield sink.drain()
+
+    archive.close()
+    yield sink.drain()
+
+
+# Créer un fichier vide au nom libre le plus proche de `filename` dans `folder`
+# (suffixe aléatoire en cas de collision) ; renvoie le nom retenu
+def claim_filename(folder, filename):
+    stem, ext = os.path.splitext(filename)
+    candidate = filename
+    while True:
+        try:
+            os.close(os.open(os.path.join(folder, candidate), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            return candidate
+        except FileExistsError:
+            candidate = f"{stem}_{secrets.token_hex(4)}{ext}"
+
+
+# Importer une archive tar produite par export_tar (avis puis images). Chaque
+# image reçoit un nom libre dans `upload_folder` (une photo existante du même
+# nom n'est jamais écrasée) et passe par le budget disque de `storage`.
+def import_tar(path, fileobj, title_for, upload_folder, reader=iter_reviews_file,
+               writer=write_reviews_file, storage=None):
+    import tarfile
+
+    stats = None
+    images = 0
+    image_errors = []
+    # Nom dans l'archive -> nom retenu dans le dossier ; les fichiers vides
+    # réservés pour des images absentes de l'archive sont retirés à la fin
+    claimed = {}
+    written = set()
+
+    def image_name(filename):
+        if filename not in claimed:
+            claimed[filename] = claim_filename(upload_folder, filename)
+        return claimed[filename]
+
+    os.makedirs(upload_folder, exist_ok=True)
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                if member.name == TAR_REVIEWS_MEMBER and member.isfile():
+                    stats = import_reviews(path, iter_jsonl(archive.extractfile(member)), title_for,
+                                           image_folder=upload_folder, reader=reader, writer=writer,
+                                           image_name=image_name)
+                elif member.name.startswith('images/') and member.isfile():
+                    filename = secure_filename(os.path.basename(member.name))
+                    if not filename:
+                        continue
+                    # Image qu'aucun avis importé ne référence : inutile de la garder
+                    if stats is not None and filename not in claimed:
+                        continue
+                    target = os.path.join(upload_folder, image_name(filename))
+                    if target in written:
+                        continue
+                    try:
+                        if storage is not None:
+                            storage.reserve(member.size)
+                    except StorageFull as e:
+                        image_errors.append(f"image {filename}: {e}")
+                        continue
+                    _extract_image(archive.extractfile(member), target)
+                    written.add(target)
+                    if storage is not None:
+                        storage.added(target)
+                    images += 1
+    except tarfile.TarError as e:
+        raise ValueError(f"archive tar invalide: {e}")
+    finally:
+        for name in claimed.values():
+            target = os.path.join(upload_folder, name)
+            if target not in written:
+                os.unlink(target)
+    if stats is None:
+        raise ValueError(f"archive sans fichier {TAR_REVIEWS_MEMBER}")
+    stats['images'] = images
+    stats['errors'].extend(image_errors[:max(0, 20 - len(stats['errors']))])
+    return stats
+
+
+# Écrire une image extraite à la place du fichier vide réservé pour elle
+def _extract_image(source, target):
+    directory = os.path.dirname(target)
+    fd, tmp_path = tempfile.mkstemp(prefix='.import-', suffix='.part', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                block = source.read(READ_CHUNK_SIZE)
+                if not block:
+                    break
+                out.write(block)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
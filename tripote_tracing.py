@@ -0,0 +1,209 @@
+# tripote_tracing.py
+# Traces par requête : chaque requête reçoit un identifiant et un arbre de
+# segments (lecture/écriture des avis, statistiques, QR Code, rendu...). Les
+# requêtes plus lentes qu'un seuil sont écrites avec leur arbre complet dans
+# un journal JSON lines tournant, et optionnellement dans un fichier au format
+# OTLP/JSON d'OpenTelemetry (lisible par le receiver « otlpjsonfile » du
+# collecteur).
+#
+# En dehors d'une requête (tâches en arrière-plan, commandes), span() ne fait rien.
+import contextvars
+import json
+import logging
+import logging.handlers
+import secrets
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+DEFAULT_THRESHOLD_MS = 1000
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+SERVICE_NAME = 'tripote-visor'
+
+# Types de segment OpenTelemetry
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+_current = contextvars.ContextVar('tripote_trace', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end', 'attributes')
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.perf_counter_ns()
+        self.end = None
+        self.attributes = attributes
+
+
+class Trace:
+    def __init__(self, name, request_id=None, **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.request_id = request_id or self.trace_id[:16]
+        self.start_unix_ns = time.time_ns()
+        self.spans = []
+        self._stack = []
+        self.root = self.open(name, attributes)
+
+    def open(self, name, attributes):
+        parent_id = self._stack[-1].span_id if self._stack else None
+        span = Span(name, parent_id, attributes)
+        self.spans.append(span)
+        self._stack.append(span)
+        return span
+
+    def close(self, span):
+        span.end = time.perf_counter_ns()
+        if self._stack and self._stack[-1] is span:
+            self._stack.pop()
+        elif span in self._stack:
+            self._stack.remove(span)
+
+    @property
+    def duration_ms(self):
+        end = self.root.end if self.root.end is not None else time.perf_counter_ns()
+        return (end - self.root.start) / 1e6
+
+    def _unix_ns(self, perf_ns):
+        return self.start_unix_ns + (perf_ns - self.root.start)
+
+    # Arbre des segments, durées en millisecondes depuis le début de la requête
+    def to_dict(self):
+        nodes = {}
+        for span in self.spans:
+            end = span.end if span.end is not None else time.perf_counter_ns()
+            nodes[span.span_id] = {
+                'name': span.name,
+                'start_ms': round((span.start - self.root.start) / 1e6, 3),
+                'duration_ms': round((end - span.start) / 1e6, 3),
+                'attributes': span.attributes,
+                'children': [],
+            }
+        for span in self.spans:
+            if span.parent_id in nodes:
+                nodes[span.parent_id]['children'].append(nodes[span.span_id])
+        return {
+            'request_id': self.request_id,
+            'trace_id': self.trace_id,
+            'start': self.start_unix_ns / 1e9,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.root.attributes,
+            'spans': nodes[self.root.span_id],
+        }
+
+    # Même trace au format OTLP/JSON (ExportTraceServiceRequest)
+    def to_otlp(self):
+        spans = []
+        for span in self.spans:
+            end = span.end if span.end is not None else time.perf_counter_ns()
+            item = {
+                'traceId': self.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': SPAN_KIND_SERVER if span is self.root else SPAN_KIND_INTERNAL,
+                'startTimeUnixNano': str(self._unix_ns(span.start)),
+                'endTimeUnixNano': str(self._unix_ns(end)),
+                'attributes': [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+            }
+            if span.parent_id:
+                item['parentSpanId'] = span.parent_id
+            spans.append(item)
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+            'scopeSpans': [{'scope': {'name': 'tripote_tracing'}, 'spans': spans}],
+        }]}
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+# Commencer la trace d'une requête
+def start(name, request_id=None, **attributes):
+    trace = Trace(name, request_id, **attributes)
+    _current.set(trace)
+    return trace
+
+
+# Terminer une trace (les attributs s'ajoutent au segment racine)
+def finish(trace, **attributes):
+    trace.root.attributes.update(attributes)
+    trace.close(trace.root)
+    if _current.get() is trace:
+        _current.set(None)
+    return trace
+
+
+def current():
+    return _current.get()
+
+
+# Segment autour d'une opération : with span('store.load', path=...): ...
+@contextmanager
+def span(name, **attributes):
+    trace = _current.get()
+    if trace is None:
+        yield None
+        return
+    segment = trace.open(name, attributes)
+    try:
+        yield segment
+    except BaseException as e:
+        segment.attributes['error'] = type(e).__name__
+        raise
+    finally:
+        trace.close(segment)
+
+
+# Décorateur : un segment à chaque appel de la fonction
+def traced(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _rotating_logger(name, path, max_bytes, backups):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True,
+                                                       encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+# Journal des requêtes lentes (JSON lines, fichiers tournants)
+class SlowRequestLog:
+    def __init__(self, path, threshold_ms=DEFAULT_THRESHOLD_MS, max_bytes=DEFAULT_MAX_BYTES,
+                 backups=DEFAULT_BACKUPS, otlp_path=None):
+        self.threshold_ms = threshold_ms
+        self._log = _rotating_logger(f'tripote.slow.{path}', path, max_bytes, backups)
+        self._otlp = _rotating_logger(f'tripote.otlp.{otlp_path}', otlp_path, max_bytes, backups) \
+            if otlp_path else None
+
+    # Enregistrer la trace si la requête a dépassé le seuil ; renvoie True si c'est le cas
+    def record(self, trace):
+        if trace.duration_ms < self.threshold_ms:
+            return False
+        self._log.info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+        if self._otlp is not None:
+            self._otlp.info(json.dumps(trace.to_otlp(), separators=(',', ':'), default=str))
+        return True
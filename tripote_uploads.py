@@ -0,0 +1,285 @@
+# tripote_uploads.py
+# Envoi de photos par morceaux, avec reprise après une coupure réseau.
+#
+# Protocole (voir les routes /uploads dans tripote_visor_server.py) :
+#   1. init      : nom du fichier et taille totale -> identifiant de session
+#   2. append    : morceau envoyé à un offset donné (doit être l'offset courant)
+#   3. status    : offset courant, pour reprendre après une coupure
+#   4. finalize  : vérifie la taille (et le SHA-256 s'il a été annoncé)
+#   5. claim     : la photo finalisée est déplacée vers le dossier du lieu
+#                  au moment où l'avis est publié, sous un nom qui ne peut
+#                  écraser aucune photo (horodatage, suffixe aléatoire)
+#
+# Chaque session est un fichier partiel <id>.part et ses métadonnées <id>.json
+# dans `directory` ; les sessions abandonnées sont supprimées après `ttl`.
+import errno
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_TTL = 24 * 3600
+GC_INTERVAL = 600
+
+# Premiers octets attendus selon l'extension
+MAGIC_BYTES = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Placer `source` dans `folder` sous un nom libre (horodatage, suffixe
+# aléatoire, nom d'origine) ; os.link échoue si le nom existe déjà, aucune
+# photo n'est donc écrasée. Renvoie le nom retenu.
+def _place(source, folder, original_name):
+    try:
+        filename = _link_unique(source, folder, original_name)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Dossier des envois sur un autre système de fichiers : copie dans le
+        # dossier de destination, puis lien sous le nom définitif
+        fd, tmp_path = tempfile.mkstemp(prefix='.claim-', suffix='.part', dir=folder)
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmp_path)
+            os.chmod(tmp_path, 0o644)
+            filename = _link_unique(tmp_path, folder, original_name)
+        finally:
+            os.unlink(tmp_path)
+    os.unlink(source)
+    return filename
+
+
+def _link_unique(source, folder, original_name):
+    while True:
+        filename = f"{datetime.now():%Y%m%d_%H%M%S}_{secrets.token_hex(4)}_{original_name}"
+        try:
+            os.link(source, os.path.join(folder, filename))
+            return filename
+        except FileExistsError:
+            continue
+
+
+class ChunkedUploads:
+    def __init__(self, directory, max_size, max_chunk=DEFAULT_CHUNK_SIZE, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_chunk = max_chunk
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._last_gc = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, upload_id):
+        if not SESSION_ID.match(upload_id or ''):
+            raise UploadError("identifiant d'envoi invalide", 404)
+        base = os.path.join(self.directory, upload_id)
+        return base + '.part', base + '.json'
+
+    def _read_meta(self, upload_id, owner):
+        part_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise UploadError("envoi inconnu ou expiré", 404)
+        if meta['owner'] != owner:
+            raise UploadError("envoi inconnu ou expiré", 404)
+        return meta, part_path, meta_path
+
+    @staticmethod
+    def _write_meta(meta_path, meta):
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    # Ouvrir une session d'envoi
+    def init(self, filename, size, owner, allowed_extensions, sha256=None):
+        self.maybe_gc()
+        filename = secure_filename(filename or '')
+        extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        if extension not in allowed_extensions:
+            raise UploadError("type de fichier non autorisé")
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("taille invalide")
+        if size > self.max_size:
+            raise UploadError("fichier trop volumineux", 413)
+        if sha256 is not None and not re.match(r'^[0-9a-f]{64}$', str(sha256)):
+            raise UploadError("empreinte SHA-256 invalide")
+
+        upload_id = secrets.token_urlsafe(18)
+        part_path, meta_path = self._paths(upload_id)
+        open(part_path, 'wb').close()
+        meta = {
+            'id': upload_id,
+            'filename': filename,
+            'extension': extension,
+            'size': size,
+            'sha256': sha256,
+            'owner': owner,
+            'created': time.time(),
+            'complete': False,
+        }
+        self._write_meta(meta_path, meta)
+        return self._status(meta, 0)
+
+    def _status(self, meta, offset):
+        return {
+            'upload_id': meta['id'],
+            'offset': offset,
+            'size': meta['size'],
+            'chunk_size': self.max_chunk,
+            'complete': meta['complete'],
+        }
+
+    # Où en est l'envoi (pour reprendre après une coupure)
+    def status(self, upload_id, owner):
+        meta, part_path, _ = self._read_meta(upload_id, owner)
+        return self._status(meta, os.path.getsize(part_path))
+
+    # Ajouter un morceau ; `offset` doit être la taille déjà reçue
+    def append(self, upload_id, owner, offset, data, chunk_sha256=None):
+        meta, part_path, _ = self._read_meta(upload_id, owner)
+        if meta['complete']:
+            raise UploadError("envoi déjà finalisé", 409)
+        if not data:
+            raise UploadError("morceau vide")
+        if len(data) > self.max_chunk:
+            raise UploadError("morceau trop volumineux", 413)
+        if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+            raise UploadError("morceau corrompu (SHA-256 différent)", 422)
+
+        with open(part_path, 'r+b') as f:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            received = os.fstat(f.fileno()).st_size
+            if offset != received:
+                # Le client reprend depuis l'offset renvoyé
+                raise UploadError(f"offset attendu: {received}", 409)
+            if received + len(data) > meta['size']:
+                raise UploadError("données au-delà de la taille annoncée", 413)
+            if received == 0 and not data.startswith(MAGIC_BYTES[meta['extension']]):
+                raise UploadError("le contenu ne correspond pas au type d'image", 415)
+            f.seek(received)
+            f.write(data)
+            f.flush()
+            received += len(data)
+        # Date de dernière activité, pour le ramasse-miettes
+        os.utime(self._paths(upload_id)[1])
+        return self._status(meta, received)
+
+    # Vérifier que tout est arrivé
+    def finalize(self, upload_id, owner):
+        meta, part_path, meta_path = self._read_meta(upload_id, owner)
+        received = os.path.getsize(part_path)
+        if received != meta['size']:
+            raise UploadError(f"envoi incomplet ({received}/{meta['size']} octets)", 409)
+        if meta['sha256'] and not meta['complete']:
+            digest = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b''):
+                    digest.update(block)
+            if digest.hexdigest() != meta['sha256']:
+                raise UploadError("fichier corrompu (SHA-256 différent)", 422)
+        meta['complete'] = True
+        self._write_meta(meta_path, meta)
+        return self._status(meta, received)
+
+    # Déplacer une photo finalisée dans `folder` ; renvoie son nom de fichier
+    def claim(self, upload_id, owner, folder):
+        meta, part_path, meta_path = self._read_meta(upload_id, owner)
+        if not meta['complete']:
+            raise UploadError("envoi non finalisé", 409)
+        # Le renommage sur place est atomique : si deux avis réclament la même
+        # photo en même temps, un seul l'obtient (le fichier orphelin d'un
+        # déplacement interrompu est supprimé par gc())
+        claimed_path = part_path[:-len('.part')] + '.claimed.part'
+        try:
+            os.rename(part_path, claimed_path)
+        except FileNotFoundError:
+            raise UploadError("photo déjà jointe à un avis", 409)
+        filename = _place(claimed_path, folder, meta['filename'])
+        try:
+            os.unlink(meta_path)
+        except FileNotFoundError:
+            pass
+        return filename
+
+    # Sessions en cours et octets déjà reçus sur le disque
+    def usage(self):
+        sessions = 0
+        received = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                sessions += 1
+            elif entry.name.endswith('.part'):
+                try:
+                    received += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+        return {'sessions': sessions, 'bytes': received}
+
+    # Supprimer les sessions abandonnées
+    def gc(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.part'):
+                # Fichier partiel resté sans métadonnées
+                part_path = os.path.join(self.directory, name)
+                meta_path = part_path[:-len('.part')] + '.json'
+                try:
+                    if not os.path.exists(meta_path) and now - os.path.getmtime(part_path) >= self.ttl:
+                        os.unlink(part_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(meta_path) < self.ttl:
+                    continue
+                os.unlink(meta_path)
+            except FileNotFoundError:
+                continue
+            try:
+                os.unlink(meta_path[:-len('.json')] + '.part')
+            except FileNotFoundError:
+                pass
+            removed += 1
+        return removed
+
+    # Ramasse-miettes au plus toutes les GC_INTERVAL secondes
+    def maybe_gc(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_gc < GC_INTERVAL:
+                return
+            self._last_gc = now
+        self.gc(now)
@@ -1,16 +1,68 @@
 # tripote_visor_server.py
+import hashlib
+import hmac
 import json
 import os
-from flask import Flask, render_template_string, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, jsonify, Response, g, \
+    send_from_directory, session, stream_template, get_flashed_messages
+import math
+import re
+import secrets
 import socket
-import qrcode
-from io import BytesIO
-import base64
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 from werkzeug.utils import secure_filename
+from markupsafe import Markup
+import click
+import tripote_store
+import tripote_snapshot
+import tripote_ratelimit
+import tripote_listings
+import tripote_rollups
+import tripote_api
+import tripote_assets
+import tripote_uploads
+import tripote_jobs
+import tripote_analytics
+import tripote_replication
+import tripote_publish
+import tripote_tracing
+import tripote_memory
+import tripote_storage
+import tripote_votes
+from tripote_store import ReviewStore, calculate_stats
+from tripote_columns import ColumnarReviews
 
 app = Flask(__name__)
-app.secret_key = 'votre_cle_secrete_ici'  # Nécessaire pour flash messages
+
+# Clé secrète (messages flash, signature du cookie invité) : TRIPOTE_SECRET_KEY,
+# sinon un fichier propre à l'installation, créé au premier démarrage
+SECRET_KEY_FILE = os.environ.get('TRIPOTE_SECRET_KEY_FILE', 'secret_key')
+PLACEHOLDER_SECRET_KEYS = {'', 'votre_cle_secrete_ici'}
+
+def load_secret_key():
+    key = os.environ.get('TRIPOTE_SECRET_KEY')
+    if key is None:
+        if not os.path.exists(SECRET_KEY_FILE):
+            # Écrite à part puis liée : un autre worker lit une clé complète ou rien
+            tmp_path = f"{SECRET_KEY_FILE}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            try:
+                os.link(tmp_path, SECRET_KEY_FILE)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(tmp_path)
+        with open(SECRET_KEY_FILE, 'r') as f:
+            key = f.read().strip()
+    if key in PLACEHOLDER_SECRET_KEYS:
+        raise RuntimeError("clé secrète vide ou d'exemple : définissez TRIPOTE_SECRET_KEY "
+                           f"(ou laissez le serveur générer {SECRET_KEY_FILE})")
+    return key
+
+app.secret_key = load_secret_key()
 
 # Configuration pour le téléchargement d'images
 UPLOAD_FOLDER = 'static/uploads'
@@ -24,49 +76,217 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # Fichier pour stocker les avis
 REVIEWS_FILE = 'reviews.json'
 
+# Envois de photos par morceaux en cours (fichiers partiels)
+PARTIAL_UPLOAD_FOLDER = os.environ.get('TRIPOTE_PARTIAL_UPLOADS', 'uploads.partial')
+# Taille maximale d'un morceau et durée de vie d'un envoi abandonné
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SESSION_TTL = int(os.environ.get('TRIPOTE_UPLOAD_TTL', 24 * 3600))
+
+# Budget disque des photos (0 : pas de budget) et espace libre à toujours garder sur le disque
+STORAGE_BUDGET = int(os.environ.get('TRIPOTE_STORAGE_BUDGET_MB', 0)) * 1024 * 1024
+STORAGE_MIN_FREE = int(os.environ.get('TRIPOTE_STORAGE_MIN_FREE_MB', 50)) * 1024 * 1024
+# Originaux non servis depuis N jours : réduits (qualité JPEG, 0 : jamais) et/ou
+# déplacés vers un stockage secondaire
+COLD_AFTER_DAYS = float(os.environ.get('TRIPOTE_COLD_AFTER_DAYS', 30))
+RECOMPRESS_QUALITY = int(os.environ.get('TRIPOTE_RECOMPRESS_QUALITY', 0))
+COLD_STORAGE_DIR = os.environ.get('TRIPOTE_COLD_STORAGE')
+
+# Snapshot binaire optionnel, utilisé à la place de reviews.json s'il est défini
+REVIEWS_SNAPSHOT = os.environ.get('TRIPOTE_SNAPSHOT')
+
+# Moyenne bayésienne : note a priori et poids (en nombre d'avis fictifs)
+PRIOR_MEAN = float(os.environ.get('TRIPOTE_PRIOR_MEAN', tripote_analytics.DEFAULT_PRIOR_MEAN))
+PRIOR_WEIGHT = int(os.environ.get('TRIPOTE_PRIOR_WEIGHT', tripote_analytics.DEFAULT_PRIOR_WEIGHT))
+
+# Avis gardés en mémoire en colonnes compactes plutôt qu'en liste de dict
+REVIEWS_COLUMNAR = os.environ.get('TRIPOTE_COLUMNAR', '0') == '1'
+
+# Lieux supplémentaires servis sous /l/<slug>/
+LISTINGS_DIR = os.environ.get('TRIPOTE_LISTINGS_DIR', 'listings')
+# Mémoire maximale des avis gardés chargés pour ces lieux (en Mo)
+LISTINGS_MEMORY_CAP = int(os.environ.get('TRIPOTE_LISTINGS_MEMORY_MB', 256)) * 1024 * 1024
+
+# Fiche du lieu principal, et valeurs par défaut des autres lieux
+DEFAULT_LISTING = {
+    'title': "Appartement Parisien Charmant - Le Marais",
+    'page_title': "Mon Appartement Parisien",
+    'breadcrumb': ["Europe", "France", "Île-de-France", "Paris", "Hébergements Paris"],
+    'description': [
+        "Bienvenue dans cet appartement parisien spacieux et lumineux situé en plein cœur du Marais, l'un des quartiers les plus animés et historiques de Paris. À proximité de la Place des Vosges, du Centre Pompidou et de nombreux sites emblématiques, c'est l'endroit idéal pour découvrir la ville.",
+        "Cet appartement de 75m² dispose de deux chambres, une cuisine entièrement équipée, un salon confortable avec canapé-lit et une salle de bain moderne. La connexion Wi-Fi haut débit est incluse.",
+        "Idéalement situé à moins de 5 minutes à pied de la station de métro, vous serez à 10 minutes de Notre-Dame et à 15 minutes du Louvre. De nombreux restaurants, cafés et boutiques se trouvent à proximité immédiate.",
+    ],
+    'amenities': [
+        ["wifi", "Wi-Fi haute vitesse"],
+        ["tv", "Télévision intelligente"],
+        ["utensils", "Cuisine équipée"],
+        ["snowflake", "Climatisation"],
+        ["parking", "Parking à proximité"],
+        ["tshirt", "Lave-linge"],
+        ["soap", "Produits de toilette"],
+        ["concierge-bell", "Service de ménage"],
+    ],
+    'location': "Paris, France",
+    'price': "120€",
+    'dates': "15 août - 20 août",
+    'guests': "2 adultes",
+}
+
+# Copies locales de Font Awesome et des photos (flask vendor-assets)
+VENDOR_DIR = os.path.join(app.static_folder, 'vendor')
+# Durée de cache des fichiers copiés (leur nom change avec leur contenu)
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Envoi de la page en flux : l'en-tête et le haut de page partent tout de suite,
+# les avis suivent par blocs de STREAM_CHUNK_SIZE octets
+STREAM_PAGES = os.environ.get('TRIPOTE_STREAM_PAGES', '1') == '1'
+STREAM_CHUNK_SIZE = 16 * 1024
+# Repère placé par le template après le haut de page
+STREAM_FLUSH_MARKER = '<!--flush-->'
+
+# Caches à préparer avant de servir (ex: "qr,template,stats" ou "all")
+WARMUP = os.environ.get('TRIPOTE_WARMUP', '')
+
+# Modules lourds qui ne doivent pas être importés au démarrage
+LAZY_MODULES = ('qrcode', 'PIL', 'tarfile', 'numpy')
+
+# Limites de débit par client, au format "quantité/secondes"
+RATE_LIMIT_SUBMISSIONS = os.environ.get('TRIPOTE_RATE_SUBMISSIONS', '5/60')
+RATE_LIMIT_UPLOAD_BYTES = os.environ.get('TRIPOTE_RATE_UPLOAD_BYTES', f'{64 * 1024 * 1024}/600')
+# Clé de limitation : 'ip' ou 'guest' (cookie invité, avec repli sur l'IP)
+RATE_LIMIT_KEY = os.environ.get('TRIPOTE_RATE_KEY', 'ip')
+# En mode 'guest', nombre d'invités qui se partagent le budget d'une même IP
+RATE_LIMIT_GUESTS_PER_IP = float(os.environ.get('TRIPOTE_RATE_GUESTS_PER_IP', '10'))
+# Dossier des fichiers partagés entre workers pour la limitation
+RATE_LIMIT_DIR = os.environ.get('TRIPOTE_RATE_DIR', '.')
+REVIEW_ENDPOINTS = {'add_review', 'listing_add_review'}
+# Routes qui comptent comme une soumission (avis, ouverture d'un envoi de photo par morceaux)
+RATE_LIMITED_ENDPOINTS = REVIEW_ENDPOINTS | {'upload_init'}
+# Au-delà de cette taille, un avis porte une photo : la place est vérifiée avant de le lire
+TEXT_REVIEW_MAX_BYTES = 64 * 1024
+# Routes dont seul le volume envoyé est compté (morceaux de photos)
+UPLOAD_LIMITED_ENDPOINTS = {'upload_chunk'}
+# Votes « utile », limités par IP (un invité qui change de cookie peut revoter)
+RATE_LIMIT_VOTES = os.environ.get('TRIPOTE_RATE_VOTES', '30/60')
+VOTE_LIMITED_ENDPOINTS = {'helpful_vote', 'listing_helpful_vote'}
+
+# Cookie identifiant un invité
+GUEST_COOKIE = 'tripote_guest'
+
+# File de tâches en arrière-plan (agrégats, caches, miniatures) et nombre de workers
+JOBS_DIR = os.environ.get('TRIPOTE_JOBS_DIR', 'jobs')
+JOB_WORKERS = int(os.environ.get('TRIPOTE_JOB_WORKERS', 2))
+# Taille maximale des miniatures des photos d'avis et leur dossier, à côté des
+# photos (dossier caché : il ne peut pas être confondu avec celui d'un lieu)
+THUMBNAIL_SIZE = (600, 600)
+THUMBNAIL_FOLDER = tripote_storage.DERIVED_FOLDERS[0]
+
+# Réplication : adresse du writer (ce serveur devient alors un follower), jeton
+# partagé entre les serveurs et intervalle de synchronisation en secondes
+WRITER_URL = os.environ.get('TRIPOTE_WRITER_URL')
+REPLICATION_TOKEN = os.environ.get('TRIPOTE_REPLICATION_TOKEN')
+REPLICATION_INTERVAL = float(os.environ.get('TRIPOTE_REPLICATION_INTERVAL', tripote_replication.DEFAULT_INTERVAL))
+
+# Mode publication : pages statiques régénérées à chaque nouvel avis dans ce dossier
+PUBLISH_DIR = os.environ.get('TRIPOTE_PUBLISH_DIR')
+PUBLISH_PER_PAGE = int(os.environ.get('TRIPOTE_PUBLISH_PER_PAGE', tripote_publish.DEFAULT_PER_PAGE))
+
+# Traces par requête : les requêtes plus lentes que le seuil (en ms) sont écrites
+# avec leurs segments dans un journal JSON lines tournant, et au format OTLP/JSON
+# d'OpenTelemetry si TRIPOTE_TRACE_OTLP est défini
+TRACING = os.environ.get('TRIPOTE_TRACING', '1') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('TRIPOTE_SLOW_REQUEST_MS', tripote_tracing.DEFAULT_THRESHOLD_MS))
+SLOW_REQUEST_LOG = os.environ.get('TRIPOTE_SLOW_LOG', 'slow_requests.jsonl')
+TRACE_OTLP_FILE = os.environ.get('TRIPOTE_TRACE_OTLP')
+
+# Votes « utile » : intervalle d'écriture des compteurs (secondes)
+VOTE_FLUSH_INTERVAL = float(os.environ.get('TRIPOTE_VOTE_FLUSH', tripote_votes.DEFAULT_FLUSH_INTERVAL))
+
+# Diagnostic mémoire : tracemalloc démarré dès le lancement avec N appels par
+# allocation (0 : seulement à la demande, par /admin/memory/start)
+TRACEMALLOC_FRAMES = int(os.environ.get('TRIPOTE_TRACEMALLOC', 0))
+
+# Jeton pour les routes d'administration (sans jeton : accès local uniquement)
+ADMIN_TOKEN = os.environ.get('TRIPOTE_ADMIN_TOKEN')
+
+# Lieu principal (servi sous /) et registre des autres lieux
+default_listing = tripote_listings.Listing(None, DEFAULT_LISTING,
+                                           ReviewStore(REVIEWS_FILE, REVIEWS_SNAPSHOT, columnar=REVIEWS_COLUMNAR),
+                                           UPLOAD_FOLDER)
+# (les compteurs de votes d'un lieu retiré du LRU sont écrits puis oubliés)
+listings = tripote_listings.ListingRegistry(LISTINGS_DIR, UPLOAD_FOLDER, DEFAULT_LISTING,
+                                            memory_cap=LISTINGS_MEMORY_CAP, columnar=REVIEWS_COLUMNAR,
+                                            on_evict=lambda listing: helpful_votes.drop(listing.store))
+
+# Sessions d'envoi de photos par morceaux
+chunked_uploads = tripote_uploads.ChunkedUploads(PARTIAL_UPLOAD_FOLDER, app.config['MAX_CONTENT_LENGTH'],
+                                                 max_chunk=UPLOAD_CHUNK_SIZE, ttl=UPLOAD_SESSION_TTL)
+
+# Budget disque du dossier des photos (envois en cours compris)
+storage = tripote_storage.StorageManager(UPLOAD_FOLDER, budget=STORAGE_BUDGET, min_free=STORAGE_MIN_FREE,
+                                         cold_dir=COLD_STORAGE_DIR, cold_after=COLD_AFTER_DAYS * 24 * 3600,
+                                         recompress_quality=RECOMPRESS_QUALITY or None,
+                                         extra_dirs=(PARTIAL_UPLOAD_FOLDER,), log=app.logger.warning)
+
+# Votes « utile » de tous les lieux
+helpful_votes = tripote_votes.HelpfulVotes(flush_interval=VOTE_FLUSH_INTERVAL, log=app.logger.warning)
+
+# Journal des requêtes lentes
+slow_requests = tripote_tracing.SlowRequestLog(SLOW_REQUEST_LOG, threshold_ms=SLOW_REQUEST_MS,
+                                               otlp_path=TRACE_OTLP_FILE) if TRACING else None
+
+# Ouvrir la trace de la requête (avant les autres hooks, pour les compter aussi)
+@app.before_request
+def start_trace():
+    if slow_requests is None:
+        return
+    request_id = request.headers.get('X-Request-Id', '')[:64] or None
+    g.trace = tripote_tracing.start('request', request_id, method=request.method, path=request.path)
+
+# La trace est terminée quand la réponse a été entièrement envoyée (pages en flux)
+@app.after_request
+def finish_trace(response):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    response.headers['X-Request-Id'] = trace.request_id
+    attributes = {'status': response.status_code, 'endpoint': request.endpoint or ''}
+    response.call_on_close(lambda: slow_requests.record(tripote_tracing.finish(trace, **attributes)))
+    return response
+
+# Requête interrompue par une exception : la trace est écrite tout de suite
+@app.teardown_request
+def abort_trace(exc):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        slow_requests.record(tripote_tracing.finish(trace, status=500, error=type(exc).__name__ if exc else ''))
+
+# Instantanés mémoire pris par les routes /admin/memory
+memory = tripote_memory.MemoryDiagnostics()
+if TRACEMALLOC_FRAMES:
+    memory.start(TRACEMALLOC_FRAMES)
+
+# Tâches lancées après la publication d'un avis
+jobs = tripote_jobs.JobQueue(JOBS_DIR, workers=JOB_WORKERS, log=app.logger.warning)
+
+# Lieu correspondant au slug (ou le lieu principal), None s'il n'existe pas
+def find_listing(slug=None):
+    if slug is None:
+        return default_listing
+    return listings.get(slug)
+
+# Lieu correspondant au slug (ou le lieu principal), 404 s'il n'existe pas
+def get_listing(slug=None):
+    listing = find_listing(slug)
+    if listing is None:
+        abort(404)
+    return listing
+
 # Vérifier si le fichier est une image autorisée
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Charger les avis existants
-def load_reviews():
-    if os.path.exists(REVIEWS_FILE):
-        with open(REVIEWS_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-# Sauvegarder les avis
-def save_reviews(reviews):
-    with open(REVIEWS_FILE, 'w') as f:
-        json.dump(reviews, f, indent=4)
-
-# Calculer les statistiques des avis
-def calculate_stats(reviews):
-    if not reviews:
-        return {
-            'average': 0,
-            'count': 0,
-            'distribution': {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
-        }
-
-    total = sum(review['rating'] for review in reviews)
-    average = total / len(reviews)
-
-    distribution = {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
-    for review in reviews:
-        distribution[review['rating']] += 1
-
-    # Convertir en pourcentages
-    for key in distribution:
-        distribution[key] = (distribution[key] / len(reviews)) * 100
-
-    return {
-        'average': round(average, 1),
-        'count': len(reviews),
-        'distribution': distribution
-    }
-
 # Générer un titre en fonction de la note
 def generate_review_title(rating):
     titles = {
@@ -78,8 +298,14 @@ def generate_review_title(rating):
     }
     return titles.get(rating, "Avis sur le séjour")
 
-# Générer le QR Code
+# Générer le QR Code (qrcode et Pillow ne sont importés qu'ici)
+@lru_cache(maxsize=256)
+@tripote_tracing.traced('qr.generate')
 def generate_qr_code(url):
+    import base64
+    from io import BytesIO
+    import qrcode
+
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -95,6 +321,7 @@ def generate_qr_code(url):
     return base64.b64encode(buffered.getvalue()).decode()
 
 # Obtenir l'adresse IP locale correcte
+@tripote_tracing.traced('ip.lookup')
 def get_local_ip():
     try:
         # Créer une socket pour se connecter à un serveur externe
@@ -115,8 +342,8 @@ HTML_TEMPLATE = """
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Mon Appartement Parisien - Tripote Visor</title>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
+    <title>{{ listing.page_title }} - Tripote Visor</title>
+    <link rel="stylesheet" href="{{ asset_url('font-awesome.css') }}">
     <style>
         :root {
             --main-color: #34E0A1;
@@ -257,31 +484,31 @@ HTML_TEMPLATE = """
 
         .main-photo {
             grid-row: span 2;
-            background-image: url('https://images.unsplash.com/photo-1522708323590-d24dbb6b0267?ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D&auto=format&fit=crop&w=1200&q=80');
+            background-image: url('{{ asset_url('main-photo', 1200) }}');
             background-size: cover;
             background-position: center;
         }
 
         .photo-2 {
-            background-image: url('https://images.unsplash.com/photo-1584622650111-993a426fbf0a?ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D&auto=format&fit=crop&w=600&q=80');
+            background-image: url('{{ asset_url('photo-2', 600) }}');
             background-size: cover;
             background-position: center;
         }
 
         .photo-3 {
-            background-image: url('https://images.unsplash.com/photo-1560448204-e02f11c3d0e2?ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D&auto=format&fit=crop&w=600&q=80');
+            background-image: url('{{ asset_url('photo-3', 600) }}');
             background-size: cover;
             background-position: center;
         }
 
         .photo-4 {
-            background-image: url('https://images.unsplash.com/photo-1567767292278-a4f21aa2d36e?ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D&auto=format&fit=crop&w=600&q=80');
+            background-image: url('{{ asset_url('photo-4', 600) }}');
             background-size: cover;
             background-position: center;
         }
 
         .photo-5 {
-            background-image: url('https://images.unsplash.com/photo-1616594039964-ae902f0c1497?ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D&auto=format&fit=crop&w=600&q=80');
+            background-image: url('{{ asset_url('photo-5', 600) }}');
             background-size: cover;
             background-position: center;
             position: relative;
@@ -491,6 +718,48 @@ HTML_TEMPLATE = """
             box-shadow: 0 2px 8px rgba(0,0,0,0.1);
         }
 
+        .helpful-button {
+            background: none;
+            border: 1px solid var(--border-color);
+            border-radius: 16px;
+            padding: 4px 12px;
+            color: var(--light-text);
+            cursor: pointer;
+            font-size: 14px;
+        }
+
+        .helpful-button:disabled {
+            color: var(--main-color);
+            cursor: default;
+        }
+
+        .review-sort {
+            margin-bottom: 10px;
+            font-size: 14px;
+        }
+
+        .review-sort a {
+            color: var(--light-text);
+        }
+
+        .review-sort a.active {
+            color: var(--dark-text);
+            font-weight: 600;
+            text-decoration: none;
+        }
+
+        .pagination {
+            display: flex;
+            justify-content: space-between;
+            margin-top: 20px;
+        }
+
+        .pagination a {
+            color: var(--dark-text);
+            font-weight: 600;
+            text-decoration: none;
+        }
+
         /* Review Form */
         .review-form-container {
             background-color: var(--background-light);
@@ -713,6 +982,26 @@ HTML_TEMPLATE = """
         }
 
         @media (max-width: 768px) {
+            .main-photo {
+                background-image: url('{{ asset_url('main-photo', 800) }}');
+            }
+
+            .photo-2 {
+                background-image: url('{{ asset_url('photo-2', 400) }}');
+            }
+
+            .photo-3 {
+                background-image: url('{{ asset_url('photo-3', 400) }}');
+            }
+
+            .photo-4 {
+                background-image: url('{{ asset_url('photo-4', 400) }}');
+            }
+
+            .photo-5 {
+                background-image: url('{{ asset_url('photo-5', 400) }}');
+            }
+
             .header-content {
                 flex-direction: column;
                 text-align: center;
@@ -781,19 +1070,19 @@ HTML_TEMPLATE = """
 
         <div class="hero">
             <div class="breadcrumb">
-                <a href="#">Europe</a> <span>&gt;</span>
-                <a href="#">France</a> <span>&gt;</span>
-                <a href="#">Île-de-France</a> <span>&gt;</span>
-                <a href="#">Paris</a> <span>&gt;</span>
-                <a href="#">Hébergements Paris</a>
+                {% for crumb in listing.breadcrumb %}
+                <a href="#">{{ crumb }}</a>{% if not loop.last %} <span>&gt;</span>{% endif %}
+                {% endfor %}
             </div>
 
-            <h1 class="hotel-title">Appartement Parisien Charmant - Le Marais</h1>
+            <h1 class="hotel-title">{{ listing.title }}</h1>
 
+            {% if stats %}
             <div class="hotel-info">
                 <div class="rating-badge">{{ stats.average }}</div>
                 <div class="review-count">{{ stats.count }} avis</div>
             </div>
+            {% endif %}
 
             <div class="photo-gallery">
                 <div class="main-photo"></div>
@@ -805,33 +1094,30 @@ HTML_TEMPLATE = """
                 </div>
             </div>
         </div>
+        {{ flush_marker }}
 
         <div class="main-content">
             <div class="left-column">
                 <div class="details-section">
                     <h2 class="section-title">À propos de ce lieu</h2>
                     <div class="about-place">
-                        <p>Bienvenue dans cet appartement parisien spacieux et lumineux situé en plein cœur du Marais, l'un des quartiers les plus animés et historiques de Paris. À proximité de la Place des Vosges, du Centre Pompidou et de nombreux sites emblématiques, c'est l'endroit idéal pour découvrir la ville.</p>
-                        <p>Cet appartement de 75m² dispose de deux chambres, une cuisine entièrement équipée, un salon confortable avec canapé-lit et une salle de bain moderne. La connexion Wi-Fi haut débit est incluse.</p>
-                        <p>Idéalement situé à moins de 5 minutes à pied de la station de métro, vous serez à 10 minutes de Notre-Dame et à 15 minutes du Louvre. De nombreux restaurants, cafés et boutiques se trouvent à proximité immédiate.</p>
+                        {% for paragraph in listing.description %}
+                        <p>{{ paragraph }}</p>
+                        {% endfor %}
                     </div>
 
                     <h3 class="section-title">Équipements</h3>
                     <div class="amenities">
-                        <div class="amenity"><i class="fas fa-wifi"></i> Wi-Fi haute vitesse</div>
-                        <div class="amenity"><i class="fas fa-tv"></i> Télévision intelligente</div>
-                        <div class="amenity"><i class="fas fa-utensils"></i> Cuisine équipée</div>
-                        <div class="amenity"><i class="fas fa-snowflake"></i> Climatisation</div>
-                        <div class="amenity"><i class="fas fa-parking"></i> Parking à proximité</div>
-                        <div class="amenity"><i class="fas fa-tshirt"></i> Lave-linge</div>
-                        <div class="amenity"><i class="fas fa-soap"></i> Produits de toilette</div>
-                        <div class="amenity"><i class="fas fa-concierge-bell"></i> Service de ménage</div>
+                        {% for icon, label in listing.amenities %}
+                        <div class="amenity"><i class="fas fa-{{ icon }}"></i> {{ label }}</div>
+                        {% endfor %}
                     </div>
                 </div>
 
                 <div class="reviews-section">
-                    <h2 class="section-title">Avis des voyageurs</h2>
+                    <h2 class="section-title">Avis des voyageurs{% if pagination and pagination.page %} - page {{ pagination.page }}{% endif %}</h2>
 
+                    {% if stats %}
                     <div class="review-summary">
                         <div class="overall-rating">
                             <div class="rating-score">{{ stats.average }}</div>
@@ -887,16 +1173,25 @@ HTML_TEMPLATE = """
                             </div>
                         </div>
                     </div>
+                    {% endif %}
+
+                    {% if helpful and reviews %}
+                    <div class="review-sort">
+                        <a href="?" class="{{ '' if sort == 'helpful' else 'active' }}">Par date</a> ·
+                        <a href="?sort=helpful" class="{{ 'active' if sort == 'helpful' else '' }}">Les plus utiles</a>
+                    </div>
+                    {% endif %}
 
                     {% if reviews %}
                         {% for review in reviews %}
-                        <div class="review">
+                        {% set review_id = review.id if review.id is defined else loop.index0 %}
+                        <div class="review" id="avis-{{ review_id }}">
                             <div class="review-header">
                                 <div class="reviewer-info">
                                     <div class="avatar">{{ review.name[0] }}</div>
                                     <div>
                                         <div class="reviewer-name">{{ review.name }}</div>
-                                        <div class="review-location">Paris, France</div>
+                                        <div class="review-location">{{ listing.location }}</div>
                                     </div>
                                 </div>
                                 <div class="review-date">{{ review.date }}</div>
@@ -916,19 +1211,33 @@ HTML_TEMPLATE = """
                             </div>
                             {% if review.image %}
                             <div class="review-image">
-                                <img src="{{ review.image }}" alt="Photo du séjour">
+                                <img src="{{ image_variant(review.image) }}" alt="Photo du séjour" loading="lazy">
                             </div>
                             {% endif %}
+                            {% if helpful %}
+                            <form class="helpful-form" action="{{ helpful_prefix }}{{ review_id }}/helpful{{ '?sort=helpful' if sort == 'helpful' else '' }}" method="POST">
+                                <button type="submit" class="helpful-button"><i class="far fa-thumbs-up"></i> Utile
+                                    <span class="helpful-count">{{ helpful.count(review_id) or '' }}</span></button>
+                            </form>
+                            {% endif %}
                         </div>
                         {% endfor %}
                     {% else %}
                         <p>Soyez le premier à laisser un commentaire !</p>
                     {% endif %}
+
+                    {% if pagination %}
+                    <nav class="pagination">
+                        {% if pagination.previous %}<a href="{{ pagination.previous }}">&laquo; Avis précédents</a>{% else %}<span></span>{% endif %}
+                        {% if pagination.next %}<a href="{{ pagination.next }}">{{ pagination.next_label }} &raquo;</a>{% endif %}
+                    </nav>
+                    {% endif %}
                 </div>
 
                 <div class="review-form-container">
                     <h2 class="section-title">Écrire un avis</h2>
-                    <form action="/add_review" method="POST" enctype="multipart/form-data">
+                    <form id="review-form" action="{{ url_for('listing_add_review', slug=listing.slug) if listing.slug else url_for('add_review') }}" method="POST" enctype="multipart/form-data">
+                        <input type="hidden" id="upload_id" name="upload_id">
                         <div class="form-group">
                             <label for="name">Votre nom</label>
                             <input type="text" id="name" name="name" required>
@@ -967,16 +1276,16 @@ HTML_TEMPLATE = """
 
             <div class="sidebar">
                 <div class="booking-card">
-                    <div class="price">120€ <span class="price-period">/ nuit</span></div>
+                    <div class="price">{{ listing.price }} <span class="price-period">/ nuit</span></div>
 
                     <div class="booking-info">
                         <div class="info-item">
                             <span class="info-label">Dates</span>
-                            <span class="info-value">15 août - 20 août</span>
+                            <span class="info-value">{{ listing.dates }}</span>
                         </div>
                         <div class="info-item">
                             <span class="info-label">Voyageurs</span>
-                            <span class="info-value">2 adultes</span>
+                            <span class="info-value">{{ listing.guests }}</span>
                         </div>
                     </div>
 
@@ -1038,71 +1347,1415 @@ HTML_TEMPLATE = """
             </div>
         </div>
     </footer>
+    <script>
+        // Envoi de la photo par morceaux avant de publier l'avis, avec reprise
+        // après une coupure (l'envoi en cours est retrouvé même après rechargement)
+        (function () {
+            const form = document.getElementById('review-form');
+            const input = document.getElementById('image');
+            const button = form.querySelector('button[type="submit"]');
+            const uploadsUrl = "{{ url_for('upload_init') }}";
+            if (!window.fetch || !window.localStorage) {
+                return;
+            }
+
+            const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+            async function call(method, url, body, headers) {
+                const response = await fetch(url, {method, body, headers: headers || {}, credentials: 'same-origin'});
+                const data = await response.json().catch(() => ({}));
+                if (!response.ok) {
+                    const error = new Error(data.error || response.statusText);
+                    error.status = response.status;
+                    throw error;
+                }
+                return data;
+            }
+
+            async function upload(file) {
+                const key = `tripote-upload:${file.name}:${file.size}:${file.lastModified}`;
+                let state = null;
+                const savedId = localStorage.getItem(key);
+                if (savedId) {
+                    state = await call('GET', `${uploadsUrl}/${savedId}`).catch(() => null);
+                }
+                if (!state) {
+                    state = await call('POST', uploadsUrl, JSON.stringify({filename: file.name, size: file.size}),
+                                       {'Content-Type': 'application/json'});
+                    localStorage.setItem(key, state.upload_id);
+                }
+
+                let failures = 0;
+                while (state.offset < state.size) {
+                    const end = Math.min(state.offset + state.chunk_size, state.size);
+                    try {
+                        state = await call('PUT', `${uploadsUrl}/${state.upload_id}?offset=${state.offset}`,
+                                           file.slice(state.offset, end));
+                        failures = 0;
+                        button.textContent = `Envoi de la photo... ${Math.round(100 * state.offset / state.size)}%`;
+                    } catch (error) {
+                        // Erreur définitive (fichier refusé) : inutile de réessayer
+                        const retryable = !error.status || error.status === 409 || error.status === 429 || error.status >= 500;
+                        if (!retryable || ++failures > 8) {
+                            throw error;
+                        }
+                        await sleep(Math.min(30000, 500 * 2 ** failures));
+                        // Reprendre à l'offset réellement reçu par le serveur
+                        state = await call('GET', `${uploadsUrl}/${state.upload_id}`).catch(() => state);
+                    }
+                }
+                await call('POST', `${uploadsUrl}/${state.upload_id}/finalize`);
+                localStorage.removeItem(key);
+                return state.upload_id;
+            }
+
+            form.addEventListener('submit', (event) => {
+                if (!input.files.length) {
+                    return;
+                }
+                event.preventDefault();
+                const label = button.innerHTML;
+                button.disabled = true;
+                upload(input.files[0]).then((uploadId) => {
+                    document.getElementById('upload_id').value = uploadId;
+                    // Le fichier est déjà sur le serveur : ne pas le renvoyer avec le formulaire
+                    input.disabled = true;
+                    form.submit();
+                }).catch((error) => {
+                    button.disabled = false;
+                    button.innerHTML = label;
+                    alert(`La photo n'a pas pu être envoyée : ${error.message}`);
+                });
+            });
+        })();
+
+        // Vote « utile » sans recharger la page
+        (function () {
+            if (!window.fetch) {
+                return;
+            }
+            document.addEventListener('submit', (event) => {
+                const form = event.target;
+                if (!form.classList.contains('helpful-form')) {
+                    return;
+                }
+                event.preventDefault();
+                const button = form.querySelector('button');
+                button.disabled = true;
+                fetch(form.action, {method: 'POST', headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+                    .then((response) => response.json())
+                    .then((data) => {
+                        form.querySelector('.helpful-count').textContent = data.helpful || '';
+                    })
+                    .catch(() => {
+                        button.disabled = false;
+                    });
+            });
+        })();
+    </script>
 </body>
 </html>
 """
 
+# Manifeste des ressources copiées localement (vide tant que vendor-assets n'a pas tourné)
+@lru_cache(maxsize=1)
+def get_asset_manifest():
+    return tripote_assets.load_manifest(VENDOR_DIR)
+
+# URL d'une ressource : copie locale si elle existe, sinon le CDN d'origine
+# (Markup : l'URL est aussi utilisée dans le <style>, où &amp; ne serait pas décodé)
+def asset_url(name, width=None):
+    filename = get_asset_manifest().get(tripote_assets.manifest_key(name, width))
+    if filename:
+        return Markup(url_for('vendored_asset', filename=filename))
+    return Markup(tripote_assets.cdn_url(name, width))
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+# Chemin de la miniature d'une photo d'avis ("/static/uploads/x.jpg" -> fichier local)
+def thumbnail_path(image_path):
+    folder, filename = os.path.split(image_path.lstrip('/'))
+    return os.path.join(folder, THUMBNAIL_FOLDER, filename)
+
+# Miniature d'une photo si la tâche l'a déjà produite, sinon la photo d'origine
+def image_variant(image_path):
+    if image_path and os.path.exists(thumbnail_path(image_path)):
+        return f"/{thumbnail_path(image_path)}"
+    return image_path
+
+app.jinja_env.globals['image_variant'] = image_variant
+
+# Ressources copiées, servies avec un cache long
+@app.route('/assets/<path:filename>')
+def vendored_asset(filename):
+    response = send_from_directory(VENDOR_DIR, filename, max_age=ASSET_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+# Template compilé une seule fois (render_template_string le recompile à chaque appel)
+@lru_cache(maxsize=1)
+def get_template():
+    return app.jinja_env.from_string(HTML_TEMPLATE)
+
+# URL du serveur (ou d'un lieu), telle qu'encodée dans le QR Code
+def get_server_url(listing=None):
+    ip_address = get_local_ip()
+    port = os.environ.get('PORT', 3000)
+    if listing is not None and listing.slug:
+        return f"http://{ip_address}:{port}/l/{listing.slug}/"
+    return f"http://{ip_address}:{port}"
+
+# Préparer les caches avant que le worker ne serve des requêtes
+# (à appeler depuis le hook post_worker_init de gunicorn par exemple)
+def warm_up(parts=WARMUP):
+    parts = {part.strip() for part in parts.split(',') if part.strip()}
+    if 'all' in parts:
+        parts = {'qr', 'template', 'stats', 'jobs'}
+    if 'qr' in parts:
+        generate_qr_code(get_server_url())
+    if 'template' in parts:
+        get_template()
+    if 'stats' in parts:
+        default_listing.store.stats()
+    if 'jobs' in parts:
+        # Reprendre les tâches restées en attente avant un redémarrage
+        jobs.start()
+    return sorted(parts)
+
 # Page d'accueil avec les avis
 @app.route('/')
 def index():
-    reviews = load_reviews()
-    stats = calculate_stats(reviews)
+    return render_listing(default_listing)
+
+# Page d'un lieu hébergé sous /l/<slug>/
+@app.route('/l/<slug>/')
+def listing_index(slug):
+    return render_listing(get_listing(slug))
+
+def render_listing(listing):
+    # En mode publication, la page statique est servie telle quelle (sauf s'il
+    # reste un message à afficher, après la publication d'un avis par exemple)
+    sort = request.args.get('sort')
+    if publisher is not None and not session.get('_flashes') and sort is None:
+        response = published_file(listing, 'index.html')
+        if response is not None:
+            return response
+
+    reviews = listing.store.load()
+    stats = listing.store.stats()
+    if sort == 'helpful':
+        votes = helpful_votes.counter(listing.store)
+        reviews = tripote_votes.HelpfulOrder(reviews, votes)
+    else:
+        votes = helpful_votes.view(listing.store)
 
     # Obtenir l'adresse IP locale correcte
-    ip_address = get_local_ip()
-    port = os.environ.get('PORT', 3000)
-
-    server_url = f"http://{ip_address}:{port}"
+    server_url = get_server_url(listing)
     qr_code_data = generate_qr_code(server_url)
 
-    return render_template_string(HTML_TEMPLATE, reviews=reviews, stats=stats, qr_code=qr_code_data, server_url=server_url)
+    context = dict(listing=listing, reviews=reviews, stats=stats, qr_code=qr_code_data, server_url=server_url,
+                   helpful=votes, helpful_prefix=listing_url(listing) + 'reviews/', sort=sort)
+    if STREAM_PAGES:
+        # Lire les messages maintenant : la session ne peut plus être enregistrée
+        # une fois les en-têtes envoyés
+        get_flashed_messages(with_categories=True)
+        pieces = stream_template(get_template(), flush_marker=Markup(STREAM_FLUSH_MARKER), **context)
+        return Response(stream_page(pieces), mimetype='text/html')
+    with tripote_tracing.span('render', reviews=len(reviews)):
+        return render_template(get_template(), **context)
+
+# Rendu en flux : tout ce qui précède le repère part d'un coup, puis des blocs
+# d'environ STREAM_CHUNK_SIZE octets (la page n'est jamais entière en mémoire)
+def stream_page(pieces, chunk_size=STREAM_CHUNK_SIZE):
+    with tripote_tracing.span('render', streamed=True):
+        yield from _stream_chunks(pieces, chunk_size)
+
+def _stream_chunks(pieces, chunk_size):
+    buffer = []
+    size = 0
+    top_sent = False
+    for piece in pieces:
+        flush = STREAM_FLUSH_MARKER in piece
+        if flush:
+            piece = piece.replace(STREAM_FLUSH_MARKER, '')
+            top_sent = True
+        buffer.append(piece)
+        size += len(piece)
+        if flush or (top_sent and size >= chunk_size):
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+# Tendance des notes : /stats/trend?bucket=hour&from=2024-07-14&to=2024-07-15T06:00
+@app.route('/stats/trend')
+def stats_trend():
+    return listing_trend(default_listing)
+
+@app.route('/l/<slug>/stats/trend')
+def listing_stats_trend(slug):
+    return listing_trend(get_listing(slug))
+
+# Lieux dont les agrégats ont déjà été demandés à la file de tâches par ce processus
+rollups_requested = set()
+
+def listing_trend(listing):
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in tripote_rollups.BUCKETS:
+        return jsonify({'error': "bucket doit valoir 'hour' ou 'day'"}), 400
+    now = datetime.now()
+    try:
+        # Un fuseau explicite (`from=...+02:00`) est ramené à l'heure locale des avis
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else now
+        end = tripote_rollups.local_time(end)
+        if request.args.get('from'):
+            start = tripote_rollups.local_time(datetime.fromisoformat(request.args['from']))
+        else:
+            start = end - (timedelta(hours=23) if bucket == 'hour' else timedelta(days=29))
+        points = listing.store.trend(bucket, start, end)
+    except (ValueError, OverflowError) as e:
+        return jsonify({'error': str(e)}), 400
+    counted = listing.store.rollups.counted()
+    if counted is None and listing.slug not in rollups_requested:
+        # Agrégats jamais calculés (avis importés avant leur mise en place) : la
+        # tâche les construit, la lecture ne touche jamais aux avis
+        rollups_requested.add(listing.slug)
+        jobs.enqueue('rollups', {'listing': listing.slug})
+    return jsonify({
+        'bucket': bucket,
+        'from': start.isoformat(timespec='minutes'),
+        'to': end.isoformat(timespec='minutes'),
+        'counted': counted or 0,
+        'rejected': listing.store.rollups.rejected(),
+        'points': points,
+    })
+
+# Réponses JSON déjà sérialisées, par version du stockage
+api_cache = tripote_api.ResponseCache()
+
+# Réponse JSON mise en cache, avec ETag (304 si le client a déjà cette version)
+def cached_json(listing, kind, params, build):
+    etag, body = api_cache.get(listing.store, kind, params, build)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Avis paginés en JSON : /api/reviews?page=1&per_page=20
+@app.route('/api/reviews')
+def api_reviews():
+    return listing_api_reviews(default_listing)
+
+@app.route('/l/<slug>/api/reviews')
+def listing_api_reviews_route(slug):
+    return listing_api_reviews(get_listing(slug))
+
+def listing_api_reviews(listing):
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', tripote_api.DEFAULT_PER_PAGE, type=int)
+    per_page = min(max(per_page, 1), tripote_api.MAX_PER_PAGE)
+    if request.args.get('sort') == 'helpful':
+        # Les votes changent sans que le fichier d'avis change : pas de cache
+        votes = helpful_votes.counter(listing.store)
+        return Response(tripote_api.dumps(tripote_api.reviews_payload(listing.store, page, per_page, votes)),
+                        mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+    return cached_json(listing, 'reviews', (page, per_page),
+                       lambda: tripote_api.reviews_payload(listing.store, page, per_page))
+
+# Statistiques en JSON
+@app.route('/api/stats')
+def api_stats():
+    return listing_api_stats(default_listing)
+
+@app.route('/l/<slug>/api/stats')
+def listing_api_stats_route(slug):
+    return listing_api_stats(get_listing(slug))
+
+def listing_api_stats(listing):
+    return cached_json(listing, 'stats', (), lambda: tripote_api.stats_payload(listing.store))
+
+# Statistiques détaillées (médiane, percentiles, moyenne bayésienne...)
+@app.route('/api/stats/extended')
+def api_stats_extended():
+    return listing_api_stats_extended(default_listing)
+
+@app.route('/l/<slug>/api/stats/extended')
+def listing_api_stats_extended_route(slug):
+    return listing_api_stats_extended(get_listing(slug))
+
+def listing_analytics(listing):
+    return tripote_analytics.rating_analytics(listing.store.load(), prior_mean=PRIOR_MEAN,
+                                              prior_weight=PRIOR_WEIGHT)
+
+def listing_api_stats_extended(listing):
+    return cached_json(listing, 'analytics', (), lambda: listing_analytics(listing))
 
 # Soumission d'un nouvel avis
 @app.route('/add_review', methods=['POST'])
 def add_review():
+    return submit_review(default_listing)
+
+@app.route('/l/<slug>/add_review', methods=['POST'])
+def listing_add_review(slug):
+    return submit_review(get_listing(slug))
+
+def submit_review(listing):
     name = request.form.get('name')
     rating = request.form.get('rating')
     comment = request.form.get('comment')
     image_file = request.files.get('image')
+    upload_id = request.form.get('upload_id')
 
     if name and rating and comment:
-        reviews = load_reviews()
+        try:
+            rating = int(rating)
+        except ValueError:
+            rating = None
+        if rating is None or not 1 <= rating <= 5:
+            return review_result(listing, 'La note doit être comprise entre 1 et 5.', 400)
 
         # Gérer l'image téléchargée
         image_path = None
-        if image_file and allowed_file(image_file.filename):
+        if upload_id:
+            # Photo déjà envoyée par morceaux et finalisée
+            try:
+                with tripote_tracing.span('image.save', source='upload'):
+                    filename = chunked_uploads.claim(upload_id, get_guest_id(), listing.upload_folder)
+            except tripote_uploads.UploadError as e:
+                return review_result(listing, f"La photo n'a pas pu être jointe : {e}", e.status)
+            image_path = f"/{os.path.join(listing.upload_folder, filename)}"
+            storage.added(image_path.lstrip('/'))
+        elif image_file and allowed_file(image_file.filename):
             filename = secure_filename(image_file.filename)
             # Ajouter un timestamp pour éviter les conflits de noms
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
             filename = timestamp + filename
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            image_file.save(filepath)
+            filepath = os.path.join(listing.upload_folder, filename)
+            with tripote_tracing.span('image.save', source='form'):
+                image_file.save(filepath)
+            storage.added(filepath)
             image_path = f"/{filepath}"
 
-        # Ajouter l'avis
-        reviews.append({
+        if follower is not None:
+            # Follower : l'avis est enregistré par le writer, puis répliqué ici
+            return forward_review(listing, name, rating, comment, image_path)
+
+        # Ajouter l'avis (seule écriture faite pendant la requête)
+        listing.store.append({
             'name': name,
-            'rating': int(rating),
+            'rating': rating,
             'comment': comment,
-            'title': generate_review_title(int(rating)),
+            'title': generate_review_title(rating),
             'date': datetime.now().strftime('%d/%m/%Y %H:%M'),
             'image': image_path
         })
-        save_reviews(reviews)
-
-        flash('Votre avis a été publié avec succès!', 'success')
+        enqueue_review_jobs(listing, [image_path] if image_path else [])
+        return review_result(listing, 'Votre avis a été publié avec succès!', 201)
+
+    return review_result(listing, 'Veuillez remplir tous les champs obligatoires.', 400)
+
+# Issue d'une soumission d'avis : message flash et retour à la page pour un
+# invité, JSON avec un code explicite pour un follower qui transmet l'avis
+def review_result(listing, message, status):
+    if request.accept_mimetypes.best == 'application/json':
+        if status == 201:
+            return jsonify({'published': True}), 201
+        return jsonify({'error': message}), status
+    flash(message, 'success' if status == 201 else 'error')
+    return redirect_to_listing(listing)
+
+# Vote « utile » d'un invité sur un avis (un seul par invité et par avis)
+@app.route('/reviews/<int:review_id>/helpful', methods=['POST'])
+def helpful_vote(review_id):
+    return submit_helpful_vote(default_listing, review_id)
+
+@app.route('/l/<slug>/reviews/<int:review_id>/helpful', methods=['POST'])
+def listing_helpful_vote(slug, review_id):
+    return submit_helpful_vote(get_listing(slug), review_id)
+
+def submit_helpful_vote(listing, review_id):
+    if review_id >= len(listing.store.load()):
+        abort(404)
+    votes = helpful_votes.counter(listing.store)
+    accepted = votes.vote(review_id, get_guest_id())
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'id': review_id, 'helpful': votes.count(review_id), 'accepted': accepted})
+    if not accepted:
+        flash("Vous avez déjà trouvé cet avis utile.", 'error')
+    query = '?sort=helpful' if request.args.get('sort') == 'helpful' else ''
+    return redirect(f"{listing_url(listing)}{query}#avis-{review_id}")
+
+# Démarrer les threads d'arrière-plan du worker dès sa première requête (après
+# le fork) : la file de tâches reprend alors celles restées en attente, et les
+# compteurs de votes sont écrits périodiquement
+@app.before_request
+def start_background_work():
+    jobs.start()
+    helpful_votes.start()
+
+# Confier le reste du traitement des nouveaux avis à la file de tâches
+def enqueue_review_jobs(listing, image_paths):
+    payload = {'listing': listing.slug}
+    tasks = [('rollups', payload), ('warm', payload)]
+    tasks += [('thumbnail', dict(payload, image=image_path)) for image_path in image_paths]
+    if publisher is not None:
+        tasks.append(('publish', payload))
+    if image_paths and storage.needs_reclaim():
+        tasks.append(('storage', None))
+    jobs.enqueue_many(tasks)
+
+# Transmettre un avis au writer (serveur follower)
+def forward_review(listing, name, rating, comment, image_path):
+    files = []
+    if image_path:
+        # La photo est renvoyée au writer, la copie locale arrivera par la réplication
+        local_path = image_path.lstrip('/')
+        with open(local_path, 'rb') as f:
+            # Le writer ajoute son propre horodatage (et suffixe) au nom
+            original_name = re.sub(r'^\d{8}_\d{6}_(?:[0-9a-f]{8}_)?', '', os.path.basename(local_path))
+            files.append(('image', original_name, f.read()))
+        os.unlink(local_path)
+    try:
+        with tripote_tracing.span('replication.forward'):
+            status, error = follower.forward(listing.slug, {'name': name, 'rating': rating, 'comment': comment},
+                                             files, client_ip=request.remote_addr)
+    except OSError as e:
+        app.logger.warning(f"transmission de l'avis au writer impossible : {e}")
+        status, error = None, None
+    if status != 201:
+        if status is not None:
+            app.logger.warning(f"avis refusé par le writer ({status}) : {error}")
+        flash(error or "Le serveur principal n'a pas pu enregistrer votre avis, réessayez dans un instant.", 'error')
+        return redirect_to_listing(listing)
+    # Relire le journal du writer pour que l'invité voie son avis tout de suite
+    try:
+        follower.sync(listing.slug)
+    except Exception:
+        follower.wake()
+    flash('Votre avis a été publié avec succès!', 'success')
+    return redirect_to_listing(listing)
+
+# Lieu désigné par une tâche
+def job_listing(payload):
+    slug = payload.get('listing')
+    listing = find_listing(slug)
+    if listing is None:
+        raise LookupError(f"lieu inconnu: {slug}")
+    return listing
+
+# Tâche : intégrer les nouveaux avis aux agrégats horaires/journaliers
+def rollups_job(payload):
+    job_listing(payload).store.sync_rollups()
+
+# Tâche : recalculer les statistiques et la première page de l'API
+def warm_job(payload):
+    listing = job_listing(payload)
+    listing.store.stats()
+    per_page = tripote_api.DEFAULT_PER_PAGE
+    api_cache.get(listing.store, 'stats', (), lambda: tripote_api.stats_payload(listing.store))
+    api_cache.get(listing.store, 'reviews', (1, per_page),
+                  lambda: tripote_api.reviews_payload(listing.store, 1, per_page))
+    api_cache.get(listing.store, 'analytics', (), lambda: listing_analytics(listing))
+
+# Tâche : miniature de la photo jointe à un avis
+def thumbnail_job(payload):
+    from PIL import Image
+
+    if storage.shortfall():
+        # Plus de place : l'original reste affiché
+        return
+    source = payload['image'].lstrip('/')
+    target = thumbnail_path(payload['image'])
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as image:
+        image_format = image.format
+        image.thumbnail(THUMBNAIL_SIZE)
+        tmp_path = f"{target}.tmp"
+        image.save(tmp_path, format=image_format)
+    os.replace(tmp_path, target)
+    storage.added(target)
+
+# Page d'un lieu pour le mode publication (page=None : index avec les derniers avis)
+def render_published_page(listing, reviews, page, pages):
+    server_url = get_server_url(listing)
+    if page is None:
+        stats = listing.store.stats()
+        pagination = None
+        if stats['count'] > len(reviews):
+            pagination = {'next': f"avis/page-{pages}.html", 'next_label': "Tous les avis"}
     else:
-        flash('Veuillez remplir tous les champs obligatoires.', 'error')
+        stats = None
+        pagination = {
+            'page': page,
+            'previous': f"page-{page - 1}.html" if page > 1 else None,
+            'next': f"page-{page + 1}.html" if page < pages else '../',
+            'next_label': "Avis suivants" if page < pages else "Retour à la fiche",
+        }
+    with app.test_request_context('/'):
+        return render_template(get_template(), listing=listing, reviews=reviews, stats=stats,
+                               qr_code=generate_qr_code(server_url), server_url=server_url,
+                               pagination=pagination)
+
+# Documents JSON refaits à chaque publication
+def published_documents(listing):
+    return {'stats': listing.store.stats(), 'stats-extended': listing_analytics(listing)}
+
+# Version du rendu : tout est republié si le gabarit, la fiche ou les ressources changent
+def published_version(listing):
+    parts = (HTML_TEMPLATE, json.dumps(listing.meta, sort_keys=True), json.dumps(get_asset_manifest(), sort_keys=True),
+             get_server_url(listing))
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=8).hexdigest()
+
+publisher = None
+if PUBLISH_DIR:
+    publisher = tripote_publish.Publisher(PUBLISH_DIR, render_published_page, documents=published_documents,
+                                          version=published_version, per_page=PUBLISH_PER_PAGE)
+
+# Fichier publié d'un lieu, servi avec sendfile (None s'il n'existe pas encore)
+def published_file(listing, filename):
+    directory = os.path.abspath(publisher.listing_dir(listing))
+    if not os.path.isfile(os.path.join(directory, filename)):
+        return None
+    return send_from_directory(directory, filename, max_age=0)
+
+# Pages d'avis et documents JSON publiés
+@app.route('/avis/<filename>')
+def published_page(filename):
+    return published_listing_file(default_listing, 'avis', filename)
+
+@app.route('/l/<slug>/avis/<filename>')
+def listing_published_page(slug, filename):
+    return published_listing_file(get_listing(slug), 'avis', filename)
+
+@app.route('/json/<filename>')
+def published_json(filename):
+    return published_listing_file(default_listing, 'json', filename)
+
+@app.route('/l/<slug>/json/<filename>')
+def listing_published_json(slug, filename):
+    return published_listing_file(get_listing(slug), 'json', filename)
+
+def published_listing_file(listing, folder, filename):
+    if publisher is None:
+        abort(404)
+    response = published_file(listing, os.path.join(folder, secure_filename(filename)))
+    if response is None:
+        abort(404)
+    return response
+
+# Tâche : libérer de la place dans le dossier des photos
+def storage_job(payload):
+    storage.reclaim()
+
+# Tâche : régénérer les pages statiques d'un lieu
+def publish_job(payload):
+    publisher.publish(job_listing(payload))
+
+jobs.register('rollups', rollups_job)
+jobs.register('warm', warm_job)
+jobs.register('thumbnail', thumbnail_job)
+jobs.register('publish', publish_job)
+jobs.register('storage', storage_job)
+
+# Avis reçus du writer : récupérer leurs photos puis lancer les tâches habituelles
+def replicated_reviews(listing, reviews):
+    image_paths = []
+    for review in reviews:
+        image_path = review.get('image')
+        if not image_path:
+            continue
+        local_path = os.path.normpath(image_path.lstrip('/'))
+        if not tripote_store.image_in_folder(image_path, listing.upload_folder):
+            app.logger.warning(f"photo répliquée hors du dossier du lieu ignorée : {image_path}")
+            continue
+        if not os.path.exists(local_path):
+            try:
+                storage.reserve(0)
+                follower.download(image_path, local_path)
+            except (OSError, tripote_storage.StorageFull) as e:
+                app.logger.warning(f"photo {image_path} non récupérée : {e}")
+                continue
+            storage.added(local_path)
+        image_paths.append(image_path)
+    enqueue_review_jobs(listing, image_paths)
+
+# En-tête des avis d'un lieu (None s'il n'existe pas), sans le charger dans le LRU
+def listing_head(slug):
+    listing = default_listing if slug is None else listings.peek(slug)
+    return listing.store.head() if listing is not None else None
+
+# En-têtes de tous les lieux {'' ou slug: {'seq': ..., 'last': ...}}
+def listing_heads():
+    heads = {'': listing_head(None)}
+    for slug in listings.slugs():
+        head = listing_head(slug)
+        if head is not None:
+            heads[slug] = head
+    return heads
+
+# Ce serveur suit le writer si TRIPOTE_WRITER_URL est défini
+follower = None
+if WRITER_URL:
+    follower = tripote_replication.Follower(WRITER_URL, token=REPLICATION_TOKEN, interval=REPLICATION_INTERVAL,
+                                            resolve=find_listing, head=listing_head,
+                                            on_applied=replicated_reviews, log=app.logger.warning)
+
+# Requête venant d'un autre serveur Tripote Visor (jeton de réplication valide)
+def is_replication_request():
+    return bool(REPLICATION_TOKEN) and \
+        secrets.compare_digest(request.headers.get(tripote_replication.TOKEN_HEADER, ''), REPLICATION_TOKEN)
+
+# En-têtes de tous les lieux, interrogés par les followers à chaque tour
+@app.route('/replication/heads')
+def replication_heads():
+    if REPLICATION_TOKEN and not is_replication_request():
+        abort(403)
+    return jsonify({'listings': listing_heads()})
+
+# Journal de modifications lu par les followers
+@app.route('/replication/changes')
+def replication_changes():
+    return listing_replication_changes(default_listing)
+
+@app.route('/l/<slug>/replication/changes')
+def listing_replication_changes_route(slug):
+    return listing_replication_changes(get_listing(slug))
+
+def listing_replication_changes(listing):
+    if REPLICATION_TOKEN and not is_replication_request():
+        abort(403)
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', tripote_replication.DEFAULT_BATCH, type=int), 1),
+                tripote_replication.MAX_BATCH)
+    try:
+        payload = tripote_replication.changes_payload(listing.store, since, request.args.get('last'), limit)
+    except tripote_replication.ResyncRequired as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(tripote_api.dumps(payload), mimetype='application/json')
+
+# Démarrer la synchronisation avec le writer au premier accès
+@app.before_request
+def start_follower():
+    if follower is not None:
+        follower.start()
+
+# Adresse de la page d'un lieu
+def listing_url(listing):
+    if listing.slug:
+        return url_for('listing_index', slug=listing.slug)
+    return url_for('index')
+
+def redirect_to_listing(listing):
+    return redirect(listing_url(listing))
+
+# Réponse JSON d'erreur pour le protocole d'envoi par morceaux
+@app.errorhandler(tripote_uploads.UploadError)
+def upload_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+# Ouvrir un envoi par morceaux : {"filename": ..., "size": ..., "sha256": optionnel}
+@app.route('/uploads', methods=['POST'])
+def upload_init():
+    data = request.get_json(silent=True) or {}
+    try:
+        storage.reserve(data.get('size') if isinstance(data.get('size'), int) else 0)
+    except tripote_storage.StorageFull as e:
+        refund_rate_limits(g.pop('rate_limit_charges', []))
+        raise tripote_uploads.UploadError(str(e), 507)
+    status = chunked_uploads.init(data.get('filename'), data.get('size'), get_guest_id(),
+                                  ALLOWED_EXTENSIONS, sha256=data.get('sha256'))
+    return jsonify(status), 201
+
+# Offset courant d'un envoi, pour reprendre après une coupure
+@app.route('/uploads/<upload_id>')
+def upload_status(upload_id):
+    return jsonify(chunked_uploads.status(upload_id, get_guest_id()))
+
+# Ajouter un morceau : PUT /uploads/<id>?offset=N, en-tête X-Chunk-Sha256 optionnel
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        raise tripote_uploads.UploadError("offset manquant")
+    length = request.content_length
+    if length is None or length > UPLOAD_CHUNK_SIZE:
+        raise tripote_uploads.UploadError("morceau trop volumineux ou sans Content-Length", 413)
+    status = chunked_uploads.append(upload_id, get_guest_id(), offset, request.get_data(cache=False),
+                                    chunk_sha256=request.headers.get('X-Chunk-Sha256'))
+    return jsonify(status)
+
+# Terminer un envoi ; la photo est jointe à l'avis via le champ upload_id
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def upload_finalize(upload_id):
+    return jsonify(chunked_uploads.finalize(upload_id, get_guest_id()))
+
+# Seaux à jetons partagés entre workers (créés au premier usage, après le fork)
+@lru_cache(maxsize=1)
+def get_rate_limiters():
+    submissions = tripote_ratelimit.SharedTokenBuckets(
+        os.path.join(RATE_LIMIT_DIR, 'ratelimit-submissions.bin'),
+        *tripote_ratelimit.parse_rate(RATE_LIMIT_SUBMISSIONS))
+    upload_bytes = tripote_ratelimit.SharedTokenBuckets(
+        os.path.join(RATE_LIMIT_DIR, 'ratelimit-upload.bin'),
+        *tripote_ratelimit.parse_rate(RATE_LIMIT_UPLOAD_BYTES))
+    return submissions, upload_bytes
+
+@lru_cache(maxsize=1)
+def get_vote_limiter():
+    return tripote_ratelimit.SharedTokenBuckets(os.path.join(RATE_LIMIT_DIR, 'ratelimit-votes.bin'),
+                                                *tripote_ratelimit.parse_rate(RATE_LIMIT_VOTES))
+
+# Signature d'un identifiant d'invité : le cookie ne peut pas être forgé
+def sign_guest_id(guest_id):
+    key = app.secret_key.encode('utf-8')
+    return hmac.new(key, guest_id.encode('utf-8'), hashlib.blake2b).hexdigest()[:24]
+
+# Identifiant d'invité du cookie, s'il a bien été émis par le serveur
+def cookie_guest_id():
+    guest_id, _, signature = request.cookies.get(GUEST_COOKIE, '').rpartition('.')
+    if guest_id and hmac.compare_digest(signature, sign_guest_id(guest_id)):
+        return guest_id
+    return None
+
+# Identifiant de l'invité, créé s'il n'a pas encore de cookie valide
+def get_guest_id():
+    guest_id = cookie_guest_id()
+    if not guest_id:
+        if 'new_guest_id' not in g:
+            g.new_guest_id = secrets.token_urlsafe(12)
+        guest_id = g.new_guest_id
+    return guest_id
+
+# Clés utilisées pour limiter le débit d'un client [(clé, part du coût), ...]
+def rate_limit_keys():
+    if is_replication_request() and request.headers.get('X-Forwarded-For'):
+        # Avis transmis par un follower : la limite s'applique à l'invité d'origine
+        return [(f"ip:{request.headers['X-Forwarded-For'].split(',')[0].strip()}", 1)]
+    ip_key = f"ip:{request.remote_addr}"
+    guest_id = cookie_guest_id() if RATE_LIMIT_KEY == 'guest' else None
+    if guest_id:
+        # Changer de cookie ne contourne pas la limite : l'IP garde un budget
+        # partagé par RATE_LIMIT_GUESTS_PER_IP invités
+        return [(f"guest:{guest_id}", 1), (ip_key, 1 / RATE_LIMIT_GUESTS_PER_IP)]
+    return [(ip_key, 1)]
+
+# Prendre `amount` unités dans chaque seau ; rien n'est pris si l'un refuse
+def take_rate_limits(charges):
+    taken = []
+    for buckets, key, amount in charges:
+        allowed, retry_after = buckets.take(key, amount)
+        if not allowed:
+            refund_rate_limits(taken)
+            return False, retry_after
+        taken.append((buckets, key, amount))
+    return True, 0
+
+def refund_rate_limits(charges):
+    for buckets, key, amount in charges:
+        buckets.refund(key, amount)
+
+# Refuser les soumissions trop fréquentes avant de lire le corps de la requête
+@app.before_request
+def limit_submissions():
+    counts_submission = request.method == 'POST' and request.endpoint in RATE_LIMITED_ENDPOINTS
+    if not counts_submission and request.endpoint not in UPLOAD_LIMITED_ENDPOINTS:
+        return None
+    submissions, upload_bytes = get_rate_limiters()
+    keys = rate_limit_keys()
+    # Sans Content-Length, on compte la taille maximale autorisée
+    length = request.content_length
+    if length is None:
+        length = app.config['MAX_CONTENT_LENGTH']
+
+    charges = [(upload_bytes, key, length * share) for key, share in keys]
+    if counts_submission:
+        charges = [(submissions, key, share) for key, share in keys] + charges
+    allowed, retry_after = take_rate_limits(charges)
+    if allowed:
+        # Rendus si la requête est finalement refusée faute de place
+        g.rate_limit_charges = charges
+        return None
+    # Connection: close pour ne pas avoir à lire le corps refusé
+    if retry_after is None:
+        return Response("Fichier trop volumineux.", 413, headers={'Connection': 'close'})
+    return Response("Trop de requêtes, réessayez dans quelques instants.", 429,
+                    headers={'Retry-After': str(math.ceil(retry_after)), 'Connection': 'close'})
+
+# Limiter les votes « utile » par IP
+@app.before_request
+def limit_votes():
+    if request.method != 'POST' or request.endpoint not in VOTE_LIMITED_ENDPOINTS:
+        return None
+    allowed, retry_after = get_vote_limiter().take(f"ip:{request.remote_addr}")
+    if allowed:
+        return None
+    return Response("Trop de votes, réessayez dans quelques instants.", 429,
+                    headers={'Retry-After': str(math.ceil(retry_after or 0))})
+
+# Vérifier la place pour la photo d'un avis sur le Content-Length annoncé (qui
+# majore sa taille), avant que le corps ne soit lu ; un avis sans photo passe
+@app.before_request
+def reserve_photo_space():
+    if request.method != 'POST' or request.endpoint not in REVIEW_ENDPOINTS:
+        return None
+    length = request.content_length
+    if length is None:
+        length = app.config['MAX_CONTENT_LENGTH']
+    if length <= TEXT_REVIEW_MAX_BYTES:
+        return None
+    try:
+        storage.reserve(length)
+    except tripote_storage.StorageFull:
+        # L'avis n'est pas enregistré : il ne compte pas dans le budget du client
+        refund_rate_limits(g.pop('rate_limit_charges', []))
+        listing = find_listing((request.view_args or {}).get('slug'))
+        if listing is None:
+            abort(404)
+        response = app.make_response(review_result(
+            listing, "Plus de place pour les photos sur le serveur : publiez votre avis sans photo.", 507))
+        # Connection: close pour ne pas avoir à lire le corps refusé
+        response.headers['Connection'] = 'close'
+        return response
+    return None
+
+# Donner un cookie invité aux nouveaux visiteurs
+@app.after_request
+def set_guest_cookie(response):
+    if not cookie_guest_id():
+        guest_id = get_guest_id()
+        response.set_cookie(GUEST_COOKIE, f"{guest_id}.{sign_guest_id(guest_id)}", max_age=365 * 24 * 3600,
+                            httponly=True, samesite='Lax')
+    return response
+
+# Vérifier l'accès aux routes d'administration
+def require_admin():
+    if ADMIN_TOKEN:
+        # En-tête uniquement : un jeton dans l'URL finirait dans les journaux d'accès
+        if not secrets.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+
+EXPORT_MIMETYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'tar': 'application/x-tar',
+}
+
+# Générateur d'export selon le format demandé
+def export_stream(fmt, listing):
+    path, reader, _ = listing.store.io()
+    if fmt == 'jsonl':
+        return (chunk.encode('utf-8') for chunk in tripote_store.export_jsonl(path, reader=reader))
+    if fmt == 'csv':
+        return (chunk.encode('utf-8') for chunk in tripote_store.export_csv(path, reader=reader))
+    if fmt == 'tar':
+        return tripote_store.export_tar(path, listing.upload_folder, reader=reader)
+    raise ValueError(f"format inconnu: {fmt}")
+
+# Import selon le format, depuis un flux binaire
+def import_stream(fmt, binary_stream, listing):
+    if fmt == 'tar':
+        return listing.store.rewrite(lambda path, reader, writer: tripote_store.import_tar(
+            path, binary_stream, generate_review_title, listing.upload_folder, reader=reader, writer=writer,
+            storage=storage))
+    if fmt == 'jsonl':
+        records = tripote_store.iter_jsonl(binary_stream)
+    elif fmt == 'csv':
+        records = tripote_store.iter_csv(tripote_store.text_stream(binary_stream))
+    else:
+        raise ValueError(f"format inconnu: {fmt}")
+    return listing.store.rewrite(lambda path, reader, writer: tripote_store.import_reviews(
+        path, records, generate_review_title, reader=reader, writer=writer, upload_folder=listing.upload_folder))
+
+# Export en masse des avis (flux JSONL, CSV ou tar avec images)
+@app.route('/admin/export')
+def admin_export():
+    require_admin()
+    listing = get_listing(request.args.get('listing'))
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in EXPORT_MIMETYPES:
+        abort(400)
+    filename = 'reviews.tar' if fmt == 'tar' else f'reviews.{fmt}'
+    return Response(export_stream(fmt, listing), mimetype=EXPORT_MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+# Import en masse des avis, le corps de la requête est lu en flux
+@app.route('/admin/import', methods=['POST'])
+def admin_import():
+    require_admin()
+    if follower is not None:
+        return jsonify({'error': "ce serveur est un follower : importez les avis sur le writer"}), 409
+    listing = get_listing(request.args.get('listing'))
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in EXPORT_MIMETYPES:
+        abort(400)
+    # Pas de limite de 16 Mo pour un import, le corps n'est jamais chargé en entier
+    request.max_content_length = None
+    try:
+        stats = import_stream(fmt, request.stream, listing)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    enqueue_review_jobs(listing, [])
+    return jsonify(stats)
+
+# Photo locale demandée sur /static/uploads/... (None pour les autres fichiers)
+def requested_upload():
+    if request.endpoint != 'static' or not request.view_args:
+        return None
+    path = os.path.normpath(os.path.join(os.path.relpath(app.static_folder), request.view_args['filename']))
+    if not path.startswith(os.path.normpath(UPLOAD_FOLDER) + os.sep):
+        return None
+    return path
+
+# Photo déplacée vers le stockage secondaire : servie depuis celui-ci
+@app.before_request
+def serve_cold_upload():
+    path = requested_upload()
+    if path is None or os.path.exists(path):
+        return None
+    cold_path = storage.find_cold(path)
+    if cold_path is None:
+        return None
+    return send_from_directory(os.path.abspath(os.path.dirname(cold_path)), os.path.basename(cold_path))
+
+# Noter le dernier service de chaque photo (les moins servies sont nettoyées d'abord)
+@app.after_request
+def touch_upload(response):
+    if response.status_code in (200, 206, 304):
+        path = requested_upload()
+        if path is not None:
+            storage.touch(path)
+    return response
+
+# Budget disque des photos : occupation, variantes, dernier nettoyage
+@app.route('/admin/storage')
+def admin_storage():
+    require_admin()
+    return jsonify(storage.status())
+
+# Libérer de la place tout de suite
+@app.route('/admin/storage/reclaim', methods=['POST'])
+def admin_storage_reclaim():
+    require_admin()
+    return jsonify(storage.reclaim(request.args.get('bytes', type=int)))
+
+# État de la file de tâches
+@app.route('/admin/jobs')
+def admin_jobs():
+    require_admin()
+    return jsonify(jobs.summary())
+
+# État d'une tâche
+@app.route('/admin/jobs/<job_id>')
+def admin_job(job_id):
+    require_admin()
+    job = jobs.status(secure_filename(job_id))
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+# État de la réplication : retard de chaque lieu (follower) ou séquence (writer)
+@app.route('/admin/replication')
+def admin_replication():
+    require_admin()
+    if follower is not None:
+        return jsonify(follower.status())
+    return jsonify({'role': 'writer', 'listings': listing_heads()})
+
+@app.errorhandler(tripote_memory.DiagnosticsError)
+def memory_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+# Mémoire occupée par les caches et les stockages de l'application
+def memory_breakdown():
+    stores = {listing.slug or '': listing.store.usage() for listing in [default_listing] + listings.loaded()}
+    qr_cache = generate_qr_code.cache_info()
+    return {
+        'stores': stores,
+        'stores_total': sum(usage['memory'] for usage in stores.values()),
+        'listings': listings.usage(),
+        'snapshots': tripote_snapshot.cache_usage(),
+        'api_cache': api_cache.usage(),
+        'qr_cache': {'entries': qr_cache.currsize, 'max_entries': qr_cache.maxsize,
+                     'hits': qr_cache.hits, 'misses': qr_cache.misses},
+        'templates': {'compiled': get_template.cache_info().currsize, 'jinja_cache': len(app.jinja_env.cache or ())},
+        'partial_uploads': chunked_uploads.usage(),
+    }
 
-    return redirect(url_for('index'))
+# État de tracemalloc, mémoire du processus et des caches de l'application
+@app.route('/admin/memory')
+def admin_memory():
+    require_admin()
+    return jsonify(dict(memory.status(), app=memory_breakdown()))
+
+# Démarrer tracemalloc : POST /admin/memory/start?frames=10
+@app.route('/admin/memory/start', methods=['POST'])
+def admin_memory_start():
+    require_admin()
+    return jsonify(memory.start(request.args.get('frames', tripote_memory.DEFAULT_FRAMES, type=int)))
+
+@app.route('/admin/memory/stop', methods=['POST'])
+def admin_memory_stop():
+    require_admin()
+    return jsonify(memory.stop())
+
+# Prendre (POST) ou oublier (DELETE) un instantané nommé
+@app.route('/admin/memory/snapshots/<name>', methods=['POST', 'DELETE'])
+def admin_memory_snapshot(name):
+    require_admin()
+    if request.method == 'DELETE':
+        memory.drop(name)
+        return jsonify(memory.status())
+    return jsonify(memory.snapshot(name))
+
+# Principaux sites d'allocation : /admin/memory/top?snapshot=avant&limit=20&key=lineno
+# (sans snapshot : état actuel)
+@app.route('/admin/memory/top')
+def admin_memory_top():
+    require_admin()
+    return jsonify(memory.top(request.args.get('snapshot') or None,
+                              limit=request.args.get('limit', tripote_memory.DEFAULT_LIMIT, type=int),
+                              key_type=request.args.get('key', 'lineno')))
+
+# Différence entre deux instantanés : /admin/memory/diff?from=avant&to=apres
+# (sans to : comparaison avec l'état actuel)
+@app.route('/admin/memory/diff')
+def admin_memory_diff():
+    require_admin()
+    old = request.args.get('from')
+    if not old:
+        abort(400)
+    return jsonify(memory.diff(old, request.args.get('to') or None,
+                               limit=request.args.get('limit', tripote_memory.DEFAULT_LIMIT, type=int),
+                               key_type=request.args.get('key', 'lineno')))
+
+# Lieu désigné par l'option --listing d'une commande
+def cli_listing(slug):
+    if slug is None:
+        return default_listing
+    listing = listings.get(slug)
+    if listing is None:
+        raise click.ClickException(f"lieu inconnu: {slug}")
+    return listing
+
+# Commande : flask --app tripote_visor_server export-reviews -f jsonl -o sauvegarde.jsonl
+@app.cli.command('export-reviews')
+@click.option('-f', '--format', 'fmt', type=click.Choice(sorted(EXPORT_MIMETYPES)), default='jsonl')
+@click.option('-o', '--output', type=click.File('wb'), default='-')
+@click.option('-l', '--listing', 'slug', default=None, help="Lieu (par défaut le lieu principal)")
+def export_reviews_command(fmt, output, slug):
+    for chunk in export_stream(fmt, cli_listing(slug)):
+        output.write(chunk)
+
+# Commande : flask --app tripote_visor_server import-reviews -f csv avis.csv
+@app.cli.command('import-reviews')
+@click.option('-f', '--format', 'fmt', type=click.Choice(sorted(EXPORT_MIMETYPES)), default='jsonl')
+@click.option('-l', '--listing', 'slug', default=None, help="Lieu (par défaut le lieu principal)")
+@click.argument('source', type=click.File('rb'), default='-')
+def import_reviews_command(fmt, source, slug):
+    stats = import_stream(fmt, source, cli_listing(slug))
+    click.echo(f"{stats['imported']} avis importés, {stats['rejected']} rejetés, {stats['total']} au total")
+    for error in stats['errors']:
+        click.echo(f"  - {error}", err=True)
+
+# Commande : convertir reviews.json en snapshot binaire
+@app.cli.command('snapshot-build')
+@click.option('-i', '--source', default=REVIEWS_FILE, show_default=True)
+@click.option('-o', '--output', default='reviews.snap', show_default=True)
+def snapshot_build_command(source, output):
+    count = tripote_snapshot.write_snapshot(output, tripote_store.iter_reviews_file(source))
+    click.echo(f"{count} avis écrits dans {output}")
+
+# Commande : reconvertir un snapshot binaire en reviews.json
+@app.cli.command('snapshot-dump')
+@click.option('-i', '--source', default='reviews.snap', show_default=True)
+@click.option('-o', '--output', default=REVIEWS_FILE, show_default=True)
+def snapshot_dump_command(source, output):
+    count = tripote_store.write_reviews_file(output, tripote_snapshot.iter_snapshot_file(source))
+    click.echo(f"{count} avis écrits dans {output}")
+
+# Commande : mesurer le chargement du stockage (JSON, snapshot et colonnes)
+@app.cli.command('bench-store')
+@click.option('-n', '--count', default=100000, show_default=True, help="Nombre d'avis générés")
+@click.option('-r', '--repeat', default=5, show_default=True)
+def bench_store_command(count, repeat):
+    import tempfile
+    import time
+
+    def measure(label, func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        click.echo(f"{label:<32} {min(timings) * 1000:10.2f} ms")
+
+    reviews = ({
+        'name': f"Invité {i}",
+        'rating': i % 5 + 1,
+        'comment': "Super séjour, très bien situé et propre. " * 3,
+        'title': generate_review_title(i % 5 + 1),
+        'date': '14/07/2024 22:30',
+        'image': None
+    } for i in range(count))
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'reviews.json')
+        snap_path = os.path.join(directory, 'reviews.snap')
+        tripote_store.write_reviews_file(json_path, reviews)
+        tripote_snapshot.write_snapshot(snap_path, tripote_store.iter_reviews_file(json_path))
+        click.echo(f"{count} avis, JSON {os.path.getsize(json_path) // 1024} Ko, "
+                   f"snapshot {os.path.getsize(snap_path) // 1024} Ko")
+
+        def load_json():
+            with open(json_path) as f:
+                calculate_stats(json.load(f))
+
+        def open_snapshot():
+            with tripote_snapshot.ReviewSnapshot(snap_path) as snapshot:
+                calculate_stats(snapshot)
+                snapshot.page(0)
+
+        def load_columns():
+            columns = ColumnarReviews.from_reviews(tripote_store.iter_reviews_file(json_path))
+            calculate_stats(columns)
+            columns[0:tripote_api.DEFAULT_PER_PAGE]
+
+        measure("json.load + stats", load_json)
+        measure("snapshot open + stats + page", open_snapshot)
+        measure("colonnes + stats + page", load_columns)
+
+        # Mémoire par avis : liste de dict contre colonnes compactes
+        with open(json_path) as f:
+            as_dicts = json.load(f)
+        columns = ColumnarReviews.from_reviews(as_dicts)
+        click.echo(f"mémoire par avis : dict {tripote_store.reviews_memory_size(as_dicts) / count:.0f} o, "
+                   f"colonnes {columns.memory_per_review():.0f} o")
+
+# Commande : statistiques détaillées de tous les lieux d'un coup
+@app.cli.command('rating-analytics')
+@click.option('-l', '--listing', 'slugs', multiple=True, help="Lieu (par défaut tous les lieux)")
+def rating_analytics_command(slugs):
+    import time
+
+    named = {'': default_listing} if not slugs else {}
+    for slug in slugs or listings.slugs():
+        named[slug] = cli_listing(slug)
+    start = time.perf_counter()
+    results = tripote_analytics.batch_analytics({slug: listing.store.load() for slug, listing in named.items()},
+                                                prior_mean=PRIOR_MEAN, prior_weight=PRIOR_WEIGHT)
+    elapsed = time.perf_counter() - start
+    click.echo(json.dumps(results, indent=4, ensure_ascii=False))
+    numpy_state = "avec NumPy" if tripote_analytics._numpy() else "sans NumPy"
+    click.echo(f"{len(results)} lieu(x) en {elapsed * 1000:.1f} ms ({numpy_state})", err=True)
+
+# Commande : vérifier le temps d'import du serveur avec python -X importtime
+@app.cli.command('check-imports')
+@click.option('--budget-ms', default=500.0, show_default=True, help="Temps d'import maximal")
+@click.option('--top', default=10, show_default=True)
+def check_imports_command(budget_ms, top):
+    import subprocess
+    import sys
+
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1])
+
+    # Lignes de la forme "import time:  self [us] | cumulative | module"
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    total_ms = sum(self_us for _, self_us, _ in timings) / 1000
+    click.echo(f"Import de {module}: {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+    for cumulative_us, _, name in sorted(timings, reverse=True)[:top]:
+        click.echo(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    loaded = {name.strip().split('.')[0] for _, _, name in timings}
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        raise click.ClickException(f"modules importés au démarrage: {', '.join(eager)}")
+    if total_ms > budget_ms:
+        raise click.ClickException(f"temps d'import au-delà du budget ({total_ms:.1f} ms)")
+
+# Commande : copier Font Awesome et les photos de la galerie pour un usage hors ligne
+@app.cli.command('vendor-assets')
+def vendor_assets_command():
+    # Icônes du template et des fiches de tous les lieux
+    icon_texts = [HTML_TEMPLATE]
+    for listing in [default_listing] + [listings.get(slug) for slug in listings.slugs()]:
+        icon_texts.extend(f"fa-{icon}" for icon, _ in listing.amenities)
+    try:
+        manifest = tripote_assets.vendor_assets(VENDOR_DIR, icon_texts, log=click.echo)
+    except OSError as e:
+        raise click.ClickException(f"téléchargement impossible : {e}")
+    get_asset_manifest.cache_clear()
+    click.echo(f"{len(manifest)} ressources copiées dans {VENDOR_DIR}")
+
+# Commande : supprimer les envois de photos abandonnés
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    removed = chunked_uploads.gc()
+    click.echo(f"{removed} envoi(s) abandonné(s) supprimé(s)")
+
+# Commande : occupation du dossier des photos, et nettoyage avec --reclaim
+@app.cli.command('storage')
+@click.option('--reclaim', is_flag=True, help="Libérer de la place selon le budget")
+def storage_command(reclaim):
+    if reclaim:
+        result = storage.reclaim()
+        click.echo(f"{result['freed'] // 1024} Ko libérés : {result['evicted']} variante(s) supprimée(s), "
+                   f"{result['recompressed']} original(aux) réduit(s), {result['moved']} déplacé(s)")
+    status = storage.status()
+    budget = f"{status['budget'] // (1024 * 1024)} Mo" if status['budget'] else "sans budget"
+    click.echo(f"{status['used'] // (1024 * 1024)} Mo utilisés ({budget}), "
+               f"{status['disk_free'] // (1024 * 1024)} Mo libres sur le disque")
+    click.echo(f"  originaux : {status['originals']['files']} fichier(s), {status['originals']['bytes'] // 1024} Ko")
+    click.echo(f"  variantes : {status['derived']['files']} fichier(s), {status['derived']['bytes'] // 1024} Ko")
+
+# Commande : publier les pages statiques (TRIPOTE_PUBLISH_DIR)
+@app.cli.command('publish')
+@click.option('-l', '--listing', 'slugs', multiple=True, help="Lieu (par défaut tous les lieux)")
+@click.option('--force', is_flag=True, help="Tout régénérer")
+def publish_command(slugs, force):
+    if publisher is None:
+        raise click.ClickException("définissez TRIPOTE_PUBLISH_DIR pour activer le mode publication")
+    targets = [cli_listing(slug) for slug in slugs] or \
+        [default_listing] + [cli_listing(slug) for slug in listings.slugs()]
+    for listing in targets:
+        written = publisher.publish(listing, force=force)
+        click.echo(f"{listing.slug or '(principal)'} : {len(written)} fichier(s) écrit(s) "
+                   f"dans {publisher.listing_dir(listing)}")
+
+# Commandes de diagnostic mémoire, envoyées au serveur en marche
+# (flask --app tripote_visor_server memory top --url http://127.0.0.1:3000)
+@app.cli.group('memory')
+@click.option('--url', default=lambda: f"http://127.0.0.1:{os.environ.get('PORT', 3000)}", show_default='local',
+              help="Adresse du serveur")
+@click.pass_context
+def memory_command(ctx, url):
+    ctx.obj = url.rstrip('/')
+
+def memory_request(url, path, method='GET', **params):
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    query = urllib.parse.urlencode({key: value for key, value in params.items() if value is not None})
+    headers = {'X-Admin-Token': ADMIN_TOKEN} if ADMIN_TOKEN else {}
+    http_request = urllib.request.Request(f"{url}/admin/memory{path}" + (f"?{query}" if query else ''),
+                                     headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(http_request, timeout=60) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.load(e).get('error', e.reason)
+        except ValueError:
+            message = e.reason
+        raise click.ClickException(f"{e.code} : {message}")
+    except OSError as e:
+        raise click.ClickException(f"serveur injoignable : {e}")
+
+def format_size(size):
+    for unit in ('o', 'Ko', 'Mo'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} Go"
+
+def echo_sites(result, diff=False):
+    for site in result['sites']:
+        where = f"{site['file']}:{site['line']}" if 'line' in site else site['file']
+        if diff:
+            click.echo(f"{format_size(site['size_diff']):>10} ({site['count_diff']:+d})  "
+                       f"{format_size(site['size']):>10}  {where}")
+        else:
+            click.echo(f"{format_size(site['size']):>10} {site['count']:>8}  {where}")
+        if site.get('code'):
+            click.echo(f"{'':>22}{site['code']}")
+    click.echo(f"pid {result['pid']}", err=True)
+
+@memory_command.command('status')
+@click.pass_obj
+def memory_status_command(url):
+    click.echo(json.dumps(memory_request(url, ''), indent=4, ensure_ascii=False))
+
+@memory_command.command('start')
+@click.option('-f', '--frames', default=tripote_memory.DEFAULT_FRAMES, show_default=True,
+              help="Appels gardés par allocation")
+@click.pass_obj
+def memory_start_command(url, frames):
+    status = memory_request(url, '/start', 'POST', frames=frames)
+    click.echo(f"tracemalloc démarré (pid {status['pid']}, {status['frames']} appel(s) par allocation)")
+
+@memory_command.command('stop')
+@click.pass_obj
+def memory_stop_command(url):
+    status = memory_request(url, '/stop', 'POST')
+    click.echo(f"tracemalloc arrêté (pid {status['pid']})")
+
+@memory_command.command('snapshot')
+@click.argument('name')
+@click.pass_obj
+def memory_snapshot_command(url, name):
+    result = memory_request(url, f"/snapshots/{name}", 'POST')
+    click.echo(f"instantané {name} : {format_size(result['size'])} suivis (pid {result['pid']})")
+
+@memory_command.command('top')
+@click.option('-s', '--snapshot', default=None, help="Instantané (par défaut l'état actuel)")
+@click.option('-n', '--limit', default=tripote_memory.DEFAULT_LIMIT, show_default=True)
+@click.option('-k', '--key', type=click.Choice(tripote_memory.KEY_TYPES), default='lineno', show_default=True)
+@click.pass_obj
+def memory_top_command(url, snapshot, limit, key):
+    result = memory_request(url, '/top', snapshot=snapshot, limit=limit, key=key)
+    click.echo(f"total suivi : {format_size(result['total'])}")
+    echo_sites(result)
+
+@memory_command.command('diff')
+@click.argument('old')
+@click.argument('new', required=False)
+@click.option('-n', '--limit', default=tripote_memory.DEFAULT_LIMIT, show_default=True)
+@click.option('-k', '--key', type=click.Choice(tripote_memory.KEY_TYPES), default='lineno', show_default=True)
+@click.pass_obj
+def memory_diff_command(url, old, new, limit, key):
+    result = memory_request(url, '/diff', **{'from': old, 'to': new, 'limit': limit, 'key': key})
+    click.echo(f"{old} -> {new or 'maintenant'} : {format_size(result['size_diff'])}")
+    echo_sites(result, diff=True)
+
+# Commande : créer un lieu servi sous /l/<slug>/
+@app.cli.command('create-listing')
+@click.argument('slug')
+@click.option('-t', '--title', required=True)
+@click.option('--location', default=None)
+def create_listing_command(slug, title, location):
+    meta = {'title': title, 'page_title': title}
+    if location:
+        meta['location'] = location
+    try:
+        listings.create(slug, meta)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Lieu créé : /l/{slug}/ (fiche dans {os.path.join(LISTINGS_DIR, slug, 'listing.json')})")
 
 if __name__ == '__main__':
+    import qrcode
+
     # Obtenir l'adresse IP locale correcte
-    ip_address = get_local_ip()
+    server_url = get_server_url()
     port = os.environ.get('PORT', 3000)
 
-    server_url = f"http://{ip_address}:{port}"
-
     print("=" * 60)
     print("Serveur Tripote Visor démarré!")
     print(f"URL du serveur: {server_url}")
@@ -1114,5 +2767,11 @@ if __name__ == '__main__':
     qr.add_data(server_url)
     qr.print_ascii(invert=True)
 
+    warm_up()
+    # Avec debug=True, ce bloc s'exécute aussi dans le processus du reloader,
+    # qui ne sert aucune requête : seul le processus servi prend les tâches
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        jobs.start()
+
     # Démarrer le serveur
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,372 @@
+# tripote_votes.py
+# Votes « utile » des invités sur les avis. Les votes sont bien plus fréquents
+# que les avis : ils ne réécrivent jamais reviews.json.
+#
+# Fichiers à côté des avis d'un lieu :
+#   reviews.votes        un compteur uint32 par avis (indice = position de l'avis)
+#   reviews.votes.bloom  filtre de Bloom des couples (invité, avis) déjà comptés
+#
+# En mémoire, les votes s'accumulent dans des compartiments (un verrou chacun,
+# choisis par l'indice de l'avis) et sont écrits par lots toutes les quelques
+# secondes : seuls les compteurs modifiés sont réécrits, sous flock, et les
+# votes des autres workers sont relus à cette occasion. Un filtre de Bloom
+# (1 Mio de bits par défaut, ~1 % de faux positifs à 100 000 votes) évite
+# de garder la liste des votants : un invité peut exceptionnellement voir son
+# vote refusé, jamais compté deux fois sur un même worker.
+#
+# L'ordre « les plus utiles » vient d'un index trié (votes décroissants, puis
+# ordre du fichier) tenu à jour à chaque vote. Le verrou de l'index couvre
+# aussi le passage des votes des compartiments vers `_flushing` puis vers les
+# compteurs écrits : un vote est toujours lu une fois, ni perdu ni compté deux
+# fois pendant une écriture.
+#
+# Un compteur n'est créé que pour voter ou trier, et vit aussi longtemps que
+# son lieu dans le LRU des lieux (HelpfulVotes.drop à l'éviction) ; le filtre
+# n'est lu qu'au premier vote. Les pages affichent sinon les votes écrits
+# (StoredVotes), sans rien garder en mémoire.
+import atexit
+import bisect
+import hashlib
+import os
+import threading
+from array import array
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_SHARDS = 16
+DEFAULT_BLOOM_BITS = 2 ** 20
+DEFAULT_BLOOM_HASHES = 7
+DEFAULT_FLUSH_INTERVAL = 5
+COUNTER = array('I').itemsize
+
+
+class _Shard:
+    __slots__ = ('lock', 'deltas', 'bloom_dirty')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deltas = {}
+        self.bloom_dirty = False
+
+
+def _locked_file(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    return fd
+
+
+def _counts(data):
+    counts = array('I')
+    counts.frombytes(data[:len(data) - len(data) % COUNTER])
+    return counts
+
+
+def _read_all(fd):
+    size = os.fstat(fd).st_size
+    return os.pread(fd, size, 0) if size else b''
+
+
+# Votes d'un lieu
+class VoteCounter:
+    def __init__(self, path, shards=DEFAULT_SHARDS, bloom_bits=DEFAULT_BLOOM_BITS,
+                 bloom_hashes=DEFAULT_BLOOM_HASHES):
+        self.path = path
+        self.bloom_path = f"{path}.bloom"
+        self._shards = [_Shard() for _ in range(shards)]
+        # Le filtre est découpé en un segment par compartiment
+        self._segment_bits = max(bloom_bits // shards // 8, 1) * 8
+        self._bloom_hashes = bloom_hashes
+        self._bloom_size = self._segment_bits // 8 * shards
+        # Lu au premier vote (None d'ici là)
+        self._bloom = None
+        self._bloom_lock = threading.Lock()
+        self._counts = array('I')
+        # Votes retirés des compartiments mais pas encore écrits
+        self._flushing = {}
+        self._flush_lock = threading.Lock()
+        # Protège l'index et le déplacement des votes entre compartiments,
+        # `_flushing` et `_counts` (pris avant le verrou d'un compartiment)
+        self._index_lock = threading.Lock()
+        self._index = []
+        self._indexed = {}
+        # (mtime, taille) de reviews.votes à la dernière lecture
+        self._stat = None
+        self._load()
+
+    def _shard(self, review_id):
+        return self._shards[review_id % len(self._shards)]
+
+    # Bits du couple (invité, avis) dans le segment de son compartiment
+    def _bits(self, guest_id, review_id):
+        digest = hashlib.blake2b(f"{guest_id}:{review_id}".encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        base = review_id % len(self._shards) * self._segment_bits
+        return [base + (h1 + i * h2) % self._segment_bits for i in range(self._bloom_hashes)]
+
+    def _get_bloom(self):
+        bloom = self._bloom
+        if bloom is None:
+            with self._bloom_lock:
+                if self._bloom is None:
+                    self._bloom = self._read_bloom()
+                bloom = self._bloom
+        return bloom
+
+    def _read_bloom(self):
+        bloom = bytearray(self._bloom_size)
+        if os.path.exists(self.bloom_path):
+            with open(self.bloom_path, 'rb') as f:
+                stored = f.read()
+            # Filtre d'une autre taille (configuration changée) : ignoré
+            if len(stored) == len(bloom):
+                bloom[:] = stored
+        return bloom
+
+    # Compter le vote d'un invité ; False s'il a déjà voté pour cet avis
+    def vote(self, review_id, guest_id):
+        shard = self._shard(review_id)
+        bits = self._bits(guest_id, review_id)
+        bloom = self._get_bloom()
+        with shard.lock:
+            if all(bloom[bit >> 3] & (1 << (bit & 7)) for bit in bits):
+                return False
+            for bit in bits:
+                bloom[bit >> 3] |= 1 << (bit & 7)
+            shard.deltas[review_id] = shard.deltas.get(review_id, 0) + 1
+            shard.bloom_dirty = True
+        self._reindex(review_id)
+        return True
+
+    def has_voted(self, review_id, guest_id):
+        bloom = self._get_bloom()
+        return all(bloom[bit >> 3] & (1 << (bit & 7)) for bit in self._bits(guest_id, review_id))
+
+    # Votes d'un avis (écrits ou non)
+    def count(self, review_id):
+        with self._index_lock:
+            return self._count(review_id)
+
+    # Sous le verrou de l'index
+    def _count(self, review_id):
+        written = self._counts[review_id] if review_id < len(self._counts) else 0
+        return written + self._flushing.get(review_id, 0) + self._shard(review_id).deltas.get(review_id, 0)
+
+    def _reindex(self, review_id):
+        with self._index_lock:
+            count = self._count(review_id)
+            previous = self._indexed.get(review_id)
+            if previous == count:
+                return
+            if previous:
+                position = bisect.bisect_left(self._index, (-previous, review_id))
+                if position < len(self._index) and self._index[position] == (-previous, review_id):
+                    del self._index[position]
+            if count:
+                bisect.insort(self._index, (-count, review_id))
+                self._indexed[review_id] = count
+            else:
+                self._indexed.pop(review_id, None)
+
+    def _rebuild_index(self):
+        with self._index_lock:
+            counts = {}
+            for review_id, count in enumerate(self._counts):
+                if count:
+                    counts[review_id] = count
+            for pending in [self._flushing] + [shard.deltas for shard in self._shards]:
+                for review_id, delta in list(pending.items()):
+                    counts[review_id] = counts.get(review_id, 0) + delta
+            self._index = sorted((-count, review_id) for review_id, count in counts.items() if count)
+            self._indexed = {review_id: count for review_id, count in counts.items() if count}
+
+    # Indices des avis, les plus utiles d'abord puis les autres dans l'ordre du fichier
+    def ordered(self, total):
+        with self._index_lock:
+            voted = [review_id for _, review_id in self._index if review_id < total]
+        yield from voted
+        voted = set(voted)
+        for review_id in range(total):
+            if review_id not in voted:
+                yield review_id
+
+    # Avis les plus utiles [(indice, votes), ...]
+    def top(self, limit=10):
+        with self._index_lock:
+            return [(review_id, -count) for count, review_id in self._index[:limit]]
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+                self._stat = os.fstat(f.fileno()).st_mtime_ns, len(data)
+            self._counts = _counts(data)
+        self._rebuild_index()
+
+    # Écrire les votes en attente et relire ceux des autres workers
+    def flush(self):
+        with self._flush_lock:
+            bloom_dirty = False
+            with self._index_lock:
+                for shard in self._shards:
+                    with shard.lock:
+                        deltas, shard.deltas = shard.deltas, {}
+                        bloom_dirty = bloom_dirty or shard.bloom_dirty
+                        shard.bloom_dirty = False
+                    for review_id, delta in deltas.items():
+                        self._flushing[review_id] = self._flushing.get(review_id, 0) + delta
+            if not self._flushing and not bloom_dirty and self._unchanged():
+                return 0
+            written = len(self._flushing)
+
+            fd = _locked_file(self.path)
+            try:
+                st = os.fstat(fd)
+                # Votes écrits par un autre worker depuis la dernière lecture
+                external = self._stat != (st.st_mtime_ns, st.st_size)
+                for review_id, delta in self._flushing.items():
+                    offset = review_id * COUNTER
+                    current = array('I', os.pread(fd, COUNTER, offset).ljust(COUNTER, b'\0'))
+                    current[0] = min(current[0] + delta, 2 ** 32 - 1)
+                    os.pwrite(fd, current.tobytes(), offset)
+                data = _read_all(fd)
+                self._stat = os.fstat(fd).st_mtime_ns, len(data)
+            finally:
+                os.close(fd)
+            counts = _counts(data)
+            with self._index_lock:
+                self._counts = counts
+                self._flushing = {}
+
+            # Filtre de Bloom (s'il a servi) : union avec celui des autres workers
+            if self._bloom is not None:
+                self._flush_bloom(bloom_dirty)
+            if external:
+                self._rebuild_index()
+            return written
+
+    def _flush_bloom(self, dirty):
+        bloom = self._bloom
+        fd = _locked_file(self.bloom_path)
+        try:
+            stored = _read_all(fd)
+            if len(stored) == len(bloom):
+                segment = self._segment_bits // 8
+                for number, shard in enumerate(self._shards):
+                    start, end = number * segment, (number + 1) * segment
+                    with shard.lock:
+                        merged = int.from_bytes(stored[start:end], 'little') \
+                            | int.from_bytes(bloom[start:end], 'little')
+                        bloom[start:end] = merged.to_bytes(segment, 'little')
+            if dirty or len(stored) != len(bloom):
+                os.pwrite(fd, bytes(bloom), 0)
+        finally:
+            os.close(fd)
+
+    # Le fichier n'a pas été modifié par un autre worker depuis la dernière lecture
+    def _unchanged(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return self._stat == (st.st_mtime_ns, st.st_size)
+
+
+# Votes écrits d'un lieu, lus d'un bloc pour afficher une page (sans compteur
+# en mémoire ni filtre de Bloom)
+class StoredVotes:
+    def __init__(self, path):
+        try:
+            with open(path, 'rb') as f:
+                self._counts = _counts(f.read())
+        except FileNotFoundError:
+            self._counts = array('I')
+
+    def count(self, review_id):
+        return self._counts[review_id] if review_id < len(self._counts) else 0
+
+
+# Avis dans l'ordre « les plus utiles », lus à la demande (chaque avis porte
+# son indice dans `id`)
+class HelpfulOrder:
+    def __init__(self, reviews, counter):
+        self.reviews = reviews
+        self.counter = counter
+
+    def __len__(self):
+        return len(self.reviews)
+
+    def __iter__(self):
+        for review_id in self.counter.ordered(len(self.reviews)):
+            yield dict(self.reviews[review_id], id=review_id)
+
+
+# Compteurs de tous les lieux, écrits par un thread toutes les `flush_interval` secondes
+class HelpfulVotes:
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, log=None, **options):
+        self.flush_interval = flush_interval
+        self.options = options
+        self.log = log or (lambda message: None)
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _path(store):
+        return os.path.splitext(store.path)[0] + '.votes'
+
+    # Compteur des votes d'un stockage d'avis (reviews.json -> reviews.votes),
+    # créé pour voter ou trier
+    def counter(self, store):
+        path = self._path(store)
+        with self._lock:
+            counter = self._counters.get(path)
+            if counter is None:
+                counter = self._counters[path] = VoteCounter(path, **self.options)
+        return counter
+
+    # Votes à afficher : le compteur s'il existe (votes pas encore écrits
+    # compris), sinon les votes écrits
+    def view(self, store):
+        path = self._path(store)
+        with self._lock:
+            counter = self._counters.get(path)
+        return counter if counter is not None else StoredVotes(path)
+
+    # Écrire puis oublier le compteur d'un stockage (lieu retiré du LRU)
+    def drop(self, store):
+        with self._lock:
+            counter = self._counters.pop(self._path(store), None)
+        if counter is not None:
+            try:
+                counter.flush()
+            except OSError as e:
+                self.log(f"votes : écriture de {counter.path} impossible : {e}")
+
+    def flush(self):
+        with self._lock:
+            counters = list(self._counters.values())
+        written = 0
+        for counter in counters:
+            try:
+                written += counter.flush()
+            except OSError as e:
+                self.log(f"votes : écriture de {counter.path} impossible : {e}")
+        return written
+
+    # Démarrer l'écriture périodique (à nouveau si le processus a été forké)
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="tripote-votes", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()